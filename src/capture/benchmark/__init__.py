@@ -0,0 +1,17 @@
+"""壓測
+
+壓測自己建立需要的訊息元件，匯入訊息模組時單例只建立不啟動
+不會去連線或佔用 master 的 port
+
+"""
+import os
+
+os.environ.setdefault('4DREC_TYPE', 'MASTER')
+
+from utility.mix_thread import MixThread  # noqa: E402
+
+MixThread.start = lambda self: None
+try:
+    import utility.message  # noqa: E402, F401
+finally:
+    del MixThread.start
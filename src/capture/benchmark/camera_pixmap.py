@@ -0,0 +1,117 @@
+"""預覽圖像轉換壓測
+
+比較 master 預覽每張圖像從 JPEG 到 UI 圖像與串流縮圖的舊流程與新流程
+舊流程: 解碼 BGR > cvtColor 成 RGB > np.copy > 對焦輔助與串流各自縮圖 > 轉回 BGR
+新流程: 直接解碼 RGB 到重複使用的陣列 > 對焦輔助與串流共用一張縮圖
+列出每張的耗時與配置的記憶體峰值
+在 capture 資料夾執行: python -m benchmark.camera_pixmap
+
+"""
+import timeit
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from utility.setting import setting
+from common.jpeg_coder import JpegProfile, TJPF_RGB
+
+KERNEL = np.ones((5, 5), np.uint8)
+
+
+def make_jpeg(profile, width, height):
+    """產生有邊緣的模擬相機圖像，讓對焦輔助有東西可以畫"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 3), np.uint8)
+    image = cv2.GaussianBlur(image, (0, 0), 3)
+    image = np.clip(image.astype(np.int16) * 4 - 300, 0, 255)
+    return profile.encode(image.astype(np.uint8))
+
+
+def convert_legacy(profile, jpeg, focus):
+    """舊的 CameraPixmap 流程，回傳 (UI 圖像, 串流縮圖)"""
+    im = profile.decode(jpeg)
+    buf = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+    buf = np.copy(buf)
+
+    _height, _width, _ = buf.shape
+    if focus:
+        sim = cv2.resize(buf, (int(_width / 2), int(_height / 2)))
+        edges = cv2.Canny(sim, 280, 380)
+        edges = cv2.dilate(edges, KERNEL)
+        edges = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+        edges *= np.array((1, 0, 0), np.uint8)
+        edges = cv2.resize(edges, (_width, _height))
+        buf = np.bitwise_or(buf, edges)
+    tm = cv2.resize(buf, (int(_width / 2), int(_height / 2)))
+    tm = cv2.cvtColor(tm, cv2.COLOR_RGB2BGR)
+    return buf, tm
+
+
+def convert(profile, jpeg, focus, allocate):
+    """新的 CameraPixmap 流程，回傳 (UI 圖像, 串流縮圖)"""
+    buf = profile.decode(jpeg, pixel_format=TJPF_RGB, allocate=allocate)
+
+    _height, _width, _ = buf.shape
+    half = cv2.resize(buf, (int(_width / 2), int(_height / 2)))
+    if focus:
+        edges = cv2.Canny(half, 280, 380)
+        edges = cv2.dilate(edges, KERNEL)
+        np.bitwise_or(half[..., 0], edges, out=half[..., 0])
+        edges = cv2.resize(edges, (_width, _height))
+        np.bitwise_or(buf[..., 0], edges, out=buf[..., 0])
+    return buf, half
+
+
+def measure_peak(func):
+    """執行一次並回傳配置的記憶體峰值 (MB)"""
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+def bench(profile, jpeg, focus, number):
+    # 重複使用的輸出陣列，相當於 CameraImageBuffers 一直有可用的陣列
+    buffers = {}
+
+    def allocate(shape):
+        if shape not in buffers:
+            buffers[shape] = np.empty(shape, np.uint8)
+        return buffers[shape]
+
+    # 兩個流程的 UI 圖像要一樣
+    legacy_image, _ = convert_legacy(profile, jpeg, focus)
+    image, _ = convert(profile, jpeg, focus, allocate)
+    if not np.array_equal(legacy_image, image):
+        print('warning: UI images differ')
+
+    results = (
+        ('legacy', lambda: convert_legacy(profile, jpeg, focus)),
+        ('rgb', lambda: convert(profile, jpeg, focus, allocate))
+    )
+
+    name = 'focus' if focus else 'plain'
+    for label, func in results:
+        elapsed = timeit.timeit(func, number=number)
+        print(
+            f'{name:<8}{label:<8}'
+            f'{elapsed / number * 1e3:>10.2f} ms'
+            f'{measure_peak(func):>10.1f} MB'
+        )
+
+
+def main(number=50):
+    width, height = setting.camera_resolution
+    profile = JpegProfile.from_parms(setting.jpeg.live_view)
+    jpeg = make_jpeg(profile, width, height)
+
+    print(f'{width}x{height}, JPEG {len(jpeg) / 1024:.0f} KB')
+    print(f'{"mode":<8}{"path":<8}{"per frame":>13}{"peak":>13}')
+    for focus in (False, True):
+        bench(profile, jpeg, focus, number)
+
+
+if __name__ == '__main__':
+    main()
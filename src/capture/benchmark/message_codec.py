@@ -0,0 +1,129 @@
+"""訊息編碼壓測
+
+比較 MessageCodec 與舊的 pickle 訊息封包，編碼與解碼各自的耗時與封包大小
+在 capture 資料夾執行: python -m benchmark.message_codec
+
+"""
+import copy
+import pickle
+import struct
+import timeit
+
+from utility.define import MessageType
+from utility.message import Message
+
+
+class PickleMessage(Message):
+    """舊的 pickle 封包，做為比較基準"""
+
+    META_FORMAT = '>II'
+    META_SIZE = struct.calcsize(META_FORMAT)
+
+    def to_packet(self):
+        obj = copy.copy(self)
+        obj._payload = b''
+        msg = pickle.dumps(obj)
+        return struct.pack(
+            self.META_FORMAT, len(msg), len(self._payload)
+        ) + msg + self._payload
+
+    @classmethod
+    def from_packet(cls, packet):
+        message_size, _ = struct.unpack(
+            cls.META_FORMAT, packet[:cls.META_SIZE]
+        )
+        message = pickle.loads(
+            packet[cls.META_SIZE:cls.META_SIZE + message_size]
+        )
+        message._payload = packet[cls.META_SIZE + message_size:]
+        return message
+
+
+def load_packet(packet):
+    """以 MessageCodec 封包建立訊息"""
+    msg_type, flags, sent_time, parms_size, _ = Message.unpack_meta(
+        packet[:Message.META_SIZE]
+    )
+    start = Message.META_SIZE
+    return Message.load_from_bytes(
+        msg_type,
+        packet[start:start + parms_size],
+        packet[start + parms_size:],
+        flags, sent_time
+    )
+
+
+SAMPLES = {
+    'status request': (
+        MessageType.CAMERA_STATUS, {'calibrate_frame': 12345}, b''
+    ),
+    'status report': (
+        MessageType.CAMERA_STATUS,
+        {
+            '17496124': {
+                'state': 1,
+                'current_frame': 12345,
+                'record_frames_count': 300,
+                'record_stats': {
+                    'queued': 300, 'blocked': 0, 'blocked_time': 0.0,
+                    'dropped': 0, 'spilled': 0, 'policy': 'block'
+                }
+            }
+        },
+        b''
+    ),
+    'submit report': (
+        MessageType.SUBMIT_REPORT,
+        {
+            'camera_id': '17496124', 'shot_id': '5f43add5253791a3da376079',
+            'job_name': 'take_01', 'progress': (120, 300),
+            'encoded': 10, 'missing': []
+        },
+        b''
+    ),
+    'shot image': (
+        MessageType.SHOT_IMAGE,
+        {
+            'camera_id': '17496124', 'shot_id': '5f43add5253791a3da376079',
+            'frame': 1234, 'quality': 85, 'scale_length': 150,
+            'delay': False
+        },
+        bytes(20 * 1024)
+    )
+}
+
+
+def bench(name, msg_type, parms, payload, number):
+    legacy = PickleMessage(msg_type, parms, payload)
+    message = Message(msg_type, parms, payload)
+    legacy_packet = legacy.to_packet()
+    packet = message.to_packet()
+
+    results = (
+        ('pickle', len(legacy_packet),
+         timeit.timeit(legacy.to_packet, number=number),
+         timeit.timeit(
+             lambda: PickleMessage.from_packet(legacy_packet),
+             number=number
+         )),
+        ('codec', len(packet),
+         timeit.timeit(message.to_packet, number=number),
+         timeit.timeit(lambda: load_packet(packet), number=number))
+    )
+
+    for label, size, encode_time, decode_time in results:
+        print(
+            f'{name:<16}{label:<8}{size:>8} B'
+            f'{encode_time / number * 1e6:>10.2f} us'
+            f'{decode_time / number * 1e6:>10.2f} us'
+        )
+
+
+def main(number=50000):
+    print(f'{"message":<16}{"codec":<8}{"size":>10}{"encode":>13}{"decode":>13}')
+    for name, sample in SAMPLES.items():
+        bench(name, *sample, number)
+
+
+if __name__ == '__main__':
+    main()
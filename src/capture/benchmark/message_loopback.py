@@ -0,0 +1,326 @@
+"""訊息層本機壓測
+
+在本機啟動 master 的 MessageManager 與 N 個模擬 slave (各自的 process)
+slave 依設定的頻率與大小送出預覽、shot 圖像、相機狀態與發佈報告
+結束後列出各訊息類型的 msg/s、MB/s、延遲 p50/p99 與各 process 的 CPU
+延遲從訊息的寄出時間算到 master 從收件匣取出為止
+
+在 capture 資料夾執行:
+    python -m benchmark.message_loopback --slaves 16 --transport asyncio
+
+"""
+import os
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+
+from utility.setting import setting
+from utility.define import MessageType
+from utility.message import Message
+from utility.message.manager import MessageManager
+from utility.message.node import MessageNodeManager
+from utility.message.aio import AsyncMessageNodeManager
+
+# 預設流量 {名稱: (訊息類型, 每秒數量, payload 大小 KB)}，皆為每台模擬 slave
+TRAFFIC = {
+    'live_view': (MessageType.LIVE_VIEW_IMAGE, 30, 20),
+    'shot': (MessageType.SHOT_IMAGE, 30, 10),
+    'status': (MessageType.CAMERA_STATUS, 10, 0),
+    'submit': (MessageType.SUBMIT_REPORT, 1, 0)
+}
+
+
+def build_parms(msg_type, camera_id, count):
+    """產生各訊息類型的模擬參數"""
+    if msg_type is MessageType.LIVE_VIEW_IMAGE:
+        return {'camera_id': camera_id}
+    elif msg_type is MessageType.SHOT_IMAGE:
+        return {
+            'camera_id': camera_id, 'shot_id': 'benchmark', 'frame': count,
+            'quality': 85, 'scale_length': 150
+        }
+    elif msg_type is MessageType.CAMERA_STATUS:
+        return {camera_id: {'current_frame': count}}
+    elif msg_type is MessageType.SUBMIT_REPORT:
+        return {
+            'camera_id': camera_id, 'shot_id': 'benchmark',
+            'job_name': 'benchmark', 'progress': (count, 1000),
+            'encoded': count, 'missing': []
+        }
+    return {}
+
+
+class SimulatedSlave():
+    """模擬 slave
+
+    直接使用 node 管理連上 master，不經過 slave 的 MessageManager 與相機系統
+
+    Args:
+        address: master 的連線地址
+        transport: thread / asyncio
+        bulk_rate: 圖像通道每秒的 payload 上限 (bytes)
+        compress: 是否壓縮
+
+    """
+
+    def __init__(self, address, transport, bulk_rate, compress):
+        connected = threading.Event()
+
+        if transport == 'asyncio':
+            self._node = AsyncMessageNodeManager(
+                lambda message: None, bulk_rate, compress
+            )
+            threading.Thread(
+                target=self._node.run_slave,
+                args=(address, connected.set, lambda *args: None),
+                daemon=True
+            ).start()
+        else:
+            self._node = MessageNodeManager(
+                lambda message: None, bulk_rate, compress
+            )
+            sock = socket.create_connection(address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._node.add_connection(sock)
+            connected.set()
+
+        if not connected.wait(10):
+            raise TimeoutError('Simulated slave can not connect to master')
+
+    def send(self, message):
+        self._node.add_send_queue(message)
+
+    def stop(self):
+        self._node.stop()
+
+
+def run_slave(
+    index, address, transport, traffic, duration, bulk_rate, compress,
+    start_event, done_event, result_queue
+):
+    """模擬 slave 的 process，回傳送出數量與 CPU 時間
+
+    Args:
+        index: slave 編號
+        address: master 的連線地址
+        transport: thread / asyncio
+        traffic: 流量設定，格式同 TRAFFIC
+        duration: 送出的秒數
+        bulk_rate: 圖像通道每秒的 payload 上限 (bytes)
+        compress: 是否壓縮
+        start_event: 開始送出的事件
+        done_event: master 統計完可以斷線的事件
+        result_queue: 回傳結果的佇列
+
+    """
+    camera_id = f'sim{index:02d}'
+    slave = SimulatedSlave(address, transport, bulk_rate, compress)
+
+    # 預先產生 payload，隨機內容避免被壓縮
+    schedule = []
+    for name, (msg_type, rate, size_kb) in traffic.items():
+        if rate <= 0:
+            continue
+        payload = os.urandom(int(size_kb * 1024)) if size_kb > 0 else b''
+        schedule.append([0.0, 1 / rate, name, msg_type, payload])
+    queued = {name: 0 for name in traffic}
+
+    start_event.wait()
+    cpu_start = time.process_time()
+    start_time = time.perf_counter()
+    end_time = start_time + duration
+    for item in schedule:
+        item[0] = start_time
+
+    while len(schedule) > 0:
+        item = min(schedule, key=lambda item: item[0])
+        next_time, interval, name, msg_type, payload = item
+        if next_time >= end_time:
+            break
+
+        wait = next_time - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+
+        slave.send(Message(
+            msg_type, build_parms(msg_type, camera_id, queued[name]), payload
+        ))
+        queued[name] += 1
+        item[0] += interval
+
+    # 等寄送佇列送完
+    time.sleep(1.0)
+    result_queue.put({
+        'index': index,
+        'queued': queued,
+        'cpu': time.process_time() - cpu_start
+    })
+
+    # master 統計完才斷線，避免連線的統計先被移除
+    done_event.wait()
+    slave.stop()
+
+
+def percentile(values, percent):
+    """取得排序後數列的百分位數"""
+    if len(values) == 0:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run(slaves, transport, traffic, duration, bulk_rate_mb, compress):
+    """執行一次壓測並列出結果
+
+    Args:
+        slaves: 模擬 slave 數量
+        transport: thread / asyncio
+        traffic: 流量設定，格式同 TRAFFIC
+        duration: 送出的秒數
+        bulk_rate_mb: 圖像通道每秒的上限 (MB)，0 為不限制
+        compress: 是否壓縮
+
+    """
+    address = ('127.0.0.1', get_free_port())
+    setting.apply({
+        'host_address': {'ip': address[0], 'port': address[1]},
+        'message_transport': transport,
+        'message_bulk_rate_mb': bulk_rate_mb,
+        'message_compress': compress
+    })
+    master = MessageManager()
+
+    context = multiprocessing.get_context('spawn')
+    start_event = context.Event()
+    done_event = context.Event()
+    result_queue = context.Queue()
+    processes = [
+        context.Process(
+            target=run_slave,
+            args=(
+                index, address, transport, traffic, duration,
+                bulk_rate_mb * 1024 ** 2, compress, start_event, done_event,
+                result_queue
+            )
+        )
+        for index in range(slaves)
+    ]
+    for process in processes:
+        process.start()
+
+    wait_until = time.perf_counter() + 30
+    while master.get_nodes_count() < slaves:
+        if time.perf_counter() > wait_until:
+            raise TimeoutError('Simulated slaves did not connect')
+        time.sleep(0.1)
+
+    # 結束時送給自己終止訊息
+    type_names = {msg_type: name for name, (msg_type, _, _) in traffic.items()}
+    latencies = {name: [] for name in traffic}
+    threading.Timer(
+        duration + 2.0,
+        lambda: master.send_message(MessageType.MASTER_DOWN, is_local=True)
+    ).start()
+
+    cpu_start = time.process_time()
+    start_time = time.perf_counter()
+    start_event.set()
+
+    while True:
+        message = master.receive_message()
+        if message.type is MessageType.MASTER_DOWN:
+            break
+        if message.type in type_names:
+            latencies[type_names[message.type]].append(
+                time.time() - message.get_sent_time()
+            )
+
+    wall_time = time.perf_counter() - start_time
+    master_cpu = time.process_time() - cpu_start
+
+    received_bytes = {}
+    for stats in master.get_stats().values():
+        for type_name, counter in stats['received'].items():
+            received_bytes[type_name] = (
+                received_bytes.get(type_name, 0) + counter['bytes']
+            )
+
+    results = [result_queue.get() for _ in processes]
+    done_event.set()
+    for process in processes:
+        process.join()
+    master.stop()
+
+    # 列出結果
+    print(
+        f'\n[{transport}] {slaves} slaves, {duration} s'
+        f'{", compress" if compress else ""}'
+        f'{f", bulk {bulk_rate_mb} MB/s" if bulk_rate_mb else ""}'
+    )
+    print(
+        f'{"message":<12}{"queued":>9}{"received":>10}{"msg/s":>10}'
+        f'{"MB/s":>9}{"p50 ms":>9}{"p99 ms":>9}'
+    )
+    for name, (msg_type, _, _) in traffic.items():
+        values = sorted(latencies[name])
+        queued = sum(result['queued'][name] for result in results)
+        size = received_bytes.get(msg_type.name, 0)
+        print(
+            f'{name:<12}{queued:>9}{len(values):>10}'
+            f'{len(values) / duration:>10.1f}'
+            f'{size / 1024 ** 2 / duration:>9.2f}'
+            f'{percentile(values, 50) * 1000:>9.2f}'
+            f'{percentile(values, 99) * 1000:>9.2f}'
+        )
+
+    print(f'master CPU {master_cpu:.2f} s ({master_cpu / wall_time:.0%})')
+    slave_cpu = [result['cpu'] for result in results]
+    print(
+        f'slave CPU avg {sum(slave_cpu) / len(slave_cpu):.2f} s,'
+        f' max {max(slave_cpu):.2f} s'
+        f' ({max(slave_cpu) / (duration + 1.0):.0%})'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--slaves', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument(
+        '--transport', choices=('thread', 'asyncio', 'both'), default='both'
+    )
+    parser.add_argument('--bulk-rate-mb', type=float, default=0)
+    parser.add_argument('--compress', action='store_true')
+    for name, (_, rate, size_kb) in TRAFFIC.items():
+        parser.add_argument(
+            f'--{name.replace("_", "-")}', type=float, nargs=2,
+            metavar=('RATE', 'SIZE_KB'), default=(rate, size_kb),
+            help=f'每台 slave 每秒數量與 payload 大小 (預設 {rate} {size_kb})'
+        )
+    args = parser.parse_args()
+
+    traffic = {
+        name: (msg_type, *getattr(args, name))
+        for name, (msg_type, _, _) in TRAFFIC.items()
+    }
+    transports = (
+        ('thread', 'asyncio') if args.transport == 'both'
+        else (args.transport,)
+    )
+    for transport in transports:
+        run(
+            args.slaves, transport, traffic, args.duration,
+            args.bulk_rate_mb, args.compress
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import threading
+
+from utility.setting import setting
+
+
+class CameraPixmapCache():
+    """所有相機共用的圖像快取
+
+    以 (shot ID, 相機 ID, 快取類型, 影格) 為 key 存放壓縮後的 CameraPixmap
+    總大小超過 setting.jpeg.shot.library_cache_mb 時，從最久沒用到的開始淘汰
+    目前 shot 顯示範圍內的影格會被釘選，放在另一個 LRU
+    先淘汰沒釘選的，只有釘選的圖像本身就超過上限時才淘汰釘選的
+    各相機的 CameraLibrary 在不同執行緒存取，所有操作都要上鎖
+
+    Args:
+        budget: 快取的大小上限 (bytes)
+
+    """
+
+    def __init__(self, budget):
+        self._lock = threading.Lock()
+        self._budget = budget  # 大小上限
+        self._size = 0  # 目前的總大小
+        self._entries = OrderedDict()  # 沒釘選的圖像 {key: CameraPixmap}
+        self._pinned = OrderedDict()  # 釘選的圖像 {key: CameraPixmap}
+        self._pin = None  # 釘選範圍 (shot ID, 開始影格, 結束影格)
+
+    @staticmethod
+    def get_key(camera_pixmap):
+        """取得圖像的快取 key"""
+        return (
+            camera_pixmap.shot_id,
+            camera_pixmap.camera_id,
+            camera_pixmap.get_cache_type(),
+            camera_pixmap.frame
+        )
+
+    def _is_pinned(self, key):
+        if self._pin is None:
+            return False
+        shot_id, start_frame, end_frame = self._pin
+        return key[0] == shot_id and start_frame <= key[3] <= end_frame
+
+    def get(self, camera_pixmap):
+        """取得快取的圖像，沒有的話回傳 None
+
+        Args:
+            camera_pixmap: 請求的 CameraPixmap
+
+        """
+        key = self.get_key(camera_pixmap)
+        with self._lock:
+            for entries in (self._pinned, self._entries):
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+        return None
+
+    def put(self, camera_pixmap):
+        """存入壓縮好的圖像，回傳因為超過上限被淘汰的圖像列表
+
+        Args:
+            camera_pixmap: 已經 save_cache 的 CameraPixmap
+
+        """
+        key = self.get_key(camera_pixmap)
+        with self._lock:
+            previous = self._pop(key)
+            if previous is not None:
+                self._size -= previous.get_size()
+
+            if self._is_pinned(key):
+                self._pinned[key] = camera_pixmap
+            else:
+                self._entries[key] = camera_pixmap
+            self._size += camera_pixmap.get_size()
+
+            return self._evict()
+
+    def _pop(self, key):
+        for entries in (self._pinned, self._entries):
+            if key in entries:
+                return entries.pop(key)
+        return None
+
+    def _evict(self):
+        """淘汰到總大小低於上限"""
+        evicted = []
+        for entries in (self._entries, self._pinned):
+            while self._size > self._budget and len(entries) > 0:
+                _, camera_pixmap = entries.popitem(last=False)
+                self._size -= camera_pixmap.get_size()
+                evicted.append(camera_pixmap)
+        return evicted
+
+    def pin(self, shot_id, start_frame, end_frame):
+        """釘選 shot 的影格範圍，原本的釘選範圍會解除
+
+        Args:
+            shot_id: shot ID
+            start_frame: 開始影格
+            end_frame: 結束影格
+
+        """
+        pin = (shot_id, start_frame, end_frame)
+        with self._lock:
+            if pin == self._pin:
+                return
+            self._pin = pin
+
+            # 重新分配，解除釘選的放回沒釘選 LRU 最新的位置
+            unpinned = [
+                key for key in self._pinned if not self._is_pinned(key)
+            ]
+            for key in unpinned:
+                self._entries[key] = self._pinned.pop(key)
+
+            pinned = [key for key in self._entries if self._is_pinned(key)]
+            for key in pinned:
+                self._pinned[key] = self._entries.pop(key)
+
+    def get_size(self):
+        """取得目前的總大小"""
+        return self._size
+
+    def get_budget(self):
+        """取得大小上限"""
+        return self._budget
+
+
+pixmap_cache = CameraPixmapCache(
+    setting.jpeg.shot.library_cache_mb * 1024 ** 2
+)  # 單例模式
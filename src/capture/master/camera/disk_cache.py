@@ -0,0 +1,301 @@
+from queue import Queue
+import threading
+import mmap
+import os
+
+import numpy as np
+
+from utility.setting import setting
+from utility.logger import log
+
+
+class CameraPixmapDiskCache(threading.Thread):
+    """master 本機硬碟的第二層圖像快取
+
+    存放 CameraPixmap.save_cache 壓縮好的 RGB 資料，重開 master 後仍可使用
+    資料分成多個區段，每個區段有一個資料檔 4dc 跟一個資訊檔 4dk
+    4dc 是壓縮資料連續寫入的檔案，讀取時以記憶體映射直接取出
+    4dk 記錄每筆資料的 key 與在 4dc 的位置，格式為 meta_dtype
+    寫入由自己的 daemon 執行緒處理，先寫資料再寫資訊，寫到一半的資料啟動時會捨棄
+    總大小超過上限時，整個刪除最舊的區段
+
+    Args:
+        path: 快取資料夾
+        budget: 快取的大小上限 (bytes)，0 為關閉
+        segment_size: 每個區段的大小 (bytes)
+
+    """
+
+    meta_dtype = np.dtype([
+        ('shot_id', 'S32'), ('camera_id', 'S32'), ('cache_type', '<u1'),
+        ('frame', '<u4'), ('cursor', '<u8'), ('size', '<u4'),
+        ('height', '<u4'), ('width', '<u4'), ('channels', '<u1')
+    ])  # 資訊格式，cursor 為資料在 4dc 的位置
+    data_ext = '.4dc'
+    meta_ext = '.4dk'
+
+    def __init__(self, path, budget, segment_size=256 * 1024 ** 2):
+        super().__init__(daemon=True)
+        self._path = path  # 快取資料夾
+        self._budget = budget  # 大小上限
+        self._segment_size = segment_size  # 區段大小
+        self._queue = Queue()  # 寫入佇列
+        self._lock = threading.Lock()
+        self._index = {}  # {key: (區段, 位置, 大小, 形狀)}
+        self._segment_sizes = {}  # {區段: 資料大小}
+        self._maps = {}  # 讀取用的記憶體映射 {區段: (file, mmap)}
+        self._segment = 0  # 寫入中的區段
+        self._data_file = None  # 寫入中的 4dc
+        self._meta_file = None  # 寫入中的 4dk
+
+        if not self.is_enabled():
+            return
+
+        os.makedirs(self._path, exist_ok=True)
+        self._load_segments()
+
+        # 初始化即自動執行
+        self.start()
+
+    def is_enabled(self):
+        """是否有開啟硬碟快取"""
+        return self._budget > 0
+
+    @staticmethod
+    def get_key(camera_pixmap):
+        """取得圖像的快取 key"""
+        return (
+            camera_pixmap.shot_id,
+            camera_pixmap.camera_id,
+            camera_pixmap.get_cache_type().value,
+            camera_pixmap.frame
+        )
+
+    def _get_segment_path(self, segment):
+        return os.path.join(self._path, f'{segment:06d}')
+
+    def _load_segments(self):
+        """讀取既有的區段重建索引，之後的寫入從新的區段開始"""
+        segments = []
+        for name in os.listdir(self._path):
+            segment, ext = os.path.splitext(name)
+            if ext == self.meta_ext and segment.isdigit():
+                segments.append(int(segment))
+        segments.sort()
+
+        for segment in segments:
+            self._load_segment(segment)
+
+        if len(segments) > 0:
+            self._segment = segments[-1] + 1
+
+        log.info(
+            f'Disk cache: {len(self._index)} frames'
+            f' ({self.get_size() / 1024 ** 3:.2f} GB)'
+        )
+
+    def _load_segment(self, segment):
+        """讀取區段的 4dk，資料沒有完整寫入的部分捨棄"""
+        segment_path = self._get_segment_path(segment)
+        try:
+            data_size = os.path.getsize(segment_path + self.data_ext)
+            with open(segment_path + self.meta_ext, 'rb') as f:
+                raw_meta = f.read()
+        except OSError as error:
+            log.warning(f'Disk cache segment {segment} broken: {error}')
+            self._remove_segment_files(segment)
+            return
+
+        count = len(raw_meta) // self.meta_dtype.itemsize
+        meta = np.frombuffer(raw_meta, self.meta_dtype, count)
+        meta = meta[meta['cursor'] + meta['size'] <= data_size]
+
+        for entry in meta:
+            key = (
+                entry['shot_id'].decode(),
+                entry['camera_id'].decode(),
+                int(entry['cache_type']),
+                int(entry['frame'])
+            )
+            self._index[key] = (
+                segment,
+                int(entry['cursor']),
+                int(entry['size']),
+                (
+                    int(entry['height']),
+                    int(entry['width']),
+                    int(entry['channels'])
+                )
+            )
+
+        self._segment_sizes[segment] = data_size
+
+    def get(self, camera_pixmap):
+        """從硬碟載入壓縮資料到 camera_pixmap，有找到的話回傳 True
+
+        Args:
+            camera_pixmap: 請求的 CameraPixmap
+
+        """
+        if not self.is_enabled():
+            return False
+
+        key = self.get_key(camera_pixmap)
+        with self._lock:
+            if key not in self._index:
+                return False
+
+            segment, cursor, size, shape = self._index[key]
+            data_map = self._get_map(segment, cursor + size)
+            if data_map is None:
+                return False
+            cache = data_map[cursor:cursor + size]
+
+        camera_pixmap.load_cache(cache, shape)
+        return True
+
+    def _get_map(self, segment, length):
+        """取得區段的記憶體映射，映射範圍不夠的話重新映射"""
+        if segment in self._maps:
+            data_file, data_map = self._maps[segment]
+            if len(data_map) >= length:
+                return data_map
+            data_map.close()
+            data_file.close()
+            del self._maps[segment]
+
+        try:
+            data_file = open(
+                self._get_segment_path(segment) + self.data_ext, 'rb'
+            )
+            data_map = mmap.mmap(
+                data_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except (OSError, ValueError) as error:
+            log.warning(f'Disk cache segment {segment} not mapped: {error}')
+            return None
+
+        self._maps[segment] = (data_file, data_map)
+        return data_map
+
+    def put(self, camera_pixmap):
+        """加入寫入佇列，已經存過的圖像略過
+
+        Args:
+            camera_pixmap: 已經 save_cache 的 CameraPixmap
+
+        """
+        if not self.is_enabled() or not camera_pixmap.is_cache():
+            return
+
+        with self._lock:
+            if self.get_key(camera_pixmap) in self._index:
+                return
+
+        self._queue.put(camera_pixmap)
+
+    def run(self):
+        while True:
+            camera_pixmap = self._queue.get()
+            try:
+                self._write(camera_pixmap)
+            except OSError as error:
+                # 寫到一半的區段不再接續，換新的區段
+                log.warning(f'Disk cache write failed: {error}')
+                with self._lock:
+                    self._close_segment()
+                    self._segment += 1
+
+    def _write(self, camera_pixmap):
+        """寫入一筆資料，區段滿了換新的區段，超過上限刪除最舊的區段"""
+        key = self.get_key(camera_pixmap)
+        cache, shape = camera_pixmap.get_cache()
+
+        with self._lock:
+            if key in self._index:
+                return
+
+            segment_size = self._segment_sizes.get(self._segment, 0)
+            if segment_size + len(cache) > self._segment_size:
+                self._close_segment()
+                self._segment += 1
+                segment_size = 0
+
+            if self._data_file is None:
+                segment_path = self._get_segment_path(self._segment)
+                self._data_file = open(segment_path + self.data_ext, 'ab')
+                self._meta_file = open(segment_path + self.meta_ext, 'ab')
+
+        # 寫檔不佔鎖，讀取只會讀到已經登記在索引的資料
+        self._data_file.write(cache)
+        self._data_file.flush()
+
+        meta = np.zeros(1, self.meta_dtype)
+        meta['shot_id'] = key[0].encode()
+        meta['camera_id'] = key[1].encode()
+        meta['cache_type'] = key[2]
+        meta['frame'] = key[3]
+        meta['cursor'] = segment_size
+        meta['size'] = len(cache)
+        meta['height'], meta['width'], meta['channels'] = shape
+        self._meta_file.write(meta.tobytes())
+        self._meta_file.flush()
+
+        with self._lock:
+            self._index[key] = (
+                self._segment, segment_size, len(cache), shape
+            )
+            self._segment_sizes[self._segment] = segment_size + len(cache)
+            self._evict()
+
+    def _close_segment(self):
+        """關閉寫入中的區段"""
+        if self._data_file is None:
+            return
+        self._data_file.close()
+        self._meta_file.close()
+        self._data_file = None
+        self._meta_file = None
+
+    def _evict(self):
+        """超過上限時刪除最舊的區段，寫入中的區段不刪"""
+        while self.get_size() > self._budget:
+            oldest = min(self._segment_sizes)
+            if oldest == self._segment:
+                break
+
+            del self._segment_sizes[oldest]
+            for key in [
+                key for key, entry in self._index.items()
+                if entry[0] == oldest
+            ]:
+                del self._index[key]
+
+            if oldest in self._maps:
+                data_file, data_map = self._maps.pop(oldest)
+                data_map.close()
+                data_file.close()
+
+            self._remove_segment_files(oldest)
+
+    def _remove_segment_files(self, segment):
+        segment_path = self._get_segment_path(segment)
+        for ext in (self.data_ext, self.meta_ext):
+            try:
+                os.remove(segment_path + ext)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                log.warning(
+                    f'Disk cache segment {segment} not removed: {error}'
+                )
+
+    def get_size(self):
+        """取得目前的總大小"""
+        return sum(self._segment_sizes.values())
+
+
+disk_cache = CameraPixmapDiskCache(
+    setting.jpeg.shot.disk_cache_path,
+    setting.jpeg.shot.disk_cache_mb * 1024 ** 2
+)  # 單例模式
@@ -1,13 +1,13 @@
 from queue import Queue
+import itertools
 import threading
 import cv2
 import numpy as np
 import lz4framed
-from PyQt5.Qt import QPixmap, QImage
 
 from utility.setting import setting
 from utility.message import message_manager
-from common.jpeg_coder import jpeg_coder
+from common.jpeg_coder import JpegProfile, TJPF_RGB
 from utility.define import (
     UIEventType, MessageType, CameraLibraryTask, CameraCacheType
 )
@@ -17,23 +17,31 @@ from master.streaming import server
 from master.ui import ui
 from master.projects import project_manager
 
+from .cache import pixmap_cache
+from .disk_cache import disk_cache
+
 
 class CameraLibrary(threading.Thread):
     """相機快取圖庫
 
-    當 slave 傳圖片過來時，會在這邊轉成 UI 可用的 pixmap
-    如果不是相機預覽，會將圖片存到 self._cache 建立快取來加速播放
+    當 slave 傳圖片過來時，交給共用的 pixmap_workers 解碼成 UI 可用的 RGB 圖像
+    如果不是相機預覽，會將圖片存到所有相機共用的 pixmap_cache 來加速播放
     圖片因為有不同的參數，存放方式以參數產生獨立的 key 來識別
-    同時也處理圖片請求，如果 self._cache 沒有的圖也會向 slave 索取
+    快取超過上限淘汰的圖像會從 shot 的快取進度扣掉
+    存進快取的圖像也會寫到本機硬碟的 disk_cache，記憶體沒有的圖先從硬碟載入
+    同時也處理圖片請求，如果快取沒有的圖也會向 slave 索取
+    整段影格的請求只送一個批次請求給 slave，解碼後分段回傳確認做流量控制
 
     """
 
+    _batch_ids = itertools.count()  # 批次請求的 ID
+
     def __init__(self):
         super().__init__()
         self._queue = Queue()  # 圖片佇列
-        self._cache = {}  # 快取
+        self._batch_received = (None, 0)  # 目前批次的 (ID, 收到的張數)
+        self._batch_lock = threading.Lock()  # 多個 worker 同時確認批次
         self._delay = DelayExecutor()
-        self._encoder = CameraPixmapEncoder(self)
 
         # 初始化即自動執行
         self.start()
@@ -55,17 +63,20 @@ class CameraLibrary(threading.Thread):
                     self._delay.execute(lambda: self._slave_request(payload))
                 else:
                     self._slave_request(payload)
+            elif task_type is CameraLibraryTask.REQUEST_RANGE:
+                self._request_range(payload)
 
     def _get_pixmap_from_cache(self, camera_pixmap):
-        try:
-            pixmap = (
-                self._cache[camera_pixmap.shot_id]
-                [camera_pixmap.get_cache_type()]
-                [camera_pixmap.frame]
-            )
+        pixmap = pixmap_cache.get(camera_pixmap)
+        if pixmap is not None:
             return pixmap
-        except KeyError:
-            return None
+
+        # 記憶體沒有的話從硬碟快取載入，再放回記憶體
+        if disk_cache.get(camera_pixmap):
+            self._store_pixmap(camera_pixmap)
+            return camera_pixmap
+
+        return None
 
     def _import_pixmap(self, camera_pixmap):
         """將 camera_pixmap 存進快取
@@ -74,27 +85,32 @@ class CameraLibrary(threading.Thread):
             camera_pixmap: CameraPixmap
 
         """
-        if camera_pixmap.shot_id not in self._cache:
-            self._cache[camera_pixmap.shot_id] = {
-                CameraCacheType.ORIGINAL: {},
-                CameraCacheType.THUMBNAIL: {}
-            }
+        if pixmap_cache.get(camera_pixmap) is not None:
+            return
 
-        target_cache = (
-            self._cache[camera_pixmap.shot_id]
-            [camera_pixmap.get_cache_type()]
-        )
+        camera_pixmap.save_cache()
+        disk_cache.put(camera_pixmap)
+        self._store_pixmap(camera_pixmap)
 
-        if camera_pixmap.frame in target_cache:
-            if target_cache[camera_pixmap.frame] is not None:
-                return
+    def _store_pixmap(self, camera_pixmap):
+        """存進記憶體快取，並更新存入與淘汰的 shot 快取進度
 
-        target_cache[camera_pixmap.frame] = camera_pixmap
-        camera_pixmap.save_cache()
+        Args:
+            camera_pixmap: 已經壓縮的 CameraPixmap
+
+        """
+        evicted = pixmap_cache.put(camera_pixmap)
 
         shot = project_manager.get_shot(camera_pixmap.shot_id)
         shot.update_cache_progress(camera_pixmap)
 
+        for evicted_pixmap in evicted:
+            try:
+                shot = project_manager.get_shot(evicted_pixmap.shot_id)
+            except KeyError:
+                continue
+            shot.update_cache_progress(evicted_pixmap, evicted=True)
+
     def _slave_request(self, camera_pixmap):
         """向 slave 索取指定圖像
 
@@ -106,9 +122,89 @@ class CameraLibrary(threading.Thread):
         """
         message_manager.send_message(
             MessageType.GET_SHOT_IMAGE,
-            camera_pixmap.get_parms()
+            camera_pixmap.get_parms(),
+            target=camera_pixmap.camera_id
+        )
+
+    def _request_range(self, parms):
+        """處理整段影格的請求
+
+        快取裡已有的影格直接傳給 UI，其餘從第一張到最後一張缺的影格
+        合成一個批次請求向 slave 索取
+
+        Args:
+            parms: {camera_id, shot_id, start_frame, end_frame, quality,
+                    scale_length}
+
+        """
+        frames = range(parms['start_frame'], parms['end_frame'] + 1)
+        cached = {}
+        for frame in frames:
+            camera_pixmap = CameraPixmap({
+                'camera_id': parms['camera_id'],
+                'shot_id': parms['shot_id'],
+                'frame': frame,
+                'quality': parms['quality'],
+                'scale_length': parms['scale_length']
+            })
+            cached[frame] = self._get_pixmap_from_cache(camera_pixmap)
+
+        missing = [frame for frame in frames if not cached[frame]]
+        if len(missing) > 0:
+            start_frame, end_frame = missing[0], missing[-1]
+        else:
+            start_frame, end_frame = None, None
+
+        # 批次範圍內的影格由 slave 傳回，不重複送給 UI
+        for frame, camera_pixmap in cached.items():
+            if start_frame is not None and start_frame <= frame <= end_frame:
+                continue
+            self.send_ui(camera_pixmap)
+
+        if start_frame is None:
+            return
+
+        message_manager.send_message(
+            MessageType.GET_SHOT_IMAGES,
+            {
+                'camera_id': parms['camera_id'],
+                'shot_id': parms['shot_id'],
+                'batch_id': next(self._batch_ids),
+                'start_frame': start_frame,
+                'end_frame': end_frame,
+                'quality': parms['quality'],
+                'scale_length': parms['scale_length'],
+                'window': setting.jpeg.shot.batch_window
+            },
+            target=parms['camera_id']
         )
 
+    def on_batch_decoded(self, camera_pixmap):
+        """批次圖像解碼完成，每解碼 batch_ack_frames 張回傳確認給 slave
+
+        Args:
+            camera_pixmap: CameraPixmap
+
+        """
+        with self._batch_lock:
+            batch_id, received = self._batch_received
+            if batch_id != camera_pixmap.batch_id:
+                batch_id, received = camera_pixmap.batch_id, 0
+
+            received += 1
+            self._batch_received = (batch_id, received)
+
+        if received % setting.jpeg.shot.batch_ack_frames == 0:
+            message_manager.send_message(
+                MessageType.SHOT_IMAGES_ACK,
+                {
+                    'camera_id': camera_pixmap.camera_id,
+                    'batch_id': batch_id,
+                    'received': received
+                },
+                target=camera_pixmap.camera_id
+            )
+
     def add_task(self, task_type, payload):
         self._queue.put((task_type, payload))
 
@@ -142,12 +238,16 @@ class CameraLibrary(threading.Thread):
                 )
 
     def on_image_received(self, message, direct=False):
-        """收到圖像的回調"""
+        """收到圖像的回調，相機狀態不用解碼直接傳給 UI"""
         if not direct:
             pixmap = CameraPixmap(*message.unpack())
         else:
             pixmap = CameraPixmap(message)
-        self._encoder.add_task(pixmap)
+
+        if pixmap.is_state():
+            self.send_ui(pixmap)
+        else:
+            pixmap_workers.add_task(self, pixmap)
 
     def on_image_requested(
         self, camera_id, shot_id, frame, quality, scale_length, delay
@@ -177,31 +277,157 @@ class CameraLibrary(threading.Thread):
         camera_pixmap = CameraPixmap(parms)
         self.add_task(CameraLibraryTask.REQUEST, camera_pixmap)
 
+    def on_images_requested(
+        self, camera_id, shot_id, start_frame, end_frame, quality,
+        scale_length
+    ):
+        """UI 整段影格的請求
 
-class CameraPixmapEncoder(threading.Thread):
-    def __init__(self, library):
-        super().__init__()
-        self._queue = Queue()
-        self._library = library
+        Args:
+            camera_id: 相機 ID
+            shot_id: shot ID
+            start_frame: 開始影格
+            end_frame: 結束影格
+            quality: 轉檔品質
+            scale_length: 最長邊長度
 
-        # 初始化即自動執行
-        self.start()
+        """
+        self.add_task(
+            CameraLibraryTask.REQUEST_RANGE,
+            {
+                'camera_id': camera_id,
+                'shot_id': shot_id,
+                'start_frame': start_frame,
+                'end_frame': end_frame,
+                'quality': quality,
+                'scale_length': scale_length
+            }
+        )
 
-    def add_task(self, pixmap):
-        if pixmap.is_live_view():
-            while not self._queue.empty():
-                self._queue.get()
-        self._queue.put(pixmap)
 
-    def run(self):
+class CameraPixmapWorkerPool():
+    """所有相機共用的圖像解碼執行緒池
+
+    解碼 JPEG、LZ4 壓縮、對焦輔助與串流縮圖都在 worker 執行
+    turbojpeg、LZ4 與 OpenCV 執行時會釋放 GIL，多個 worker 可以真正平行
+    UI 執行緒只負責把 RGB 圖像包成 QPixmap
+    每台相機的預覽只保留最新一張等待解碼，處理完比已送出的舊就丟掉
+    shot 圖像都要處理，批次請求的確認依靠解碼的張數
+
+    Args:
+        workers: worker 數量
+
+    """
+
+    def __init__(self, workers):
+        self._queue = Queue()  # 工作佇列
+        self._lock = threading.Lock()
+        self._live_views = {}  # 等待解碼的最新預覽 {相機 ID: (圖庫, 圖像, 序號)}
+        self._live_sent = {}  # 已送給 UI 的預覽序號 {相機 ID: 序號}
+        self._live_seqs = itertools.count()  # 預覽的序號
+
+        for _ in range(workers):
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def add_task(self, library, pixmap):
+        """加入解碼工作
+
+        Args:
+            library: 圖像所屬相機的 CameraLibrary
+            pixmap: CameraPixmap
+
+        """
+        if not pixmap.is_live_view():
+            self._queue.put((library, pixmap, None))
+            return
+
+        # 預覽只放相機 ID 到佇列，worker 取出時拿最新的一張
+        camera_id = pixmap.camera_id
+        with self._lock:
+            is_queued = camera_id in self._live_views
+            self._live_views[camera_id] = (
+                library, pixmap, next(self._live_seqs)
+            )
+        if not is_queued:
+            self._queue.put((None, None, camera_id))
+
+    def _run(self):
         while True:
-            pixmap = self._queue.get()
+            library, pixmap, camera_id = self._queue.get()
+
+            if camera_id is not None:
+                with self._lock:
+                    library, pixmap, seq = self._live_views.pop(camera_id)
+                self._process_live_view(library, pixmap, seq)
+            else:
+                self._process_shot(library, pixmap)
+
+    def _process_live_view(self, library, pixmap, seq):
+        pixmap.decode(image_buffers)
+
+        with self._lock:
+            if seq < self._live_sent.get(pixmap.camera_id, -1):
+                pixmap.release()
+                return
+            self._live_sent[pixmap.camera_id] = seq
+
+        library.send_ui(pixmap)
 
-            # 斷線產生 buf 會是 None 的情況不進行轉換
-            pixmap.decode()
+    def _process_shot(self, library, pixmap):
+        # 斷線產生 buf 會是 None 的情況不進行轉換
+        pixmap.decode()
+        pixmap.compress()
 
-            # 傳給 UI
-            self._library.send_ui(pixmap, save=True)
+        # 傳給 UI，並留著壓縮的資料存進快取
+        library.send_ui(pixmap, save=True)
+
+        if pixmap.is_batch():
+            library.on_batch_decoded(pixmap)
+
+
+class CameraImageBuffers():
+    """預覽解碼輸出的陣列池
+
+    每台相機的預覽固定解析度連續進來，解碼輸出的陣列用完後放回來重複使用
+    UI 把圖像包成 QPixmap 之後、或是圖像被丟掉時才放回
+    每台相機每種形狀最多保留 max_free 個，UI 落後時多出來的就照常配置
+
+    Args:
+        max_free: 每台相機每種形狀保留的陣列上限
+
+    """
+
+    def __init__(self, max_free=4):
+        self._lock = threading.Lock()
+        self._max_free = max_free  # 保留的陣列上限
+        self._free = {}  # 可用的陣列 {(相機 ID, 形狀): [陣列]}
+
+    def acquire(self, camera_id, shape):
+        """取得輸出陣列，沒有可用的就配置新的
+
+        Args:
+            camera_id: 相機 ID
+            shape: 陣列形狀 (高, 寬, 通道)
+
+        """
+        with self._lock:
+            free = self._free.get((camera_id, shape))
+            if free:
+                return free.pop()
+        return np.empty(shape, np.uint8)
+
+    def release(self, camera_id, array):
+        """放回用完的陣列
+
+        Args:
+            camera_id: 相機 ID
+            array: acquire 取得的陣列
+
+        """
+        with self._lock:
+            free = self._free.setdefault((camera_id, array.shape), [])
+            if len(free) < self._max_free:
+                free.append(array)
 
 
 class CameraPixmap():
@@ -217,12 +443,14 @@ class CameraPixmap():
     _ow = setting.camera_resolution[0]
     _oh = setting.camera_resolution[1]
     _kernel = np.ones((5, 5), np.uint8)
+    _profile = JpegProfile.from_parms(setting.jpeg.shot)
 
     def __init__(self, parms, buf=None, pixmap=None):
         self._buf = buf
         self._pixmap = pixmap  # QPixmap
         self._parms = parms  # 圖像資訊
         self._cache = None
+        self._buffers = None  # 解碼輸出陣列的來源 CameraImageBuffers
 
     def __getattr__(self, prop):
         if prop in self._parms:
@@ -243,6 +471,10 @@ class CameraPixmap():
     def is_shot(self):
         return 'shot_id' in self._parms
 
+    def is_batch(self):
+        """是否是批次請求的圖像"""
+        return 'batch_id' in self._parms
+
     def is_original(self):
         return (
             'scale_length' in self._parms and
@@ -259,13 +491,42 @@ class CameraPixmap():
         return 'state' in self._parms
 
     def to_payload(self, focus, caching, save):
-        pixmap = self.convert_to_pixmap(focus, save) if not caching else None
+        """UI 的 CAMERA_PIXMAP 內容
+
+        最後一項是 UI 包成 QPixmap 後要呼叫的 release，沒有的話為 None
+
+        """
+        if caching:
+            self.release()
+            image = None
+        else:
+            image = self.convert_to_image(focus, save)
+
+        release = None
+        if image is not None and self._buffers is not None:
+            release = self._get_release(image)
+            self._buffers = None
+
         return (
             self._parms['camera_id'],
-            pixmap,
-            self.is_live_view()
+            image,
+            self.is_live_view(),
+            release
         )
 
+    def _get_release(self, image):
+        buffers = self._buffers
+        camera_id = self._parms['camera_id']
+        return lambda: buffers.release(camera_id, image)
+
+    def release(self):
+        """解碼輸出的陣列不再使用，放回 CameraImageBuffers"""
+        if self._buffers is None or self._buf is None:
+            return
+        self._buffers.release(self._parms['camera_id'], self._buf)
+        self._buffers = None
+        self._buf = None
+
     def to_state(self):
         return (self._parms['camera_id'], self._parms['state'])
 
@@ -292,27 +553,73 @@ class CameraPixmap():
         """取得 QPixmap"""
         return self._pixmap
 
-    def decode(self):
+    def decode(self, buffers=None):
+        """解碼 JPEG 成 RGB
+
+        Args:
+            buffers: 指定的話解碼到從這個 CameraImageBuffers 取得的陣列
+
+        """
         if self._buf is None:
             return
 
-        # 解碼 JPEG 成 cv2 跟正確顏色
-        im = jpeg_coder.decode(self._buf)
-        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+        # 縮圖在 DCT 階段縮小解碼，不做全尺寸解碼
+        min_length = None
+        if self.is_shot() and not self.is_original():
+            min_length = self._parms['scale_length']
+
+        # 直接解碼成 RGB，符合 QImage.Format_RGB888 不用再轉換顏色
+        allocate = None
+        if buffers is not None:
+            camera_id = self._parms['camera_id']
+
+            def allocate(shape):
+                return buffers.acquire(camera_id, shape)
+
+        im = self._profile.decode(
+            self._buf, pixel_format=TJPF_RGB, min_length=min_length,
+            allocate=allocate
+        )
+        if buffers is not None:
+            self._buffers = buffers
         self._buf = im
         self._shape = self._buf.shape
         self._type = self._buf.dtype
 
+    def compress(self):
+        """壓縮解碼後的圖像，保留 buf 給 UI 顯示"""
+        if self._buf is None or self._cache is not None:
+            return
+        self._cache = lz4framed.compress(self._buf)
+
     def save_cache(self):
         if self._buf is None:
             return
-        self._cache = lz4framed.compress(self._buf)
+        self.compress()
         self._buf = None
 
-    def convert_to_pixmap(self, focus=False, save=False):
-        """做一系列圖像轉換至 pixmap
+    def get_cache(self):
+        """取得壓縮資料與圖像形狀，給硬碟快取寫入"""
+        return self._cache, self._shape
+
+    def load_cache(self, cache, shape):
+        """載入硬碟快取的壓縮資料
 
-        二進制JPEG > cv2 > QImage > QPixmap
+        Args:
+            cache: LZ4 壓縮的 RGB 資料
+            shape: 圖像形狀 (高, 寬, 通道)
+
+        """
+        self._cache = cache
+        self._shape = shape
+        self._type = np.dtype(np.uint8)
+
+    def convert_to_image(self, focus=False, save=False):
+        """取得給 UI 顯示的 RGB 圖像
+
+        預覽的對焦輔助與串流縮圖也在這裡處理
+        QImage 與 QPixmap 的包裝由 UI 執行緒處理
+        圖像不會被修改，直接給 UI 不用複製，對焦輔助只畫在預覽自己的陣列上
 
         """
         if self._buf is None:
@@ -322,7 +629,7 @@ class CameraPixmap():
             buf = np.frombuffer(buf, self._type)
             buf.shape = self._shape
         else:
-            buf = np.copy(self._buf)
+            buf = self._buf
 
         _height, _width, _ = buf.shape
 
@@ -330,28 +637,23 @@ class CameraPixmap():
             self.is_live_view() and
             _width == self._ow
         ):
+            # 對焦輔助與串流共用同一張半尺寸縮圖
+            half = cv2.resize(buf, (int(_width / 2), int(_height / 2)))
             if focus:
-                sim = cv2.resize(buf, (int(_width / 2), int(_height / 2)))
-                edges = cv2.Canny(sim, 280, 380)
+                edges = cv2.Canny(half, 280, 380)
                 edges = cv2.dilate(edges, self._kernel)
-                edges = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-                edges *= np.array((1, 0, 0), np.uint8)
+                np.bitwise_or(half[..., 0], edges, out=half[..., 0])
                 edges = cv2.resize(edges, (_width, _height))
-                buf = np.bitwise_or(buf, edges)
-            tm = cv2.resize(buf, (int(_width / 2), int(_height / 2)))
-            tm = cv2.cvtColor(tm, cv2.COLOR_RGB2BGR)
-            server.set_buffer(tm)
-
-        # 轉成 QImage
-        q_image = QImage(
-            buf.data,
-            _width,
-            _height,
-            3 * _width,
-            QImage.Format_RGB888
-        )
+                np.bitwise_or(buf[..., 0], edges, out=buf[..., 0])
+            server.set_buffer(half)
 
-        # 轉成 QPixmap
         if not save:
             self._buf = None
-        return QPixmap.fromImage(q_image)
+        return buf
+
+
+pixmap_workers = CameraPixmapWorkerPool(
+    setting.jpeg.shot.decode_workers
+)  # 單例模式
+
+image_buffers = CameraImageBuffers()  # 單例模式
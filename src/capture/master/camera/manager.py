@@ -1,3 +1,4 @@
+from threading import Timer
 import time
 
 from utility.setting import setting
@@ -14,6 +15,7 @@ from master.hardware_trigger import hardware_trigger
 from .proxy import CameraProxy
 from .parameter import CameraParameter
 from .report_collector import CameraReportCollector
+from .cache import pixmap_cache
 
 
 class CameraSaveMeta():
@@ -50,10 +52,13 @@ class CameraManager():
         self._parameters = self._build_parameters()  # 相機可控參數
         self._report_collector = CameraReportCollector()  # 相機報告蒐集
         self._ui_status_sender = Repeater(self._send_ui_status, 0.1, True)
-        self._camera_status_requester = Repeater(
-            self._request_camera_status, 0.1, True
+        self._camera_alive_checker = Repeater(
+            self._check_cameras_alive,
+            setting.camera_status.heartbeat_interval / 2,
+            True
         )
         self._delay = DelayExecutor(0.1)
+        self._camera_sessions = {}  # 各相機所在連線的 session ID
 
         self._save_meta = None
 
@@ -95,7 +100,7 @@ class CameraManager():
     def update_status(self, message):
         """更新相機狀態
 
-        將 slave 回報的相機狀態更新到 proxy
+        將 slave 推送的相機狀態差異更新到 proxy
 
         Args:
             message: 回報訊息
@@ -334,13 +339,19 @@ class CameraManager():
 
         """
         for camera in self._camera_list.values():
-            camera.update_status({'state': CameraState.CLOSE.value})
+            if camera.state is not CameraState.OFFLINE:
+                camera.set_state(CameraState.CLOSE)
+
+        if message is not None:
+            # 斷線的 slave 負責的相機直接離線，不用等心跳逾時
+            for camera_id in message.get_parms().get('camera_ids', []):
+                if camera_id in self._camera_list:
+                    self._camera_list[camera_id].set_offline()
 
         if self._is_capturing and message is not None:
             node = message.unpack()
             log.warning(f'Slave [{node.get_name()}] down, restart cameras')
-            time.sleep(1)
-            message_manager.send_message(MessageType.MASTER_DOWN)
+            self._restart_cameras()
 
         self._is_capturing = False
 
@@ -349,6 +360,99 @@ class CameraManager():
             False
         )
 
+    def _restart_cameras(self):
+        """要求所有 slave 重新啟動相機，重置擷取的格數
+
+        等一秒讓 slave 處理完停止擷取再送出，不卡住訊息分派的執行緒
+
+        """
+        timer = Timer(
+            1,
+            message_manager.send_message,
+            (MessageType.MASTER_DOWN,)
+        )
+        timer.daemon = True
+        timer.start()
+
+    def on_slave_lost(self, message):
+        """slave 斷線
+
+        沒有在擷取的話直接停止擷取
+        擷取中的話 slave 會繼續擷取並等待 session 恢復
+        只把斷線連線負責的相機設為離線，超過 setting.session.resume_timeout
+        還有相機沒恢復才停止擷取並重新啟動相機
+
+        Args:
+            message: SLAVE_DOWN 訊息
+
+        """
+        if not self._is_capturing:
+            self.stop_capture(message)
+            return
+
+        camera_ids = message.get_parms().get('camera_ids', [])
+        for camera_id in camera_ids:
+            if camera_id in self._camera_list:
+                self._camera_list[camera_id].set_offline()
+
+        node = message.unpack()
+        log.warning(f'Slave [{node.get_name()}] lost, wait for session resume')
+
+        # 逾時放進收件匣，由分派訊息的執行緒處理，不會與其他訊息同時停止擷取
+        timer = Timer(
+            setting.session.resume_timeout,
+            message_manager.send_message,
+            (MessageType.SLAVE_TIMEOUT, message.get_parms()),
+            {'is_local': True}
+        )
+        timer.daemon = True
+        timer.start()
+
+    def on_slave_timeout(self, message):
+        """斷線的 slave 等待時間到，負責的相機還有離線的話便停止擷取
+
+        Args:
+            message: SLAVE_TIMEOUT 訊息
+
+        """
+        if not self._is_capturing:
+            return
+
+        for camera_id in message.get_parms().get('camera_ids', []):
+            if (
+                camera_id in self._camera_list and
+                self._camera_list[camera_id].state is CameraState.OFFLINE
+            ):
+                self.stop_capture(message)
+                return
+
+    def on_node_announced(self, message):
+        """slave 連線告知負責的相機
+
+        記下各相機的 session ID，擷取中發現 session 換了
+        代表 slave 已經重新啟動，擷取格數對不上，要重新啟動所有相機
+
+        Args:
+            message: NODE_ANNOUNCE 訊息
+
+        """
+        parms = message.unpack()
+        session_id = parms.get('session_id')
+
+        is_restarted = False
+        for camera_id in parms['camera_ids']:
+            previous = self._camera_sessions.get(camera_id)
+            self._camera_sessions[camera_id] = session_id
+            if previous is not None and previous != session_id:
+                is_restarted = True
+
+        if is_restarted and self._is_capturing:
+            log.warning(
+                f'Cameras {parms["camera_ids"]} restarted, restart cameras'
+            )
+            self._restart_cameras()
+            self.stop_capture()
+
     def collect_report(self, message):
         """蒐集報告
 
@@ -396,6 +500,7 @@ class CameraManager():
             camera_ids: 相機ID列表
 
         """
+        self._pin_shot(shot_id)
 
         for camera_id, camera in self._camera_list.items():
             if closeup_camera == camera_id:
@@ -442,14 +547,36 @@ class CameraManager():
         )
 
     def cache_whole_shot(self, closeup_camera):
+        """快取整個 shot
+
+        每台相機只送一個整段影格的批次請求，slave 依流量控制逐張傳回
+
+        Args:
+            closeup_camera: 特寫的相機 ID，會取原尺寸圖像
+
+        """
         shot = project_manager.current_shot
         sf, ef = shot.frame_range
+        self._pin_shot(shot.get_id())
 
-        for f in range(sf, ef + 1):
-            self.request_shot_image(
-                shot.get_id(), f, closeup_camera
+        for camera_id, camera in self._camera_list.items():
+            if closeup_camera == camera_id:
+                scale_length = None
+            else:
+                scale_length = setting.jpeg.shot.scale_length
+
+            camera.on_images_requested(
+                camera_id, shot.get_id(), sf, ef,
+                setting.jpeg.shot.quality, scale_length
             )
 
+    def _pin_shot(self, shot_id):
+        """釘選正在看的 shot 整段影格，快取超過上限時最後才淘汰"""
+        shot = project_manager.get_shot(shot_id)
+        if shot.frame_range is None:
+            return
+        pixmap_cache.pin(shot_id, *shot.frame_range)
+
     def _get_bias(self):
         """取得相機實際擷取的格數誤差的最大值"""
         frames = [
@@ -460,22 +587,20 @@ class CameraManager():
         max_frame = max(frames)
         return max_frame - min_frame
 
-    def _request_camera_status(self):
-        message_manager.send_message(
-            MessageType.CAMERA_STATUS,
-            {
-                'calibrate_frame': self._camera_list[
-                    setting.get_working_camera_ids()[0]
-                ].current_frame
-            }
-        )
+    def _check_cameras_alive(self):
+        """檢查相機是否超過時間沒推送狀態"""
+        now = time.monotonic()
+        for camera in self._camera_list.values():
+            camera.check_alive(now)
 
     def _send_ui_status(self):
         status = {
             'bias': self._get_bias(),
             'slaves': message_manager.get_nodes_count(),
             'frames': -1,
-            'cache_size': project_manager.get_all_cache_size()
+            'cache_size': project_manager.get_all_cache_size(),
+            'connect_rate': message_manager.get_receive_rate(),
+            'messages': message_manager.get_stats()
         }
 
         if self._is_recording:
@@ -1,6 +1,7 @@
+import time
+
 from utility.setting import setting
 from utility.define import CameraState
-from utility.delay_executor import DelayExecutor
 
 from .library import CameraLibrary
 
@@ -9,6 +10,8 @@ class CameraProxy():
     """相機代理
 
     對應 slave 端的相機，處理狀態變化跟該相機拍攝的圖像處理
+    slave 推送的狀態只有改變的欄位，合併到 self._status
+    超過 offline_timeout 沒收到任何狀態 (含心跳) 便視為離線
 
     Args:
         camera_id: 相機 ID
@@ -27,7 +30,7 @@ class CameraProxy():
         }
 
         self._library = CameraLibrary()  # 相機快取圖庫
-        self._delay = DelayExecutor(1)
+        self._last_seen = None  # 上次收到狀態的時間
 
         # 連結自身狀態
         self._on_state_changed = on_state_changed
@@ -35,45 +38,67 @@ class CameraProxy():
         # 連結 library
         self.on_image_received = self._library.on_image_received
         self.on_image_requested = self._library.on_image_requested
+        self.on_images_requested = self._library.on_images_requested
 
     def __getattr__(self, prop):
         return self._status[prop]
 
     def set_offline(self):
-        self.update_status({'state': CameraState.OFFLINE}, True)
+        """設為離線"""
+        self._last_seen = None
+        self.set_state(CameraState.OFFLINE)
 
-    def update_status(self, status, from_offline=False):
-        """更新相機狀態
+    def check_alive(self, now):
+        """檢查是否超過時間沒收到狀態，超過便設為離線
 
         Args:
-            status: 相機狀態
+            now: 目前的 time.monotonic()
 
         """
-        if not from_offline:
-            self._delay.execute(self.set_offline)
+        if (
+            self._last_seen is not None and
+            now - self._last_seen > setting.camera_status.offline_timeout
+        ):
+            self.set_offline()
 
-        # 轉為相機狀態 Enum
-        status['state'] = CameraState(status['state'])
+    def update_status(self, status):
+        """更新 slave 推送的相機狀態
 
-        # 狀態是否改變
-        is_state_changed = (
-            status['state'] != self.state or
-            status['state'] is CameraState.OFFLINE
-        )
+        Args:
+            status: 有改變的相機狀態欄位
+
+        """
+        self._last_seen = time.monotonic()
+        status = dict(status)
+
+        # 離線後只有差異的話不知道完整狀態，等下次心跳
+        if 'state' not in status and self.state is CameraState.OFFLINE:
+            return
 
-        # 如果要更新的 state 一樣而且不是擷取的狀況，不更新狀態
-        if status['state'] is not CameraState.CAPTURING:
-            if not is_state_changed:
-                return
+        if 'state' in status:
+            state = CameraState(status.pop('state'))
+        else:
+            state = self.state
 
         self._status.update(status)
+        self.set_state(state)
 
-        if is_state_changed:
-            self._on_state_changed(self)
-            self._library.on_image_received(
-                {'state': status['state'], 'camera_id': self._id},
-                True
-            )
+    def set_state(self, state):
+        """改變相機 state，有改變時回調並通知 UI
+
+        Args:
+            state: CameraState
+
+        """
+        if state is self.state:
+            return
+
+        self._status['state'] = state
+        self._on_state_changed(self)
+        self._library.on_image_received(
+            {'state': state, 'camera_id': self._id},
+            True
+        )
 
     def get_id(self):
         """取得相機 ID"""
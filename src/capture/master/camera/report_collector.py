@@ -194,14 +194,41 @@ class RecordReportContainer(ReportContainer):
         start_frame = max(start_frames)  # 讓開始格數齊頭
         end_frame = min(end_frames)  # 讓結束格數齊尾
 
-        # 失蹤格數，藉由開始結尾跟相機編號所設立
+        # 失蹤格數，藉由開始結尾跟相機編號所設立，包含錄製緩衝捨棄的影格
         missing_frames = {}
         for r in self._reports:
-            frames = r['missing_frames']
+            record_stats = r.get('record_stats', {})
+            frames = sorted(
+                set(r['missing_frames']) |
+                set(record_stats.get('dropped_frames', []))
+            )
             missing_frames[r['camera_id']] = (
                 [f for f in frames if f >= start_frame and f <= end_frame]
             )
 
+            if record_stats.get('dropped', 0) > 0:
+                log.warning(
+                    f'<{r["camera_id"]}> dropped {record_stats["dropped"]}'
+                    f' frames ({record_stats["policy"]})'
+                )
+
+        # 寫入統計，列出寫入最慢的相機
+        write_stats = {
+            r['camera_id']: r['write_stats']
+            for r in self._reports if 'write_stats' in r
+        }
+        if len(write_stats) > 0:
+            camera_id, stats = max(
+                write_stats.items(),
+                key=lambda item: item[1]['write_latency_max']
+            )
+            log.info(
+                f'Slowest record write <{camera_id}>: '
+                f'{stats["write_latency_max"]:.1f}ms max, '
+                f'{stats["write_latency_avg"]:.1f}ms avg, '
+                f'queue depth {stats.get("queue_depth_max", -1)}'
+            )
+
         data = {
             'frame_range': (start_frame, end_frame),
             'size': size,
@@ -233,11 +260,15 @@ class SubmitReportContainer(ReportContainer):
         self._parameters = parameters
         self._progress_list = {}  # 進度表{相機ID: 進度(0~1)}
         self._complete_check_list = {}
+        self._encoded_list = {}  # 重新轉檔的數量{相機ID: 數量}
+        self._missing_list = {}  # 遺失的影格{相機ID: [影格]}
 
         # 先建立對應表
         for camera_id in setting.get_working_camera_ids():
             self._progress_list[camera_id] = 0
             self._complete_check_list[camera_id] = False
+            self._encoded_list[camera_id] = 0
+            self._missing_list[camera_id] = []
 
     def _import_report(self, report):
         """匯入報告"""
@@ -246,6 +277,10 @@ class SubmitReportContainer(ReportContainer):
         progress = report['progress']
         self._progress_list[report['camera_id']] = progress[0]
         self._complete_check_list[report['camera_id']] = progress[0] == progress[1]
+        self._encoded_list[report['camera_id']] = report.get('encoded', 0)
+        self._missing_list[report['camera_id']].extend(
+            report.get('missing', [])
+        )
 
         ui.dispatch_event(
             UIEventType.TICK_SUBMIT,
@@ -262,6 +297,18 @@ class SubmitReportContainer(ReportContainer):
 
     def _summarize_report(self):
         """總結"""
+        total_count = len(self._frames) * len(self._progress_list)
+        encoded_count = sum(self._encoded_list.values())
+        missing_count = sum(len(f) for f in self._missing_list.values())
+        log.info(
+            f'Submit transferred: {encoded_count} encoded, {missing_count}'
+            f' missing, {total_count - encoded_count - missing_count} verified'
+        )
+
+        for camera_id, frames in self._missing_list.items():
+            if len(frames) > 0:
+                log.warning(f'<{camera_id}> missing {len(frames)} frames')
+
         self._shot.submit(self._name, self._frames, self._parameters)
 
     def get_job_name(self):
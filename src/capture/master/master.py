@@ -26,7 +26,13 @@ def start_master():
             camera_manager.update_status(message)
 
         elif message.type is MessageType.SLAVE_DOWN:
-            camera_manager.stop_capture(message)
+            camera_manager.on_slave_lost(message)
+
+        elif message.type is MessageType.SLAVE_TIMEOUT:
+            camera_manager.on_slave_timeout(message)
+
+        elif message.type is MessageType.NODE_ANNOUNCE:
+            camera_manager.on_node_announced(message)
 
         elif message.type is MessageType.MASTER_DOWN:
             log.warning('Master closed')
@@ -38,9 +44,6 @@ def start_master():
         elif message.type is MessageType.SUBMIT_REPORT:
             camera_manager.collect_report(message)
 
-        elif message.type is MessageType.TRIGGER_REPORT:
-            camera_manager.collect_report(message)
-
     # 關閉通訊
     hardware_trigger.close()
     message_manager.stop()
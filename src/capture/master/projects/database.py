@@ -405,15 +405,31 @@ class ShotEntity(Entity):
 
         super().emit(event, entity)
 
-    def update_cache_progress(self, camera_pixmap):
-        self._memory += camera_pixmap.get_size()
+    def update_cache_progress(self, camera_pixmap, evicted=False):
+        """更新快取進度
+
+        Args:
+            camera_pixmap: 存入或被淘汰的 CameraPixmap
+            evicted: 是否是從快取淘汰
+
+        """
+        if evicted:
+            self._memory -= camera_pixmap.get_size()
+        else:
+            self._memory += camera_pixmap.get_size()
 
         if camera_pixmap.get_cache_type() is CameraCacheType.THUMBNAIL:
             thumb_origin = self._cache_progress[
                 CameraCacheType.THUMBNAIL
             ]
             unit = 1 / len(setting.get_working_camera_ids())
-            if camera_pixmap.frame not in thumb_origin:
+            if evicted:
+                if camera_pixmap.frame in thumb_origin:
+                    thumb_origin[camera_pixmap.frame] -= unit
+                    # 浮點誤差，剩不到半張視為沒有快取
+                    if thumb_origin[camera_pixmap.frame] < unit / 2:
+                        del thumb_origin[camera_pixmap.frame]
+            elif camera_pixmap.frame not in thumb_origin:
                 thumb_origin[camera_pixmap.frame] = unit
             else:
                 thumb_origin[camera_pixmap.frame] += unit
@@ -425,7 +441,10 @@ class ShotEntity(Entity):
             if camera_id not in progress_origin:
                 progress_origin[camera_id] = []
 
-            progress_origin[camera_id].append(camera_pixmap.frame)
+            if not evicted:
+                progress_origin[camera_id].append(camera_pixmap.frame)
+            elif camera_pixmap.frame in progress_origin[camera_id]:
+                progress_origin[camera_id].remove(camera_pixmap.frame)
 
         self.emit(EntityEvent.PROGRESS, self)
 
@@ -524,9 +543,22 @@ class JobEntity(Entity):
             self._repeater.stop()
             self.update({'state': 1})
 
-    def update_cache_progress(self, frame, size):
-        self._memory += size
-        self._cache_progress.append(frame)
+    def update_cache_progress(self, frame, size, evicted=False):
+        """更新快取進度
+
+        Args:
+            frame: 存入或被淘汰的影格
+            size: 快取大小
+            evicted: 是否是從快取淘汰
+
+        """
+        if evicted:
+            self._memory -= size
+            if frame in self._cache_progress:
+                self._cache_progress.remove(frame)
+        else:
+            self._memory += size
+            self._cache_progress.append(frame)
         self.emit(EntityEvent.PROGRESS, self)
 
     def get_cache_progress(self):
@@ -80,8 +80,15 @@ class ProjectManager():
         """選擇 Shot
 
         選擇 Shot 後，會在 self._selected_shots 新增以便之後快速存取
+        換到其他 Shot 時會取消原本 Shot 還在傳送的批次圖像
 
         """
+        if self.current_shot is not None and self.current_shot != shot:
+            message_manager.send_message(
+                MessageType.CANCEL_SHOT_IMAGES,
+                {'shot_id': self.current_shot.get_id()}
+            )
+
         if shot:
             log.info(f'Select shot: {shot}')
             if shot.get_id() not in self._selected_shots:
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import threading
+
+from utility.logger import log
+
+
+class ResolveArena():
+    """已解碼模型的共享記憶體快取
+
+    以 (job ID, 影格) 為 key 存放 ResolvePackage，幾何與貼圖都是解碼好的陣列
+    播放時直接取用共享記憶體上的陣列，不用再解壓縮
+    總大小超過上限時，從最久沒用到的開始淘汰並釋放共享記憶體
+    UI 還在顯示的陣列無法馬上釋放，先留著之後再試
+    ResolveManager、MultiExecutor 與 UI 在不同執行緒存取，所有操作都要上鎖
+
+    Args:
+        budget: 快取的大小上限 (bytes)
+
+    """
+
+    def __init__(self, budget):
+        self._lock = threading.Lock()
+        self._budget = budget  # 大小上限
+        self._size = 0  # 目前的總大小
+        self._packages = OrderedDict()  # {(job ID, 影格): ResolvePackage}
+        self._retired = []  # 淘汰了但還沒釋放的 ResolvePackage
+
+    def has(self, job_id, frame):
+        """是否有快取"""
+        with self._lock:
+            return (job_id, frame) in self._packages
+
+    def get_payload(self, job_id, frame):
+        """取得快取模型給 UI 的內容，沒有的話回傳 None
+
+        在鎖內取得陣列，避免取到一半被淘汰釋放
+
+        Args:
+            job_id: job ID
+            frame: 影格，None 為相機架
+
+        """
+        key = (job_id, frame)
+        with self._lock:
+            if key not in self._packages:
+                return None
+            self._packages.move_to_end(key)
+            return self._packages[key].to_payload()
+
+    def put(self, package):
+        """存入載入好的模型，回傳因為超過上限被淘汰的 ResolvePackage 列表
+
+        已經有快取的話釋放新的這份並回傳 None，不會重複計算大小
+
+        Args:
+            package: 已經 load 的 ResolvePackage
+
+        """
+        key = package.get_meta()
+        with self._lock:
+            if key in self._packages:
+                self._release(package)
+                return None
+
+            self._packages[key] = package
+            self._size += package.get_cache_size()
+
+            evicted = []
+            while self._size > self._budget and len(self._packages) > 1:
+                _, evicted_package = self._packages.popitem(last=False)
+                self._size -= evicted_package.get_cache_size()
+                self._release(evicted_package)
+                evicted.append(evicted_package)
+
+            self._release_retired()
+            return evicted
+
+    def _release(self, package):
+        if not package.release():
+            self._retired.append(package)
+
+    def _release_retired(self):
+        """重試釋放之前還在使用的共享記憶體"""
+        self._retired = [
+            package for package in self._retired if not package.release()
+        ]
+        if len(self._retired) > 0:
+            log.debug(f'Resolve arena: {len(self._retired)} blocks in use')
+
+    def get_size(self):
+        """取得目前的總大小"""
+        return self._size
+
+    def get_budget(self):
+        """取得大小上限"""
+        return self._budget
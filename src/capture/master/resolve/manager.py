@@ -1,6 +1,7 @@
 import threading
 from queue import Queue
 
+from utility.setting import setting
 from utility.define import UIEventType
 from utility.delay_executor import DelayExecutor
 
@@ -9,6 +10,7 @@ from master.projects import project_manager
 
 from .package import ResolvePackage, RigPackage
 from .multi_executor import MultiExecutor
+from .arena import ResolveArena
 
 
 class ResolveManager(threading.Thread):
@@ -16,7 +18,7 @@ class ResolveManager(threading.Thread):
         super().__init__()
 
         self._queue = Queue()
-        self._cache = {}
+        self._cache = ResolveArena(setting.resolve_cache_mb * 1024 ** 2)
         self._delay = DelayExecutor()
         self._multi_executor = MultiExecutor(self)
 
@@ -41,8 +43,10 @@ class ResolveManager(threading.Thread):
             self.send_ui(None)
             return
 
+        # 先取得陣列，存入快取後就算馬上被淘汰也能顯示
+        payload = package.to_payload()
         self.save_package(package)
-        self.send_ui(package)
+        self._send_payload(payload)
 
     def _send_payload(self, payload):
         ui.dispatch_event(
@@ -65,15 +69,25 @@ class ResolveManager(threading.Thread):
         self._queue.put(package)
 
     def save_package(self, package):
-        job_id, frame = package.get_meta()
-        if job_id not in self._cache:
-            self._cache[job_id] = {}
-
-        self._cache[job_id][frame] = package
+        _, frame = package.get_meta()
+        evicted = self._cache.put(package)
+        if evicted is None:
+            return
 
         if frame is not None:
+            self._update_cache_progress(package)
+
+        for evicted_package in evicted:
+            if evicted_package.get_meta()[1] is not None:
+                self._update_cache_progress(evicted_package, evicted=True)
+
+    def _update_cache_progress(self, package, evicted=False):
+        job_id, frame = package.get_meta()
+        try:
             job = project_manager.get_job(job_id)
-            job.update_cache_progress(frame, package.get_cache_size())
+        except KeyError:
+            return
+        job.update_cache_progress(frame, package.get_cache_size(), evicted)
 
     def cache_whole_job(self):
         job = project_manager.current_job
@@ -90,7 +104,7 @@ class ResolveManager(threading.Thread):
         self._multi_executor.add_task('cache_all', tasks)
 
     def has_cache(self, job_id, frame):
-        return job_id in self._cache and frame in self._cache[job_id]
+        return self._cache.has(job_id, frame)
 
     def request_geometry(
         self, job, frame, is_delay=True
@@ -99,9 +113,9 @@ class ResolveManager(threading.Thread):
         cali_id = job.get_cali_id()
 
         # get already cached
-        if self.has_cache(job_id, frame):
-            package = self._cache[job_id][frame]
-            self.send_ui(package)
+        payload = self._cache.get_payload(job_id, frame)
+        if payload is not None:
+            self._send_payload(payload)
 
         # load rig data
         elif frame is None:
@@ -1,24 +1,47 @@
 from queue import Queue
+import pickle
 import threading
+from multiprocessing import Manager
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from .package import RigPackage, ResolvePackage
 
 
-def load_geometry(job_id, cali_id, frame):
+def load_geometry(index, job_id, cali_id, frame, loaded, attached):
+    """在 worker 載入模型，透過 loaded 交給 master
+
+    Windows 的共享記憶體在所有 handle 關閉後就會消失
+    worker 要等 master 連上 (attached 被設定) 才關閉自己的 handle
+    之後共享記憶體只剩 master 持有，淘汰時就會真的釋放
+
+    Args:
+        index: 任務編號
+        job_id: job ID
+        cali_id: 校正 ID
+        frame: 影格，None 為相機架
+        loaded: 放 (任務編號, pickle 後的 package) 的 Queue，沒有檔案的話為 None
+        attached: master 連上共享記憶體後設定的 Event
+
+    """
     # check rig or 4df
     if frame is None:
         package = RigPackage(job_id, cali_id)
     else:
         package = ResolvePackage(job_id, frame)
 
-    result = package.load()
-
-    # no files
-    if result is None:
-        return None
+    data = None
+    try:
+        if package.load() is not None:
+            # 只 pickle 共享記憶體的名稱，master 直接連上解碼好的陣列
+            # 先轉成 bytes，Manager 的 process 不會連上共享記憶體
+            data = pickle.dumps(package)
+    finally:
+        # 出錯也要通知，master 才不會一直等
+        loaded.put((index, data))
 
-    return package
+    if data is not None:
+        attached.wait()
+        package.detach()
 
 
 def export_geometry(load_path, filename, frame, export_path):
@@ -45,19 +68,30 @@ class MultiExecutor(threading.Thread):
 
     def cache_all(self, tasks):
         future_list = []
-        with ProcessPoolExecutor() as executor:
-            for job_id, cali_id, f in tasks:
+        attached_list = []
+        with Manager() as manager, ProcessPoolExecutor() as executor:
+            loaded = manager.Queue()
+            for index, (job_id, cali_id, f) in enumerate(tasks):
+                attached = manager.Event()
                 future = executor.submit(
-                    load_geometry, job_id, cali_id, f
+                    load_geometry, index, job_id, cali_id, f, loaded, attached
                 )
                 future_list.append(future)
-
-            for future in as_completed(future_list):
-                package = future.result()
-                if package is not None:
-                    self._manager.save_package(package)
+                attached_list.append(attached)
+
+            for _ in range(len(tasks)):
+                index, data = loaded.get()
+                if data is not None:
+                    # 解開時連上共享記憶體，之後 worker 就可以關閉它的 handle
+                    try:
+                        self._manager.save_package(pickle.loads(data))
+                    finally:
+                        attached_list[index].set()
                 self._manager.send_ui(None)
 
+            for future in future_list:
+                future.result()
+
     def export_all(self, tasks):
         from utility.setting import setting
         import os
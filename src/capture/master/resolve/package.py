@@ -1,8 +1,9 @@
 import os
 import lz4framed
 import struct
+from multiprocessing import shared_memory
 from utility.setting import setting
-from common.jpeg_coder import jpeg_coder
+from common.jpeg_coder import jpeg_coder, JpegProfile
 from common.fourd_frame import FourdFrameManager
 import json
 import numpy as np
@@ -25,10 +26,116 @@ class CompressedCache:
         return len(self._data)
 
 
+class SharedBlock:
+    """解碼好的陣列放在同一塊共享記憶體
+
+    播放時直接取共享記憶體上的陣列，不用解壓縮也不用複製
+    pickle 時只會帶共享記憶體的名稱與排列，另一個 process 解開時直接連上
+    worker process 解碼後回傳給 master 只傳名稱，不會傳陣列內容
+
+    Args:
+        specs: 各陣列的 (形狀, dtype)，None 代表沒有這個陣列
+
+    """
+
+    align = 64  # 每個陣列的起始位置對齊
+
+    def __init__(self, specs):
+        self._layout = []  # 各陣列的 (位置, 形狀, dtype)
+        size = 0
+        for spec in specs:
+            if spec is None:
+                self._layout.append(None)
+                continue
+            shape, dtype = spec
+            dtype = np.dtype(dtype)
+            self._layout.append((size, tuple(shape), dtype.str))
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            size += -(-nbytes // self.align) * self.align
+
+        self._size = size  # 陣列的總大小
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(size, 1)
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """建立並複製陣列進去
+
+        Args:
+            arrays: 陣列列表，可以有 None
+
+        """
+        block = cls([
+            None if arr is None else (arr.shape, arr.dtype)
+            for arr in arrays
+        ])
+        for view, arr in zip(block.get_arrays(), arrays):
+            if arr is not None:
+                np.copyto(view, arr)
+        return block
+
+    def get_arrays(self):
+        """取得共享記憶體上的陣列"""
+        arrays = []
+        for layout in self._layout:
+            if layout is None:
+                arrays.append(None)
+                continue
+            # frombuffer 會佔用 buffer，陣列還在的話共享記憶體無法關閉
+            offset, shape, dtype = layout
+            arr = np.frombuffer(
+                self._shm.buf, dtype, int(np.prod(shape)), offset
+            )
+            arrays.append(arr.reshape(shape))
+        return arrays
+
+    def get_size(self):
+        return self._size
+
+    def detach(self):
+        """只關閉這個 process 的 handle，不刪除共享記憶體
+
+        worker 把共享記憶體交給 master 後呼叫，之後由 master 負責刪除
+
+        """
+        if self._shm is None:
+            return True
+
+        try:
+            self._shm.close()
+        except BufferError:
+            return False
+
+        self._shm = None
+        return True
+
+    def release(self):
+        """刪除共享記憶體
+
+        還有陣列在使用 (例如 UI 正在顯示) 的話無法關閉並回傳 False，之後要再呼叫一次
+
+        """
+        if self._shm is None:
+            return True
+
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+        try:
+            self._shm.close()
+        except BufferError:
+            return False
+
+        self._shm = None
+        return True
+
+
 class ResolvePackage:
     def __init__(self, job_id, frame):
-        self._geo_cache = None
-        self._tex_cache = None
+        self._block = None
         self._job_id = job_id
         self._frame = frame
         self._resolution = setting.max_display_resolution
@@ -42,20 +149,28 @@ class ResolvePackage:
         return self._job_id, self._frame
 
     def _cache_buffer(self, geo_data, texture_data):
-        self._geo_cache = (
-            CompressedCache(geo_data[0]),
-            CompressedCache(geo_data[1])
+        self._block = SharedBlock.from_arrays(
+            (geo_data[0], geo_data[1], texture_data)
         )
-        self._tex_cache = CompressedCache(texture_data)
 
     def get_cache_size(self):
-        return self._geo_cache[0].get_size() +\
-               self._geo_cache[1].get_size() +\
-               self._tex_cache.get_size()
+        return self._block.get_size()
+
+    def release(self):
+        """釋放快取的共享記憶體，還在使用無法釋放的話回傳 False"""
+        if self._block is None:
+            return True
+        return self._block.release()
+
+    def detach(self):
+        """關閉這個 process 的共享記憶體 handle，不刪除共享記憶體"""
+        if self._block is None:
+            return True
+        return self._block.detach()
 
     def load(self):
-        # if size is not None, means already loaded.
-        if self._geo_cache is not None:
+        # if block is not None, means already loaded.
+        if self._block is not None:
             return True
 
         # open file
@@ -94,28 +209,42 @@ class ResolvePackage:
         elif os.path.isfile(new_format_path):
             fourd_frame = FourdFrameManager.load(new_format_path)
             geo_data = fourd_frame.get_geo_data()
-            tex_data = fourd_frame.get_texture_data()
-            self._resolution = fourd_frame.get_texture_resolution()
+
+            # decode in the DCT domain close to the display resolution
+            tex_data = fourd_frame.get_texture_data(
+                profile=JpegProfile.from_parms(setting.jpeg.texture),
+                min_length=setting.max_display_resolution
+            )
+            self._resolution = tex_data.shape[1]
 
             # resize for better playback performance
             if self._resolution > setting.max_display_resolution:
-                tex_data = cv2.resize(
+                # resize straight into the shared memory block
+                resolution = setting.max_display_resolution
+                self._block = SharedBlock((
+                    (geo_data[0].shape, geo_data[0].dtype),
+                    (geo_data[1].shape, geo_data[1].dtype),
+                    ((resolution, resolution, 3), tex_data.dtype)
+                ))
+                pos_list, uv_list, texture = self._block.get_arrays()
+                np.copyto(pos_list, geo_data[0])
+                np.copyto(uv_list, geo_data[1])
+                cv2.resize(
                     tex_data,
-                    dsize=(
-                        setting.max_display_resolution,
-                        setting.max_display_resolution
-                    ),
+                    dsize=(resolution, resolution),
+                    dst=texture,
                     interpolation=cv2.INTER_CUBIC
                 )
-                self._resolution = setting.max_display_resolution
+                self._resolution = resolution
+                return True
 
             self._cache_buffer(geo_data, tex_data)
             return True
         return None
 
     def to_payload(self):
-        geo_data = (self._geo_cache[0].load(), self._geo_cache[1].load())
-        return len(geo_data[0]), geo_data, self._tex_cache.load(), self._resolution
+        pos_list, uv_list, texture = self._block.get_arrays()
+        return len(pos_list), (pos_list, uv_list), texture, self._resolution
 
 
 def build_camera_pos_list():
@@ -129,6 +258,7 @@ class RigPackage(ResolvePackage):
 
     def __init__(self, job_id, cali_id):
         super().__init__(job_id, None)
+        self._geo_cache = None
         self._cali_id = cali_id
 
     def load(self):
@@ -174,6 +304,12 @@ class RigPackage(ResolvePackage):
     def get_cache_size(self):
         return self._geo_cache.get_size()
 
+    def release(self):
+        return True
+
+    def detach(self):
+        return True
+
     def to_payload(self):
         geo_data = (self._geo_cache.load(), [])
         return len(geo_data[0]), geo_data, None, None
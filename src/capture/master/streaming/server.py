@@ -3,7 +3,7 @@ from threading import Thread, Condition
 
 from utility.setting import setting
 from utility.define import UIEventType
-from common.jpeg_coder import jpeg_coder
+from common.jpeg_coder import JpegProfile, TJPF_RGB
 
 from master.ui import ui
 
@@ -72,11 +72,14 @@ class StreamingServer(Thread):
             return f'focus {toggle}'
 
         def getImage():
+            profile = JpegProfile.from_parms(
+                setting.jpeg.live_view, quality=70
+            )
             while True:
                 image = self._get_buffer()
                 if image is None:
                     continue
-                data = jpeg_coder.encode(image, quality=70)
+                data = profile.encode(image, pixel_format=TJPF_RGB)
                 yield (
                     b'--frame\r\n'
                     b'Content-Type: image/jpeg\r\n\r\n' +
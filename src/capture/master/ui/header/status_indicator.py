@@ -33,7 +33,7 @@ class StatusIndicator(LayoutWidget):
     def _setup_ui(self):
         self.addWidget(ScreenButton())
         self.addWidget(TriggerButton())
-        for text in ('slaves', 'bias', 'cache_size'):
+        for text in ('slaves', 'bias', 'cache_size', 'connect_rate'):
             widget = StatusItem(text)
             self._widgets[text] = widget
             self.addWidget(widget)
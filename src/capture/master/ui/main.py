@@ -1,5 +1,7 @@
 import sys
-from PyQt5.Qt import QMainWindow, QApplication, Qt, QWidget
+from PyQt5.Qt import (
+    QMainWindow, QApplication, Qt, QWidget, QImage, QPixmap
+)
 
 from utility.define import UIEventType, BodyMode, CameraState
 from utility.logger import log
@@ -107,12 +109,18 @@ class MainWindow(QMainWindow):
                 state.set(f'pixmap_{camera_id}', pixmap)
 
         elif event.type is UIEventType.CAMERA_PIXMAP:
-            camera_id, pixmap, is_live_view = event.get_payload()
-            body_mode = state.get('body_mode')
-            if is_live_view and body_mode is not BodyMode.LIVEVIEW:
-                return
-            elif not is_live_view and body_mode is BodyMode.LIVEVIEW:
+            camera_id, image, is_live_view, release = event.get_payload()
+            is_shown = is_live_view is (
+                state.get('body_mode') is BodyMode.LIVEVIEW
+            )
+            pixmap = self._convert_to_pixmap(image) if is_shown else None
+
+            # QPixmap 已經複製了圖像，陣列還給解碼的 worker 重複使用
+            if release is not None:
+                release()
+            if not is_shown:
                 return
+
             state.set(f'pixmap_{camera_id}', pixmap)
             if state.get('closeup_camera') == camera_id:
                 state.set('pixmap_closeup', pixmap)
@@ -204,6 +212,23 @@ class MainWindow(QMainWindow):
         elif event.type is UIEventType.TICK_SUBMIT:
             state.set('tick_submit', event.get_payload())
 
+    @staticmethod
+    def _convert_to_pixmap(image):
+        """把 worker 解碼好的 RGB 圖像包成 QPixmap
+
+        Args:
+            image: RGB 圖像 (np.ndarray)，沒有圖像時為 None
+
+        """
+        if image is None:
+            return None
+
+        height, width, _ = image.shape
+        q_image = QImage(
+            image.data, width, height, 3 * width, QImage.Format_RGB888
+        )
+        return QPixmap.fromImage(q_image)
+
     def _on_project_list_open(self):
         if self._state.get('project_list_dialog'):
             from .projects import ProjectListDialog
@@ -4,7 +4,13 @@
 
 """
 
-from .system import CameraSystem
+import os
 
-from .connector import CameraConnector
-from .configurator import CameraConfigurator
+from ..submit_worker import WORKER_ENV
+
+# 發佈用的 worker process 只需要讀檔與轉檔，不載入相機系統跟連線
+if WORKER_ENV not in os.environ:
+    from .system import CameraSystem
+
+    from .connector import CameraConnector
+    from .configurator import CameraConfigurator
@@ -5,13 +5,15 @@ import PySpin
 
 from utility.define import CameraState
 from utility.setting import setting
+from utility.message import message_manager
 
 from .encoder import CameraLiveViewer, CameraShotLoader, CameraShotSubmitter
 from .recorder import CameraRecorder
 from .configurator import CameraConfigurator
-from .shot import CameraShotFileCore, CameraShotMeta
+from .shot import CameraShotFileCore, CameraShotMeta, CameraShotBatch
 from .image import CameraImage
 from .receiver import Receiver
+from .reporter import CameraStatusReporter
 
 
 class CameraConnector(Process):
@@ -38,6 +40,7 @@ class CameraConnector(Process):
         self._id = None  # 相機ID
         self._record_folder_path = setting.get_record_folder_path(camera_index)  # 錄製的資料夾路徑
         self._receiver = None
+        self._status_reporter = None  # 相機狀態推送器
         self._log = logger
 
         # 即時預覽
@@ -96,12 +99,14 @@ class CameraConnector(Process):
 
         # set attribute
         self._id = self._camera.GetUniqueID()
+        message_manager.announce([self._id])
         self._configurator = CameraConfigurator(self._camera, self._log)
         # self._log = get_prefix_log(f'<{self._id}> ')
 
         # set child threads
         self._live_viewer = CameraLiveViewer(self._id)
         self._receiver = Receiver(self, self._log)
+        self._status_reporter = CameraStatusReporter(self)
         self._shot_loader = CameraShotLoader(self._log)
         self._submitter = CameraShotSubmitter(self._log)
 
@@ -141,25 +146,29 @@ class CameraConnector(Process):
             self._current_frame = image_ptr.GetFrameID()
 
             # 判斷是否有開啟即時預覽或錄製，有的情況才執行影像處理
-            if self._is_live_view or self._is_recording:
-                camera_image = CameraImage(
-                    image_ptr.GetData(),
-                    image_ptr.GetWidth(),
-                    image_ptr.GetHeight()
+            if self._is_live_view and not self._is_recording:
+                self._live_viewer.set_buffer(
+                    CameraImage(
+                        image_ptr.GetData(),
+                        image_ptr.GetWidth(),
+                        image_ptr.GetHeight()
+                    )
                 )
 
-                if self._is_live_view and not self._is_recording:
-                    self._live_viewer.set_buffer(camera_image)
-
-                if self._is_recording:
-                    self._recorder.add_task(
-                        self._current_frame,
-                        camera_image
+            if self._is_recording:
+                # 錄製器會複製到自己的緩衝環，這裡直接使用 PySpin 的陣列
+                self._recorder.add_task(
+                    self._current_frame,
+                    CameraImage(
+                        image_ptr.GetNDArray(),
+                        image_ptr.GetWidth(),
+                        image_ptr.GetHeight()
                     )
+                )
 
-                    if self._stop_sign:
-                        if len(self._recorder.get_record_frames()) > 0:
-                            self._stop_recording()
+                if self._stop_sign:
+                    if len(self._recorder.get_record_frames()) > 0:
+                        self._stop_recording()
 
             image_ptr.Release()
 
@@ -187,6 +196,9 @@ class CameraConnector(Process):
         self._log.info(f'Change to state: {state.name}')
         self._state = state
 
+        if self._status_reporter is not None:
+            self._status_reporter.notify()
+
     def get_shot_file_path_for_recording(self, shot_id):
         """取得 shot 的檔案位置
 
@@ -196,6 +208,16 @@ class CameraConnector(Process):
         """
         return f'{self._record_folder_path}{shot_id}_{self._id}'
 
+    def get_shot_file_path_for_spill(self, shot_id):
+        """取得錄製 spill 暫存的檔案位置，放在下一顆錄製硬碟
+
+        Args:
+            shot_id: Shot ID
+
+        """
+        folder_path = setting.get_record_folder_path(self._camera_index + 1)
+        return f'{folder_path}{shot_id}_{self._id}_spill'
+
     def stop_capture(self):
         """停止擷取
 
@@ -220,6 +242,7 @@ class CameraConnector(Process):
             status['record_frames_count'] = len(
                 self._recorder.get_record_frames()
             )
+            status['record_stats'] = self._recorder.get_record_stats()
 
         return status
 
@@ -235,7 +258,10 @@ class CameraConnector(Process):
             {'shot_id': shot_id, 'camera_id': self._id, 'is_cali': is_cali},
             self.get_shot_file_path_for_recording(shot_id)
         )
-        self._recorder = CameraRecorder(shot_meta, self._log)
+        self._recorder = CameraRecorder(
+            shot_meta, self._log,
+            spill_path=self.get_shot_file_path_for_spill(shot_id)
+        )
         self._is_recording = True
         self._stop_sign = False
 
@@ -285,6 +311,38 @@ class CameraConnector(Process):
 
         self._shot_loader.add_task(meta)
 
+    def load_shot_images(self, parms):
+        """批次讀取 shot 圖像
+
+        Args:
+            parms: {camera_id, shot_id, batch_id, start_frame, end_frame,
+                    quality, scale_length, window}
+
+        """
+        batch = CameraShotBatch(
+            parms,
+            setting.get_shot_file_path(parms['shot_id'], parms['camera_id'])
+        )
+        self._shot_loader.add_batch(batch)
+
+    def ack_shot_images(self, parms):
+        """master 確認收到批次圖像
+
+        Args:
+            parms: {camera_id, batch_id, received}
+
+        """
+        self._shot_loader.ack_batch(parms)
+
+    def cancel_shot_images(self, shot_id):
+        """取消 shot 的批次讀取
+
+        Args:
+            shot_id: Shot ID
+
+        """
+        self._shot_loader.cancel_batch(shot_id)
+
     def change_parameter(self, parm_name, value):
         """更改相機參數
 
@@ -315,7 +373,8 @@ class CameraConnector(Process):
 
             for ext in (
                 CameraShotFileCore.image_ext,
-                CameraShotFileCore.meta_ext
+                CameraShotFileCore.meta_ext,
+                CameraShotFileCore.index_ext
             ):
                 file = shot_file_path + ext
                 if os.path.isfile(file):
@@ -340,5 +399,7 @@ class CameraConnector(Process):
         self._log.debug('Stop live viewer')
         self._shot_loader.stop()
         self._log.debug('Stop shot loader')
+        self._status_reporter.stop()
+        self._log.debug('Stop status reporter')
         del self._camera
         del self._configurator
@@ -1,13 +1,18 @@
-from threading import Condition
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from threading import Condition, Lock
+from collections import OrderedDict, deque
 import queue
 import os
 
 from utility.setting import setting
 from utility.message import message_manager
 from utility.mix_thread import MixThread
-from utility.define import MessageType
+from utility.define import MessageType, ShotLoaderTask
+from common.jpeg_coder import JpegProfile
 
-from .shot import CameraShotFileLoader
+from ..submit_worker import WORKER_ENV, initialize_worker
+from .shot import CameraShotFileLoader, CameraShotMeta
+from .submit import SubmitManifest, submit_frames
 
 
 class CameraLiveViewer(MixThread):
@@ -27,6 +32,9 @@ class CameraLiveViewer(MixThread):
             'quality': setting.jpeg.live_view.quality,
             'scale_length': setting.jpeg.live_view.scale_length
         }  # 預設編碼設定
+        self._profile = JpegProfile.from_parms(
+            setting.jpeg.live_view
+        )  # JPEG 編碼設定
         self._buffer = None  # 緩衝佇列
         self._cond = Condition()  # 緩衝鎖，以防衝突
 
@@ -41,7 +49,7 @@ class CameraLiveViewer(MixThread):
                 break
 
             encoded_data = camera_image.convert_jpeg(
-                **self._encode_parms
+                self._profile, self._encode_parms['scale_length']
             )
 
             message_manager.send_message(
@@ -61,6 +69,9 @@ class CameraLiveViewer(MixThread):
 
         """
         self._encode_parms.update(parms)
+        self._profile = JpegProfile.from_parms(
+            setting.jpeg.live_view, quality=self._encode_parms['quality']
+        )
 
     def set_buffer(self, camera_image):
         """設定圖像緩衝
@@ -104,6 +115,11 @@ class CameraShotLoader(MixThread):
 
     監控 self._queue 去讀取特定的圖像
     會看要讀取的圖像資訊去切換 self._file 的 CameraShotFileLoader
+    轉好的 JPEG 以 (shot 檔案, 影格, 品質, 最長邊) 存在有容量上限的 LRU
+    偵測到連續影格的請求時 (播放)，在佇列空閒時預先讀取轉檔後面的影格
+    請求到已快取的影格會直接回傳，不用等硬碟讀取與轉檔
+    批次請求 (CameraShotBatch) 在佇列空閒時逐張送出，未確認的張數到上限便暫停
+    同時只處理一個批次，新的批次或取消訊息會中斷目前的批次
 
     """
 
@@ -112,41 +128,239 @@ class CameraShotLoader(MixThread):
         self._log = log
         self._file = None  # CameraShotFileLoader
         self._queue = queue.Queue()  # 任務佇列
+        self._lock = Lock()  # 讀取與刪除 shot 的鎖
+        self._cache = OrderedDict()  # 轉好的 JPEG {key: 資料}
+        self._cache_bytes = 0  # 快取的總大小
+        self._cache_limit = setting.jpeg.shot.cache_mb * 1024 ** 2  # LRU 上限
+        self._prefetch_count = setting.jpeg.shot.prefetch_frames  # 預讀張數
+        self._prefetch_list = deque()  # 待預讀的 CameraShotMeta
+        self._last_request = None  # 上次請求的 (key 不含影格, 影格)
+        self._sequential_count = 0  # 連續影格請求次數
+        self._prefetch_end = None  # 預讀讀不到的 (key 不含影格, 影格)
+        self._batch = None  # 處理中的 CameraShotBatch
 
         self.start()
 
     def _run(self):
         while self._running:
-            shot_meta = self._queue.get()
-
-            if shot_meta is None:
+            # 有批次或預讀工作時，佇列空閒才做
+            if self._has_background_work():
+                try:
+                    task = self._queue.get_nowait()
+                except queue.Empty:
+                    with self._lock:
+                        if self._has_batch_credit():
+                            self._send_batch_frame()
+                        else:
+                            self._prefetch()
+                    continue
+            else:
+                task = self._queue.get()
+
+            if task is None:
                 break
 
-            shot_path = shot_meta.get_path()
-            if shot_path is None:
-                continue
+            task_type, payload = task
+
+            if task_type is ShotLoaderTask.LOAD:
+                with self._lock:
+                    self._load(payload)
+            elif task_type is ShotLoaderTask.BATCH:
+                self._start_batch(payload)
+            elif task_type is ShotLoaderTask.ACK:
+                self._ack_batch(payload)
+            elif task_type is ShotLoaderTask.CANCEL:
+                self._cancel_batch(payload)
+
+    def _has_batch_credit(self):
+        """批次是否還有可送的影格"""
+        return (
+            self._batch is not None and
+            not self._batch.is_done() and
+            self._batch.has_credit()
+        )
+
+    def _has_background_work(self):
+        return self._has_batch_credit() or len(self._prefetch_list) > 0
+
+    def _get_key(self, shot_meta, frame=None):
+        """取得快取的 key"""
+        return (
+            shot_meta.get_path(),
+            shot_meta.frame if frame is None else frame,
+            shot_meta.quality,
+            shot_meta.scale_length
+        )
+
+    def _load(self, shot_meta):
+        """回應圖像請求，並依請求模式安排預讀"""
+        if shot_meta.get_path() is None:
+            return
+
+        key = self._get_key(shot_meta)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            encoded_data = self._cache[key]
+        else:
+            encoded_data = self._encode(shot_meta)
+
+        if encoded_data is None:
+            return
+
+        message_manager.send_message(
+            MessageType.SHOT_IMAGE,
+            shot_meta.get_parms(),
+            encoded_data
+        )
+
+        self._schedule_prefetch(shot_meta)
+
+    def _encode(self, shot_meta):
+        """讀取並轉檔，結果存進快取"""
+        shot_path = shot_meta.get_path()
+
+        # 如果 self._file 是空的或者不是所需的檔案路徑，取代掉
+        if not (
+            self._file is not None and
+            self._file.get_path() == shot_path
+        ):
+            if isinstance(self._file, CameraShotFileLoader):
+                self._file.close()
+            self._file = CameraShotFileLoader(shot_path, self._log)
 
-            # 如果 self._file 是空的或者不是所需的檔案路徑，取代掉
-            if not (
-                self._file is not None and
-                self._file.get_path() == shot_path
-            ):
-                if isinstance(self._file, CameraShotFileLoader):
-                    self._file.close()
-                self._file = CameraShotFileLoader(shot_path, self._log)
+        camera_image = self._file.load(shot_meta.frame)
+        if camera_image is None:
+            return None
 
-            camera_image = self._file.load(shot_meta.frame)
-            if camera_image is None:
+        encoded_data = camera_image.convert_jpeg(
+            JpegProfile.from_parms(
+                setting.jpeg.shot, quality=shot_meta.quality
+            ),
+            shot_meta.scale_length
+        )
+
+        self._cache[self._get_key(shot_meta)] = encoded_data
+        self._cache_bytes += len(encoded_data)
+        while self._cache_bytes > self._cache_limit:
+            _, data = self._cache.popitem(last=False)
+            self._cache_bytes -= len(data)
+
+        return encoded_data
+
+    def _schedule_prefetch(self, shot_meta):
+        """偵測連續影格請求，安排預讀後面的影格
+
+        同一個 shot 與參數的請求影格是上一次的下一格才算連續
+        連續兩次以上才開始預讀，請求模式改變就清掉原本的預讀
+
+        """
+        request = self._get_key(shot_meta, frame=-1)
+        frame = shot_meta.frame
+
+        if (
+            self._last_request is not None and
+            self._last_request == (request, frame - 1)
+        ):
+            self._sequential_count += 1
+        else:
+            self._sequential_count = 0
+            self._prefetch_list.clear()
+
+        self._last_request = (request, frame)
+
+        if self._sequential_count < 2:
+            return
+
+        # 補上還沒快取也還沒排入的影格，不超過讀不到的影格
+        end_frame = frame + 1 + self._prefetch_count
+        if (
+            self._prefetch_end is not None and
+            self._prefetch_end[0] == request
+        ):
+            end_frame = min(end_frame, self._prefetch_end[1])
+
+        scheduled = set(meta.frame for meta in self._prefetch_list)
+        for next_frame in range(frame + 1, end_frame):
+            if (
+                next_frame in scheduled or
+                self._get_key(shot_meta, next_frame) in self._cache
+            ):
                 continue
+            self._prefetch_list.append(CameraShotMeta(
+                dict(shot_meta.get_parms(), frame=next_frame),
+                shot_meta.get_path()
+            ))
+
+        # 已經播過的影格不用預讀
+        while (
+            len(self._prefetch_list) > 0 and
+            self._prefetch_list[0].frame <= frame
+        ):
+            self._prefetch_list.popleft()
 
-            message_manager.send_message(
-                MessageType.SHOT_IMAGE,
-                shot_meta.get_parms(),
-                camera_image.convert_jpeg(
-                    shot_meta.quality,
-                    shot_meta.scale_length
-                )
+    def _prefetch(self):
+        """預讀一張影格，讀不到代表到 shot 結尾，停止預讀"""
+        if len(self._prefetch_list) == 0:
+            return
+
+        shot_meta = self._prefetch_list.popleft()
+        if self._get_key(shot_meta) in self._cache:
+            return
+
+        if self._encode(shot_meta) is None:
+            self._prefetch_end = (
+                self._get_key(shot_meta, frame=-1), shot_meta.frame
             )
+            self._prefetch_list.clear()
+
+    def _start_batch(self, batch):
+        """開始批次請求，取代目前的批次"""
+        if self._batch is not None and not self._batch.is_done():
+            self._log.info(f'Batch {self._batch.batch_id} replaced')
+
+        self._batch = batch
+        self._log.info(
+            f'Batch {batch.batch_id}: {batch.shot_id} '
+            f'({batch.start_frame}-{batch.end_frame})'
+        )
+
+    def _ack_batch(self, parms):
+        """master 確認收到批次的張數"""
+        batch = self._batch
+        if batch is not None and batch.batch_id == parms['batch_id']:
+            batch.ack(parms['received'])
+
+    def _cancel_batch(self, shot_id):
+        """取消指定 shot 的批次"""
+        if self._batch is not None and self._batch.shot_id == shot_id:
+            self._batch.cancel()
+            self._log.info(f'Batch {self._batch.batch_id} cancelled')
+            self._batch = None
+
+    def _send_batch_frame(self):
+        """送出批次的下一張影格，讀不到的影格略過"""
+        batch = self._batch
+        shot_meta = batch.next_meta()
+
+        if batch.get_path() is not None:
+            key = self._get_key(shot_meta)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                encoded_data = self._cache[key]
+            else:
+                encoded_data = self._encode(shot_meta)
+
+            if encoded_data is not None:
+                message_manager.send_message(
+                    MessageType.SHOT_IMAGE,
+                    shot_meta.get_parms(),
+                    encoded_data
+                )
+                batch.on_sent()
+
+        if batch.is_done():
+            self._log.info(f'Batch {batch.batch_id} finished')
+            self._batch = None
 
     def add_task(self, shot_meta):
         """將讀取圖像資訊放到佇列
@@ -155,24 +369,68 @@ class CameraShotLoader(MixThread):
             shot_meta: CameraShotMeta 物件
 
         """
-        self._queue.put(shot_meta)
+        self._queue.put((ShotLoaderTask.LOAD, shot_meta))
+
+    def add_batch(self, batch):
+        """將批次請求放到佇列
+
+        Args:
+            batch: CameraShotBatch 物件
+
+        """
+        self._queue.put((ShotLoaderTask.BATCH, batch))
+
+    def ack_batch(self, parms):
+        """將批次確認放到佇列
+
+        Args:
+            parms: {camera_id, batch_id, received}
+
+        """
+        self._queue.put((ShotLoaderTask.ACK, parms))
+
+    def cancel_batch(self, shot_id):
+        """將取消批次放到佇列
+
+        Args:
+            shot_id: 要取消的 shot ID
+
+        """
+        self._queue.put((ShotLoaderTask.CANCEL, shot_id))
 
     def on_shot_will_remove(self, remove_shot_file_path):
         """當有 Shot 刪除時
 
         檢查要刪除的 Shot 自己的 self._file 是否開啟
-        如果有開啟就關閉以便刪除
+        如果有開啟就關閉以便刪除，並清掉該 Shot 的快取、預讀與批次
 
         """
-        if (
-            self._file is not None and
-            self._file.get_path() == remove_shot_file_path
-        ):
-            self._file.close()
-            self._file = None
+        with self._lock:
+            if (
+                self._file is not None and
+                self._file.get_path() == remove_shot_file_path
+            ):
+                self._file.close()
+                self._file = None
+
+            for key in list(self._cache.keys()):
+                if key[0] == remove_shot_file_path:
+                    self._cache_bytes -= len(self._cache.pop(key))
+
+            if (
+                self._batch is not None and
+                self._batch.get_path() == remove_shot_file_path
+            ):
+                self._batch.cancel()
+
+            self._prefetch_end = None
+            self._prefetch_list = deque(
+                shot_meta for shot_meta in self._prefetch_list
+                if shot_meta.get_path() != remove_shot_file_path
+            )
 
     def _after_stop(self):
-        self.add_task(None)
+        self._queue.put(None)
         self.join()
 
 
@@ -181,6 +439,8 @@ class CameraShotSubmitter(MixThread):
 
     監控 self._queue 去讀取特定的 Shot
     將 Shot 轉換出需要範圍的圖像並發佈到解算伺服器
+    轉檔以相機跟影格段落分工給 process pool，每完成一段便回報該相機的進度
+    已發佈的圖像記錄在 SubmitManifest，驗證無誤的影格不會重新轉檔
 
     """
 
@@ -209,57 +469,104 @@ class CameraShotSubmitter(MixThread):
             os.makedirs(submit_image_path, exist_ok=True)
             self._log.debug(f'Save to {submit_image_path}')
 
-            # 取出圖像
-            for camera_id, shot_file_path in shot_file_paths.items():
-                file_loader = CameraShotFileLoader(
-                    shot_file_path, self._log
-                )
+            self._submit(
+                shot_id, job_name, frames, shot_file_paths, submit_image_path
+            )
+
+    def _submit(
+        self, shot_id, job_name, frames, shot_file_paths, submit_image_path
+    ):
+        """以 process pool 轉檔發佈
+
+        Args:
+            shot_id: Shot ID
+            job_name: 發佈名稱
+            frames: 要發佈的影格
+            shot_file_paths: {相機 ID: shot 檔案位置}
+            submit_image_path: 發佈資料夾
+
+        """
+        # 進度定義
+        progress = {camera_id: 0 for camera_id in shot_file_paths}
+        encoded = {camera_id: 0 for camera_id in shot_file_paths}
+        total_count = len(frames)
+        manifests = {
+            camera_id: SubmitManifest(submit_image_path, shot_id, camera_id)
+            for camera_id in shot_file_paths
+        }
+        chunk_size = setting.submit_chunk_frames
+
+        def report(camera_id, chunk, missing_frames, encoded_count):
+            """整理進度並傳送進度報告"""
+            for frame in missing_frames:
+                self._log.error(f'{camera_id} missing frame {frame}')
+
+            progress[camera_id] += len(chunk)
+            encoded[camera_id] += encoded_count
 
-                # 進度定義
-                current_count = 0
-                total_count = len(frames)
-
-                for frame in frames:
-                    camera_image = file_loader.load(frame)
-
-                    if camera_image is not None:
-                        image_path = (
-                            f'{submit_image_path}{camera_id}_{frame:06d}.jpg'
-                        )
-
-                        # 檢查是否有存在的檔案並大小差不多
-                        is_exist = False
-                        if os.path.isfile(image_path):
-                            exist_size = os.stat(image_path).st_size
-
-                            # 大小超過閥值，略過
-                            if exist_size > setting.bypass_exist_size:
-                                is_exist = True
-
-                        # 轉檔與儲存
-                        if not is_exist:
-                            jpg_data = camera_image.convert_jpeg(
-                                setting.jpeg.submit.quality
-                            )
-                            with open(image_path, 'wb') as f:
-                                f.write(jpg_data)
-
-                    else:
-                        self._log.error(f'{camera_id} missing frame {frame}')
-
-                    # 進度整理
-                    current_count += 1
-
-                    # 傳送進度報告
-                    message_manager.send_message(
-                        MessageType.SUBMIT_REPORT,
-                        {
-                            'camera_id': camera_id,
-                            'shot_id': shot_id,
-                            'job_name': job_name,
-                            'progress': (current_count, total_count)
-                        }
+            message_manager.send_message(
+                MessageType.SUBMIT_REPORT,
+                {
+                    'camera_id': camera_id,
+                    'shot_id': shot_id,
+                    'job_name': job_name,
+                    'progress': (progress[camera_id], total_count),
+                    'encoded': encoded[camera_id],
+                    'missing': missing_frames
+                }
+            )
+
+        # worker 初始化時設定 WORKER_ENV，不會建立相機系統
+        with ProcessPoolExecutor(
+            setting.submit_workers,
+            initializer=initialize_worker,
+            initargs=({WORKER_ENV: '1'},)
+        ) as executor:
+            future_chunks = {}  # {future: (相機 ID, 影格)}
+            for camera_id, shot_file_path in shot_file_paths.items():
+                # 沒有檔案的相機全部回報遺失，master 才會收到完成的進度
+                if shot_file_path is None:
+                    self._log.error(f'{camera_id} shot file not found')
+                    report(camera_id, frames, list(frames), 0)
+                    continue
+
+                for i in range(0, total_count, chunk_size):
+                    chunk = frames[i:i + chunk_size]
+                    future = executor.submit(
+                        submit_frames,
+                        camera_id,
+                        shot_file_path,
+                        chunk,
+                        submit_image_path,
+                        JpegProfile.from_parms(setting.jpeg.submit),
+                        manifests[camera_id].get_entries(chunk)
+                    )
+                    future_chunks[future] = (camera_id, chunk)
+
+            for future in as_completed(future_chunks):
+                camera_id, chunk = future_chunks[future]
+                try:
+                    (
+                        _, _, missing_frames, entries, encoded_count
+                    ) = future.result()
+                except Exception as error:
+                    # 失敗的段落視為遺失，進度照樣推進
+                    self._log.error(
+                        f'{camera_id} submit failed'
+                        f' ({chunk[0]}-{chunk[-1]}): {error}'
                     )
+                    report(camera_id, chunk, list(chunk), 0)
+                    continue
+
+                # 每完成一段便存清單，中斷後可以接續
+                manifests[camera_id].update(entries)
+                report(camera_id, chunk, missing_frames, encoded_count)
+
+        for camera_id, count in encoded.items():
+            self._log.info(
+                f'{camera_id} submitted: {count} encoded,'
+                f' {progress[camera_id] - count} verified or missing'
+            )
 
     def add_task(self, task):
         """將要發佈的 Shot 資訊放到佇列
@@ -1,8 +1,6 @@
 import cv2
 import numpy as np
 
-from common.jpeg_coder import jpeg_coder
-
 
 class CameraImage():
     """相機圖像
@@ -22,13 +20,44 @@ class CameraImage():
         self._height = height  # 圖像高
 
     def _raw_to_cv2(self):
-        """將二進制陣列轉成 cv2 的圖像"""
+        """將二進制陣列轉成 cv2 的圖像
+
+        OpenCV 的 Bayer 命名與實際排列差一格，RGGB 用 BAYER_RG2RGB
+        轉出來的通道順序其實是 BGR，跟 cv2 與 JPEG 預設的 TJPF_BGR 一致
+
+        """
         im = np.frombuffer(self._data, dtype=np.uint8)
         im = im.reshape((self._height, self._width))
         im = cv2.cvtColor(im, cv2.COLOR_BAYER_RG2RGB)
         return im
 
-    def _rescale(self, image, scale_length):
+    def _raw_to_binned(self, step):
+        """將二進制陣列以 2x2 超像素直接轉成縮小的 cv2 圖像
+
+        每隔 step 個 2x2 的 Bayer 區塊取一個組成一個像素，綠色取兩點平均
+        省去全尺寸的 demosaic，通道順序與 _raw_to_cv2 相同
+
+        Args:
+            step: 取樣間隔(超像素)
+
+        """
+        stride = step * 2
+        h = self._height // stride
+        w = self._width // stride
+
+        im = np.frombuffer(self._data, dtype=np.uint8)
+        im = im.reshape((self._height, self._width))
+        im = im[:h * stride, :w * stride]
+
+        binned = np.empty((h, w, 3), np.uint8)
+        binned[..., 0] = im[1::stride, 1::stride]
+        green = im[0::stride, 1::stride].astype(np.uint16)
+        green += im[1::stride, 0::stride]
+        binned[..., 1] = green >> 1
+        binned[..., 2] = im[0::stride, 0::stride]
+        return binned
+
+    def _rescale(self, image, scale_length, interpolation=cv2.INTER_LINEAR):
         """縮放圖像
 
         縮放圖像，最長邊會等於指定的長度
@@ -36,6 +65,7 @@ class CameraImage():
         Args:
             image: 圖像
             scale_length: 最長邊長度
+            interpolation: cv2 縮放方式
 
         """
         if self._width > self._height:
@@ -44,23 +74,40 @@ class CameraImage():
         else:
             sh = scale_length
             sw = int(scale_length * self._width / self._height)
-        return cv2.resize(image, (sw, sh))
+        return cv2.resize(image, (sw, sh), interpolation=interpolation)
 
-    def convert_jpeg(self, quality, scale_length=None):
+    def convert_jpeg(self, profile, scale_length=None):
         """轉成JPEG
 
         傳送到 master 前的壓縮，scale_length 指定的話就會縮放影像
+        縮小很多的情況 (預覽、縮圖)，先取樣 2x2 超像素到約兩倍目標尺寸再縮放
+        跳過全尺寸的 demosaic
+        品質、色度取樣等編碼設定由 profile 決定，gray 取樣會轉成灰階再編碼
 
         Args:
-            quality: JPEG品質
+            profile: JpegProfile
             scale_length: 最長邊長度
 
         """
-        im = self._raw_to_cv2()
-        if scale_length is not None:
-            im = self._rescale(im, scale_length)
+        if scale_length is None:
+            im = self._raw_to_cv2()
+        else:
+            # 超像素取樣間隔，讓取樣結果保有兩倍目標尺寸
+            step = max(self._width, self._height) // (scale_length * 4)
+
+            # 間隔太小的話超像素不比 demosaic 快
+            if step >= 2:
+                im = self._rescale(
+                    self._raw_to_binned(step), scale_length, cv2.INTER_AREA
+                )
+            else:
+                im = self._rescale(self._raw_to_cv2(), scale_length)
+
+        # 兩種取樣的通道順序都是 BGR
+        if profile.subsample == 'gray':
+            im = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
 
-        return jpeg_coder.encode(im, quality=quality)
+        return profile.encode(im)
 
     def save_png(self, path):
         im = self._raw_to_cv2()
@@ -72,7 +119,19 @@ class CameraImage():
         將自身資料寫入到指定檔案裏頭
 
         """
-        np.save(file, self._data, False, False)
+        np.save(file, self._data, allow_pickle=False)
+
+    def write_raw(self, file):
+        """寫入原始資料
+
+        不含 npy 標頭，直接將二進制陣列寫入檔案
+
+        """
+        file.write(self._data)
+
+    def get_data(self):
+        """取得二進制陣列"""
+        return self._data
 
     def get_size(self):
         """取得圖像尺寸"""
@@ -28,6 +28,15 @@ class Receiver(MixThread):
             elif message.type is MessageType.GET_SHOT_IMAGE:
                 self._load_shot_image(message)
 
+            elif message.type is MessageType.GET_SHOT_IMAGES:
+                self._load_shot_images(message)
+
+            elif message.type is MessageType.SHOT_IMAGES_ACK:
+                self._ack_shot_images(message)
+
+            elif message.type is MessageType.CANCEL_SHOT_IMAGES:
+                self._camera_connector.cancel_shot_images(message.unpack())
+
             elif message.type is MessageType.RETRIGGER:
                 self._camera_connector.retrigger()
 
@@ -43,6 +52,10 @@ class Receiver(MixThread):
             elif message.type is MessageType.CAMERA_STATUS:
                 self._report_status()
 
+            elif message.type is MessageType.MASTER_LOST:
+                # 暫時斷線，相機繼續擷取，等 session 恢復
+                self._log.warning('Master lost, keep capturing')
+
             elif message.type is MessageType.MASTER_DOWN:
                 break
 
@@ -106,6 +119,28 @@ class Receiver(MixThread):
         if camera_id == self._camera_connector.get_id():
             self._camera_connector.load_shot_image(parms)
 
+    def _load_shot_images(self, message):
+        """批次讀取錄製的圖像
+
+        Args:
+            message: 批次讀取圖像訊息
+
+        """
+        parms = message.unpack()
+        if parms['camera_id'] == self._camera_connector.get_id():
+            self._camera_connector.load_shot_images(parms)
+
+    def _ack_shot_images(self, message):
+        """批次圖像的確認
+
+        Args:
+            message: 批次確認訊息
+
+        """
+        parms = message.unpack()
+        if parms['camera_id'] == self._camera_connector.get_id():
+            self._camera_connector.ack_shot_images(parms)
+
     def _change_parameter(self, message):
         """更改相機參數
 
@@ -177,6 +212,7 @@ class Receiver(MixThread):
         ))
 
     def _report_status(self):
+        """回報完整的相機狀態，平時由 CameraStatusReporter 推送"""
         message_manager.send_message(
             MessageType.CAMERA_STATUS,
             {self._camera_connector.get_id(): self._camera_connector.get_status()}
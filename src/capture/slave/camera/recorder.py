@@ -1,62 +1,288 @@
-import queue
+from threading import Condition
+from collections import deque
+import numpy as np
+import time
+import os
 
 from utility.mix_thread import MixThread
+from utility.setting import setting
 from utility.message import message_manager
 from utility.define import MessageType
 
-from .shot import CameraShotFileDumper
+from .shot import CameraShotFileDumper, CameraShotFileLoader
+from .image import CameraImage
+
+
+class CameraFrameRing():
+    """錄製圖像緩衝環
+
+    擷取端把圖像複製到空的槽位，寫入端依序取出寫入，寫完再歸還槽位
+    槽位在第一張圖像進來時依大小一次配置，之後不再配置記憶體
+    槽位用完時依呼叫端的選擇等待、捨棄最舊的圖像或直接回報放不下
+
+    Args:
+        capacity: 槽位數量
+
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity  # 槽位數量
+        self._slots = []  # 預先配置的圖像陣列
+        self._free = deque()  # 空的槽位
+        self._pending = deque()  # 待寫入的 (影格, 槽位, 寬, 高)
+        self._cond = Condition()
+
+    def _allocate(self, nbytes):
+        """依圖像大小配置所有槽位"""
+        self._slots = [
+            np.empty(nbytes, np.uint8) for _ in range(self._capacity)
+        ]
+        self._free.extend(range(self._capacity))
+
+    def put(self, frame, camera_image, block=False, drop_oldest=False):
+        """放入圖像
+
+        回傳 (是否放入, 被捨棄的影格)
+
+        Args:
+            frame: 影格編號
+            camera_image: CameraImage
+            block: 沒有空槽位時是否等待
+            drop_oldest: 沒有空槽位時是否捨棄最舊的圖像
+
+        """
+        data = camera_image.get_data()
+        dropped_frame = None
+
+        with self._cond:
+            if len(self._slots) == 0:
+                self._allocate(data.nbytes)
+
+            if len(self._free) == 0:
+                if block:
+                    while len(self._free) == 0:
+                        self._cond.wait(1.0)
+                elif drop_oldest and len(self._pending) > 0:
+                    dropped_frame, slot, _, _ = self._pending.popleft()
+                    self._free.append(slot)
+                else:
+                    return False, None
+
+            slot = self._free.popleft()
+
+        # 複製在鎖外面做，不阻擋寫入端
+        np.copyto(self._slots[slot], data.reshape(-1))
+
+        width, height = camera_image.get_size()
+        with self._cond:
+            self._pending.append((frame, slot, width, height))
+            self._cond.notify_all()
+
+        return True, dropped_frame
+
+    def put_stop(self):
+        """放入終止事件，不佔用槽位"""
+        with self._cond:
+            self._pending.append((None, None, None, None))
+            self._cond.notify_all()
+
+    def get(self):
+        """取出待寫入的圖像，沒有的話等待
+
+        回傳 (影格, 槽位, CameraImage)，終止事件的槽位為 None
+
+        """
+        with self._cond:
+            while len(self._pending) == 0:
+                self._cond.wait()
+            frame, slot, width, height = self._pending.popleft()
+
+        if slot is None:
+            return None, None, None
+
+        return frame, slot, CameraImage(self._slots[slot], width, height)
+
+    def release(self, slot):
+        """歸還寫完的槽位"""
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def get_depth(self):
+        """取得待寫入的數量"""
+        return len(self._pending)
+
+
+class CameraRingWriter(MixThread):
+    """緩衝環寫入器
+
+    不斷從 CameraFrameRing 取出圖像寫到 CameraShotFileDumper
+    收到終止事件時結束，檔案交由呼叫端關閉
+
+    Args:
+        ring: CameraFrameRing
+        dumper: CameraShotFileDumper
+
+    """
+
+    def __init__(self, ring, dumper):
+        super().__init__()
+        self._ring = ring
+        self._dumper = dumper
+        self._depth_max = 0  # 緩衝環累積的最大數量
+
+        self.start()
+
+    def _run(self):
+        while True:
+            self._depth_max = max(self._depth_max, self._ring.get_depth())
+            frame, slot, camera_image = self._ring.get()
+
+            if slot is None:
+                break
+
+            self._dumper.dump(frame, camera_image)
+            self._ring.release(slot)
+
+    def _stop(self):
+        self._ring.put_stop()
+
+    def _after_stop(self):
+        self.join()
+
+    def get_depth_max(self):
+        """取得緩衝環累積的最大數量"""
+        return self._depth_max
 
 
 class CameraRecorder(MixThread):
     """相機錄製器
 
     根據 shot 資訊建立 CameraShotFileDumper
-    並監控 self._queue 將圖像給 CameraShotFileDumper
+    擷取的圖像放進預先配置的 CameraFrameRing，由 thread 取出寫入
+    緩衝環滿的時候依 setting.record.overflow_policy 處理:
+        block: 擷取端等待空槽位
+        drop_oldest: 捨棄最舊還沒寫入的圖像
+        spill: 寫到另一顆硬碟的暫存 shot，錄製結束後併回主檔案
+    每個決策都會計數，放在相機狀態與錄製報告
     錄製結束時會回傳錄製報告
 
     Args:
         shot_meta: Shot 資訊
+        spill_path: spill 暫存 shot 檔案位置
 
     """
 
-    def __init__(self, shot_meta, log):
+    overflow_policies = ('block', 'drop_oldest', 'spill')
+
+    def __init__(self, shot_meta, log, spill_path=None):
         super().__init__()
         self._log = log
         self._shot_meta = shot_meta  # Shot 資訊
-        self._queue = queue.Queue()  # 任務佇列
+        self._spill_path = spill_path  # spill 暫存 shot 檔案位置
+        self._policy = setting.record.overflow_policy  # 緩衝環滿的處理方式
+        self._ring = CameraFrameRing(setting.record.ring_capacity)
+        self._spill_ring = None  # spill 用的緩衝環
+        self._spill_writer = None  # spill 用的寫入器
+        self._spill_file = None  # spill 用的 CameraShotFileDumper
         self._file = None  # 將資料給 thread 做
         self._count = 0
+        self._stats = {
+            'queued': 0,  # 放入緩衝環
+            'blocked': 0,  # 等待空槽位
+            'blocked_time': 0.0,  # 等待空槽位的總時間(秒)
+            'dropped': 0,  # 捨棄
+            'spilled': 0  # 寫到 spill
+        }
+        self._dropped_frames = []  # 捨棄的影格
+
+        if self._policy not in self.overflow_policies:
+            self._log.error(
+                f'Unknown overflow policy <{self._policy}>, use block'
+            )
+            self._policy = 'block'
+
+        if self._policy == 'spill' and self._spill_path is None:
+            self._log.error('No spill path, use block')
+            self._policy = 'block'
 
         self.start()
 
+    def _build_dumper(self, shot_file_path):
+        """依 setting 建立 CameraShotFileDumper"""
+        return CameraShotFileDumper(
+            shot_file_path, self._log,
+            raw_format=setting.record.raw_format,
+            buffer_size=setting.record.write_buffer_mb * 1024 ** 2,
+            block_size=setting.record.write_block_kb * 1024,
+            meta_batch=setting.record.meta_batch,
+            fsync_interval=setting.record.fsync_interval
+        )
+
     def _run(self):
         # 負責錄製檔案寫入
-        self._file = CameraShotFileDumper(self._shot_meta.get_path(), self._log)
+        self._file = self._build_dumper(self._shot_meta.get_path())
+        writer = CameraRingWriter(self._ring, self._file)
+        writer.join()
 
-        while True:
-            frame, camera_image = self._queue.get()
+        self._stop_record(writer.get_depth_max())
 
-            # 偵測是否是終止事件 (None, None)
-            if camera_image is None:
-                self._stop_record()
-                break
+    def _stop(self):
+        """停止錄製，利用放入終止事件的方式終止運作"""
+        self._ring.put_stop()
 
-            self._file.dump(frame, camera_image)
+    def _stop_spill(self):
+        """停止 spill 寫入，並將 spill 的圖像併回主檔案"""
+        if self._spill_writer is None:
+            return
 
-    def _stop(self):
-        """停止錄製，利用餵 None tuple 的方式終止運作"""
-        self.add_task(None, None)
+        self._spill_writer.stop()
+        spill_file = self._spill_file
+        spill_file.close()
+
+        if len(spill_file.get_frames()) > 0:
+            self._log.info(
+                f'Merge {len(spill_file.get_frames())} spilled frames'
+            )
+            loader = CameraShotFileLoader(
+                self._spill_path, self._log,
+                use_mmap=False, use_index_cache=False
+            )
+            for frame in spill_file.get_frames():
+                camera_image = loader.load(frame)
+                if camera_image is not None:
+                    self._file.dump(frame, camera_image)
+            loader.close()
 
-    def _stop_record(self):
+        for ext in (
+            CameraShotFileDumper.image_ext,
+            CameraShotFileDumper.meta_ext
+        ):
+            file = self._spill_path + ext
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def _stop_record(self, depth_max):
         """停止運作，將錄製做收尾，並整理錄製報告傳給 master"""
-        report = self._file.get_report()
+        self._stop_spill()
         self._file.close()
+        report = self._file.get_report()
+        report['write_stats']['queue_depth_max'] = depth_max
+
+        record_stats = self.get_record_stats()
+        record_stats['dropped_frames'] = self._dropped_frames
 
         report.update({
             'camera_id': self._shot_meta.camera_id,
-            'shot_id': self._shot_meta.shot_id
+            'shot_id': self._shot_meta.shot_id,
+            'record_stats': record_stats
         })
 
+        if self._stats['dropped'] > 0:
+            self._log.warning(
+                f'{self._stats["dropped"]} frames dropped while recording'
+            )
+
         message_manager.send_message(
             MessageType.RECORD_REPORT,
             report
@@ -69,10 +295,28 @@ class CameraRecorder(MixThread):
         else:
             return []
 
+    def get_record_stats(self):
+        """取得緩衝環的決策統計"""
+        return dict(self._stats, policy=self._policy)
+
+    def _spill(self, frame, camera_image):
+        """將圖像放到 spill 緩衝環，第一次 spill 時才建立寫入器"""
+        if self._spill_writer is None:
+            self._log.warning(f'Record ring full, spill to {self._spill_path}')
+            self._spill_ring = CameraFrameRing(setting.record.ring_capacity)
+            self._spill_file = self._build_dumper(self._spill_path)
+            self._spill_writer = CameraRingWriter(
+                self._spill_ring, self._spill_file
+            )
+
+        is_queued, _ = self._spill_ring.put(frame, camera_image)
+        return is_queued
+
     def add_task(self, current_frame, camera_image):
-        """將圖像放入錄製佇列
+        """將圖像放入錄製緩衝環
 
-        將圖像放到錄製佇列給 recorder 寫入到硬碟
+        將圖像複製到緩衝環給 recorder 寫入到硬碟
+        緩衝環滿的時候依 overflow_policy 處理
 
         Args:
             current_frame: 目前擷取的格數
@@ -81,7 +325,30 @@ class CameraRecorder(MixThread):
         """
         if self._shot_meta.is_cali:
             current_frame = 0
-            if self._count >= 1 and camera_image is not None:
+            if self._count >= 1:
                 return
-        self._queue.put((current_frame, camera_image))
         self._count += 1
+
+        is_queued, dropped_frame = self._ring.put(
+            current_frame, camera_image,
+            drop_oldest=self._policy == 'drop_oldest'
+        )
+
+        if is_queued:
+            self._stats['queued'] += 1
+        elif self._policy == 'block':
+            start_time = time.perf_counter()
+            self._ring.put(current_frame, camera_image, block=True)
+            self._stats['blocked'] += 1
+            self._stats['blocked_time'] += time.perf_counter() - start_time
+            self._stats['queued'] += 1
+        elif self._policy == 'spill' and self._spill(
+            current_frame, camera_image
+        ):
+            self._stats['spilled'] += 1
+        else:
+            dropped_frame = current_frame
+
+        if dropped_frame is not None:
+            self._stats['dropped'] += 1
+            self._dropped_frames.append(dropped_frame)
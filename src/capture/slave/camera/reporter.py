@@ -0,0 +1,74 @@
+from threading import Event
+import time
+
+from utility.message import message_manager
+from utility.mix_thread import MixThread
+from utility.define import MessageType
+from utility.setting import setting
+
+
+class CameraStatusReporter(MixThread):
+    """相機狀態推送器
+
+    取代 master 輪詢，由 slave 主動推送相機狀態
+    每隔 push_interval 檢查狀態，只送出有改變的欄位
+    狀態 (state) 改變時由 notify 立即推送，不用等間隔
+    超過 heartbeat_interval 沒有送過完整狀態就送一次，當作心跳也修正遺漏
+
+    Args:
+        camera_connector: CameraConnector
+
+    """
+
+    def __init__(self, camera_connector):
+        super().__init__()
+        self._camera_connector = camera_connector
+        self._event = Event()  # 立即推送的事件
+        self._last_status = {}  # 上次送出後的狀態
+        self._last_full_time = 0  # 上次送出完整狀態的時間
+
+        self.start()
+
+    def _run(self):
+        while self._running:
+            self._event.wait(setting.camera_status.push_interval)
+            self._event.clear()
+
+            if not self._running:
+                break
+
+            self._report()
+
+    def _report(self):
+        """送出狀態差異，到心跳時間則送完整狀態"""
+        status = self._camera_connector.get_status()
+        now = time.monotonic()
+
+        if now - self._last_full_time >= (
+            setting.camera_status.heartbeat_interval
+        ):
+            delta = status
+            self._last_full_time = now
+        else:
+            delta = {
+                key: value for key, value in status.items()
+                if key not in self._last_status or
+                self._last_status[key] != value
+            }
+
+        self._last_status = status
+
+        if len(delta) == 0:
+            return
+
+        message_manager.send_message(
+            MessageType.CAMERA_STATUS,
+            {self._camera_connector.get_id(): delta}
+        )
+
+    def notify(self):
+        """狀態改變，立即推送"""
+        self._event.set()
+
+    def _stop(self):
+        self._event.set()
@@ -1,6 +1,8 @@
 import numpy as np
 import struct
-import io
+import mmap
+import time
+import os
 
 from .image import CameraImage
 
@@ -11,7 +13,13 @@ class CameraShotFileCore():
     shot 檔案會有一個圖像檔案 4dr 跟一個資訊檔案 4dm
     4dr 是所有圖像連續寫入的檔案
     4dm 會記錄每一個影格在 4dr 的位置
-    4dm 的影格格式是: (圖像大小, 寬, 高)
+    4dm 的影格格式是: (影格號碼, 圖像大小, 寬, 高)
+    4di 是讀取時整理出來的影格索引快取，可以直接載入免去重新整理
+
+    4dr 有兩種格式:
+        版本 1: 每張圖像以 np.save 寫入，各自帶有 npy 標頭
+        版本 2: 檔頭記錄一次寬高，之後直接接續寫入原始 Bayer 資料
+               每張圖像大小固定，第 n 張的位置為 檔頭大小 + n * 圖像大小
 
     Args:
         shot_file_path: shot 檔案位置
@@ -21,8 +29,20 @@ class CameraShotFileCore():
 
     binary_format = '>IIII'
     binary_size = struct.calcsize(binary_format)
+    meta_dtype = np.dtype([
+        ('frame', '>u4'), ('size', '>u4'), ('width', '>u4'), ('height', '>u4')
+    ])  # 與 binary_format 相同的 numpy 格式
+    index_dtype = np.dtype([
+        ('frame', '<u4'), ('cursor', '<u8'), ('size', '<u4'),
+        ('width', '<u4'), ('height', '<u4')
+    ])  # 影格索引格式，cursor 為圖像在 4dr 的位置
+    raw_header_format = '>4sIII'  # (識別碼, 版本, 寬, 高)
+    raw_header_size = struct.calcsize(raw_header_format)
+    raw_magic = b'4DRW'
+    raw_version = 2
     image_ext = '.4dr'
     meta_ext = '.4dm'
+    index_ext = '.4di'
 
     def __init__(self, shot_file_path, file_handle):
         self._shot_file_path = shot_file_path
@@ -55,97 +75,396 @@ class CameraShotFileLoader(CameraShotFileCore):
     """ shot 檔案讀取器
 
     根據影格資訊讀取圖像
-    初始化時會先將資訊全部讀出來整理到 self._frames
+    初始化時會先將資訊整理成依影格號碼排序的索引陣列 self._index
     之後再用 load 去讀取圖像
 
+    初始化時會從 4dr 檔頭判斷格式版本，兩種格式都能讀取
+    use_mmap 開啟時會將 4dr 整個映射到記憶體
+    load 回傳的 CameraImage 資料為映射的唯讀 view，不會複製圖像
+    use_index_cache 開啟時會讀寫 4di 索引快取
+
     Args:
         shot_file_path: shot 檔案位置
+        use_mmap: 是否以記憶體映射讀取
+        use_index_cache: 是否使用索引快取
 
     """
 
-    def __init__(self, shot_file_path, log):
+    def __init__(
+        self, shot_file_path, log, use_mmap=True, use_index_cache=True
+    ):
         super().__init__(shot_file_path, 'rb')
         self._log = log
         self._log.info(f'File read: {self._shot_file_path}')
-        self._frames = {}  # {影格號碼: (圖像在檔案的位置, 圖像大小, 寬, 高)}
+        self._map = None  # 4dr 的記憶體映射
+        self._use_index_cache = use_index_cache
+        self._index = None  # 影格索引，格式為 index_dtype
+        self._headers = {}  # {圖像大小: (標頭長度, npy 標頭)}
+        self._version = 1  # 4dr 格式版本
+        self._data_offset = 0  # 第一張圖像在 4dr 的位置
+
+        # 空檔案無法映射
+        self._image_file_size = os.fstat(self._image_file.fileno()).st_size
+        if use_mmap and self._image_file_size > 0:
+            self._map = mmap.mmap(
+                self._image_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
 
         # 先取得資訊
+        self._read_file_header()
         self._load_metadata()
 
-    def _load_metadata(self):
-        """讀取影格資訊檔案整理出所有影格資訊"""
-        file_cursor = 0
+    def _read_file_header(self):
+        """讀取 4dr 檔頭判斷格式版本"""
+        if self._image_file_size < self.raw_header_size:
+            return
 
-        while True:
-            # 讀取特定 size
-            raw_meta = self._meta_file.read(self.binary_size)
+        self._image_file.seek(0)
+        magic, version, w, h = struct.unpack(
+            self.raw_header_format,
+            self._image_file.read(self.raw_header_size)
+        )
 
-            # 如果讀取的長度錯誤的話即中斷，可能是檔案儲存到一半
-            if len(raw_meta) < self.binary_size:
-                break
+        if magic != self.raw_magic:
+            return
 
-            # 取得資訊，file_cursor 就是檔案游標位置，不斷增加
-            frame, image_size, w, h = struct.unpack(
-                self.binary_format,
-                raw_meta
-            )
-            self._frames[frame] = (file_cursor, image_size, w, h)
-            file_cursor += image_size
+        self._version = version
+        self._data_offset = self.raw_header_size
+
+    def _read_npy_header(self, file_cursor):
+        """解析 npy 標頭
+
+        回傳標頭長度與 (形狀, 是否 fortran 排列, 型別)
+
+        Args:
+            file_cursor: npy 在 4dr 的位置
+
+        """
+        handle = self._map if self._map is not None else self._image_file
+        handle.seek(file_cursor)
+
+        version = np.lib.format.read_magic(handle)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(handle)
+        else:
+            header = np.lib.format.read_array_header_2_0(handle)
+
+        return handle.tell() - file_cursor, header
+
+    def _load_metadata(self):
+        """整理出所有影格資訊
+
+        有可用的索引快取就直接載入，否則從 4dm 建立後存成快取
+        同樣大小的影格 npy 標頭一致，每種大小只解析一次
+
+        """
+        index = None
+        if self._use_index_cache:
+            index = self._load_index_cache()
+
+        if index is None:
+            index = self._build_index()
+            if self._use_index_cache:
+                self._save_index_cache(index)
+
+        self._index = index
+
+        sizes, first_positions = np.unique(index['size'], return_index=True)
+        for image_size, position in zip(sizes, first_positions):
+            # 原始資料沒有標頭，直接以一維 uint8 讀取
+            if self._version >= self.raw_version:
+                self._headers[int(image_size)] = (
+                    0, ((int(image_size),), False, np.dtype(np.uint8))
+                )
+            else:
+                self._headers[int(image_size)] = self._read_npy_header(
+                    int(index['cursor'][position])
+                )
+
+        if len(index) == 0:
+            self._log.warning(f'No frames in {self._shot_file_path}')
+            return
 
-        frames = list(self._frames.keys())
         self._log.info('{} frames loaded ({}/{})'.format(
-            len(self._frames),
-            frames[0],
-            frames[-1]
+            len(index),
+            index['frame'][0],
+            index['frame'][-1]
         ))
 
+    def _build_index(self):
+        """從 4dm 建立影格索引"""
+        raw_meta = self._meta_file.read()
+
+        # 如果檔案儲存到一半，捨棄最後不完整的資訊
+        count = len(raw_meta) // self.binary_size
+        meta = np.frombuffer(raw_meta, self.meta_dtype, count)
+
+        # 圖像在檔案的位置為檔頭加上前面所有圖像大小的累加
+        sizes = meta['size'].astype(np.uint64)
+        cursors = np.cumsum(sizes) - sizes + np.uint64(self._data_offset)
+
+        # 圖像沒有完整寫入的影格捨棄
+        is_complete = cursors + sizes <= self._image_file_size
+
+        index = np.empty(np.count_nonzero(is_complete), self.index_dtype)
+        index['cursor'] = cursors[is_complete]
+        for field in ('frame', 'size', 'width', 'height'):
+            index[field] = meta[field][is_complete]
+
+        # 依影格號碼排序，重複的影格以後寫入的為主
+        return index[np.argsort(index['frame'], kind='stable')]
+
+    def _load_index_cache(self):
+        """讀取索引快取，快取不存在或已過期會回傳 None"""
+        index_path = self._shot_file_path + self.index_ext
+        meta_path = self._shot_file_path + self.meta_ext
+
+        if not os.path.isfile(index_path):
+            return None
+
+        # 4dm 在快取之後有更動
+        if os.path.getmtime(index_path) < os.path.getmtime(meta_path):
+            return None
+
+        try:
+            index = np.load(index_path, allow_pickle=False)
+        except (OSError, ValueError) as error:
+            self._log.warning(f'Index cache broken: {error}')
+            return None
+
+        if index.dtype != self.index_dtype:
+            return None
+
+        # 4dr 大小不符
+        if len(index) > 0 and (
+            int((index['cursor'] + index['size']).max()) >
+            self._image_file_size
+        ):
+            return None
+
+        return index
+
+    def _save_index_cache(self, index):
+        """將索引存成快取，先寫入暫存檔再取代以免寫到一半"""
+        index_path = self._shot_file_path + self.index_ext
+        temp_path = f'{index_path}.{os.getpid()}.tmp'
+
+        try:
+            with open(temp_path, 'wb') as f:
+                np.save(f, index, allow_pickle=False)
+            os.replace(temp_path, index_path)
+        except OSError as error:
+            self._log.warning(f'Index cache not saved: {error}')
+
     def load(self, frame):
         """讀取圖像
 
         讀取特定影格的圖像，回傳 CameraImage
         讀取方式是藉由影格資訊去找到該區段在檔案的位置
-        只讀該片段轉成假 file 檔去讀出來
+        有記憶體映射的話直接以 view 包裝，否則只讀該片段
 
         Args:
             frame: 想讀取的影格數
 
         """
-        if frame not in self._frames:
+        frames = self._index['frame']
+        position = np.searchsorted(frames, frame, side='right') - 1
+
+        if position < 0 or frames[position] != frame:
             self._log.error(
                 f"Can't find frame {frame} in {self._shot_file_path}"
             )
             return None
 
         # 取得資訊
-        file_cursor, image_size, w, h = self._frames[frame]
-
-        # 讀取片段
-        self._image_file.seek(file_cursor)
-        image_bytes = self._image_file.read(image_size)
-        f = io.BytesIO(image_bytes)
+        entry = self._index[position]
+        w = int(entry['width'])
+        h = int(entry['height'])
+        header_size, (shape, fortran_order, dtype) = (
+            self._headers[int(entry['size'])]
+        )
+        data_cursor = int(entry['cursor']) + header_size
+        count = int(np.prod(shape))
 
         # 讀取圖像
-        data = np.load(f, allow_pickle=False, fix_imports=False)
+        if self._map is not None:
+            data = np.frombuffer(self._map, dtype, count, data_cursor)
+        else:
+            self._image_file.seek(data_cursor)
+            data = np.frombuffer(
+                self._image_file.read(count * dtype.itemsize), dtype
+            )
+
+        data = data.reshape(shape, order='F' if fortran_order else 'C')
 
         return CameraImage(data, w, h)
 
+    def _close(self):
+        """關閉記憶體映射
+
+        如果還有 CameraImage 在使用映射便無法關閉，交給回收機制處理
+
+        """
+        if self._map is None:
+            return
+
+        try:
+            self._map.close()
+        except BufferError:
+            self._log.warning(
+                f'Memory map still in use: {self._shot_file_path}'
+            )
+        self._map = None
+
+
+class CameraShotFileBuffer():
+    """shot 檔案寫入緩衝
+
+    將多次寫入合併在 bytearray，累積到 buffer_size 後一次寫入硬碟
+    每次寫入都是 block_size 的整數倍，不足的部分留到下次，讓寫入位置保持對齊
+    每隔 fsync_interval 秒會 fsync 一次，讓資料確實落地
+    另外會記錄每次寫入的耗時，提供錄製報告使用
+
+    Args:
+        file: 無緩衝的 file object
+        buffer_size: 累積多少位元組才寫入
+        block_size: 寫入對齊大小
+        fsync_interval: fsync 間隔(秒)，0 為不 fsync
+
+    """
+
+    def __init__(self, file, buffer_size, block_size=1, fsync_interval=0):
+        self._file = file  # 寫入的 file object
+        self._buffer = bytearray()  # 寫入緩衝
+        self._buffer_size = buffer_size  # 累積多少位元組才寫入
+        self._block_size = block_size  # 寫入對齊大小
+        self._fsync_interval = fsync_interval  # fsync 間隔(秒)
+        self._last_fsync = time.perf_counter()  # 上次 fsync 時間
+        self._position = file.tell()  # 包含緩衝的檔案位置
+
+        # 寫入統計
+        self._write_count = 0
+        self._write_time = 0.0
+        self._write_time_max = 0.0
+        self._fsync_count = 0
+
+    def write(self, data):
+        """寫入緩衝
+
+        累積超過 buffer_size 時，以對齊的大小寫入硬碟
+
+        Args:
+            data: bytes-like 資料
+
+        """
+        # ndarray 要轉成 memoryview，否則 += 會變成 numpy 的運算
+        view = memoryview(data).cast('B')
+        size = view.nbytes
+        self._buffer += view
+        self._position += size
+
+        if len(self._buffer) >= self._buffer_size:
+            self._write(len(self._buffer) // self._block_size * self._block_size)
+
+        return size
+
+    def tell(self):
+        """取得包含緩衝的檔案位置"""
+        return self._position
+
+    def flush(self):
+        """將緩衝全部寫入硬碟並 fsync"""
+        self._write(len(self._buffer))
+        self._fsync()
+
+    def _write(self, size):
+        """將緩衝前段指定大小寫入硬碟
+
+        Args:
+            size: 寫入大小
+
+        """
+        if size == 0:
+            return
+
+        start_time = time.perf_counter()
+
+        # 無緩衝的 file object 可能只寫入一部分，要寫到完為止
+        with memoryview(self._buffer) as view:
+            written = 0
+            while written < size:
+                written += self._file.write(view[written:size])
+
+        del self._buffer[:size]
+
+        if (
+            self._fsync_interval > 0 and
+            start_time - self._last_fsync >= self._fsync_interval
+        ):
+            self._fsync()
+
+        # 統計
+        elapsed = time.perf_counter() - start_time
+        self._write_count += 1
+        self._write_time += elapsed
+        self._write_time_max = max(self._write_time_max, elapsed)
+
+    def _fsync(self):
+        """fsync 讓資料落地"""
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.perf_counter()
+        self._fsync_count += 1
+
+    def get_stats(self):
+        """取得寫入統計，時間單位為毫秒"""
+        return {
+            'write_count': self._write_count,
+            'write_latency_avg': (
+                self._write_time / self._write_count * 1000
+                if self._write_count > 0 else 0
+            ),
+            'write_latency_max': self._write_time_max * 1000,
+            'fsync_count': self._fsync_count
+        }
+
 
 class CameraShotFileDumper(CameraShotFileCore):
     """ shot 檔案寫入器
 
     將檔案寫入到硬碟，並同時產生影格資訊檔
     另外會記錄寫入的編號，在結束寫入時產生報告，以查看有沒有遺失的影格
+    raw_format 開啟時以版本 2 的格式寫入，不經過 np.save
+    圖像與影格資訊都經過 CameraShotFileBuffer 合併寫入
 
     Args:
         shot_file_path: shot 檔案位置
+        raw_format: 是否以原始資料格式寫入
+        buffer_size: 圖像累積多少位元組才寫入
+        block_size: 圖像寫入對齊大小
+        meta_batch: 影格資訊累積幾筆才寫入
+        fsync_interval: fsync 間隔(秒)，0 為不 fsync
 
     """
 
-    def __init__(self, shot_file_path, log):
+    def __init__(
+        self, shot_file_path, log, raw_format=True,
+        buffer_size=64 * 1024 ** 2, block_size=1024 ** 2,
+        meta_batch=30, fsync_interval=5
+    ):
         super().__init__(shot_file_path, 'wb')
         self._log = log
         self._log.info(f'File write: {self._shot_file_path}')
         self._frames = []  # 寫入的影格編號陣列
+        self._raw_format = raw_format
+        self._raw_size = None  # 原始資料格式檔頭記錄的 (寬, 高)
+
+        # 寫入緩衝
+        self._image_buffer = CameraShotFileBuffer(
+            self._image_file, buffer_size, block_size, fsync_interval
+        )
+        self._meta_buffer = CameraShotFileBuffer(
+            self._meta_file, self.binary_size * meta_batch, 1, fsync_interval
+        )
 
     def dump(self, frame, camera_image):
         """寫入
@@ -157,26 +476,61 @@ class CameraShotFileDumper(CameraShotFileCore):
             camera_image: CameraImage
 
         """
+        if self._raw_format and not self._check_raw_size(camera_image):
+            return
+
         # 藉由 tell() 去算出檔案大小
-        start_cursor = self._image_file.tell()
-        camera_image.write(self._image_file)
-        image_size = self._image_file.tell() - start_cursor
+        start_cursor = self._image_buffer.tell()
+        if self._raw_format:
+            camera_image.write_raw(self._image_buffer)
+        else:
+            camera_image.write(self._image_buffer)
+        image_size = self._image_buffer.tell() - start_cursor
 
         # 包裝 binary
         meta = struct.pack(
             self.binary_format, frame, image_size, *camera_image.get_size()
         )
-        self._meta_file.write(meta)
+        self._meta_buffer.write(meta)
 
         # 加入影格
         self._frames.append(frame)
 
+    def _check_raw_size(self, camera_image):
+        """檢查原始資料格式的圖像尺寸
+
+        第一張圖像會寫入檔頭記錄寬高，之後尺寸不同的圖像不寫入
+
+        Args:
+            camera_image: CameraImage
+
+        """
+        size = camera_image.get_size()
+
+        if self._raw_size is None:
+            self._raw_size = size
+            self._image_buffer.write(struct.pack(
+                self.raw_header_format, self.raw_magic, self.raw_version, *size
+            ))
+            return True
+
+        if size != self._raw_size:
+            self._log.error(
+                f'Image size {size} differs from {self._raw_size}, skip'
+            )
+            return False
+
+        return True
+
     def _close(self):
-        """關閉時的運行，做一個 log 回報"""
+        """關閉時的運行，將緩衝寫完並做一個 log 回報"""
+        self._image_buffer.flush()
+        self._meta_buffer.flush()
+
         self._log.info('File saved with {} frames ({}/{}): {}'.format(
             len(self._frames),
-            self._frames[0],
-            self._frames[-1],
+            min(self._frames),
+            max(self._frames),
             self._shot_file_path
         ))
 
@@ -185,15 +539,24 @@ class CameraShotFileDumper(CameraShotFileCore):
         return self._frames
 
     def get_report(self):
-        """取得寫入報告"""
+        """取得寫入報告
+
+        spill 的圖像會在錄製結束後才併回來，影格編號不一定依序
+
+        """
         # 算出遺失格數
-        all_frames = [f for f in range(self._frames[0], self._frames[-1])]
-        missing_frames = list(i for i in all_frames if i not in self._frames)
+        first_frame = min(self._frames)
+        last_frame = max(self._frames)
+        frames = set(self._frames)
+        missing_frames = [
+            f for f in range(first_frame, last_frame) if f not in frames
+        ]
 
         return {
             'missing_frames': missing_frames,
-            'frame_range': (self._frames[0], self._frames[-1]),
-            'size': self._image_file.tell()
+            'frame_range': (first_frame, last_frame),
+            'size': self._image_buffer.tell(),
+            'write_stats': self._image_buffer.get_stats()
         }
 
 
@@ -221,3 +584,69 @@ class CameraShotMeta():
     def get_parms(self):
         """返回所有 parms 參數"""
         return self._parms
+
+
+class CameraShotBatch():
+    """shot 批次圖像請求
+
+    一次請求一段影格，由 CameraShotLoader 依序讀取轉檔送出
+    未確認的張數到 window 就暫停，等 master 確認收到後再繼續送
+
+    Args:
+        parms: {camera_id, shot_id, batch_id, start_frame, end_frame,
+                quality, scale_length, window}
+        shot_file_path: shot 檔案路徑
+
+    """
+
+    def __init__(self, parms, shot_file_path):
+        self._parms = parms  # 參數儲存
+        self._shot_file_path = shot_file_path  # shot 檔案路徑
+        self._next_frame = parms['start_frame']  # 下一個要送的影格
+        self._sent = 0  # 已送出的張數
+        self._received = 0  # master 確認收到的張數
+        self._is_cancelled = False
+
+    def __getattr__(self, prop):
+        return self._parms[prop]
+
+    def get_path(self):
+        """取得 shot 檔案路徑"""
+        return self._shot_file_path
+
+    def get_parms(self):
+        """返回所有 parms 參數"""
+        return self._parms
+
+    def next_meta(self):
+        """取出下一個影格的 CameraShotMeta"""
+        parms = {
+            'camera_id': self.camera_id,
+            'shot_id': self.shot_id,
+            'frame': self._next_frame,
+            'quality': self.quality,
+            'scale_length': self.scale_length,
+            'batch_id': self.batch_id
+        }
+        self._next_frame += 1
+        return CameraShotMeta(parms, self._shot_file_path)
+
+    def on_sent(self):
+        """送出一張影格"""
+        self._sent += 1
+
+    def ack(self, received):
+        """master 確認收到的張數"""
+        self._received = max(self._received, received)
+
+    def cancel(self):
+        """取消請求"""
+        self._is_cancelled = True
+
+    def has_credit(self):
+        """未確認的張數是否還沒到 window"""
+        return self._sent - self._received < self.window
+
+    def is_done(self):
+        """是否已送完或取消"""
+        return self._is_cancelled or self._next_frame > self.end_frame
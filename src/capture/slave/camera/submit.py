@@ -0,0 +1,158 @@
+"""Shot 發佈的 worker process
+
+CameraShotSubmitter 以 process pool 分工，每個 worker 負責一台相機的一段影格
+worker 只載入讀檔跟轉檔需要的模組，不會建立相機系統與連線
+
+"""
+import hashlib
+import json
+import os
+
+from utility.logger import log
+
+from .shot import CameraShotFileLoader
+
+
+def hash_data(data):
+    """計算檔案內容的雜湊"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def is_verified(image_path, entry):
+    """檢查已發佈的圖像與清單記錄的大小跟雜湊是否一致
+
+    Args:
+        image_path: 圖像位置
+        entry: 清單記錄 {size, hash}
+
+    """
+    if entry is None or not os.path.isfile(image_path):
+        return False
+
+    if os.stat(image_path).st_size != entry['size']:
+        return False
+
+    with open(image_path, 'rb') as f:
+        return hash_data(f.read()) == entry['hash']
+
+
+def write_atomic(path, data):
+    """先寫到暫存檔再取代，避免留下寫到一半的檔案"""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def submit_frames(
+    camera_id, shot_file_path, frames, submit_image_path, profile, entries
+):
+    """發佈一段影格
+
+    將指定影格轉成 JPEG 存到發佈資料夾
+    清單有記錄且檔案驗證無誤的影格會略過，不重新轉檔
+    回傳 (相機 ID, 影格, 遺失的影格, 清單記錄, 轉檔數量)
+
+    Args:
+        camera_id: 相機 ID
+        shot_file_path: shot 檔案位置
+        frames: 要發佈的影格
+        submit_image_path: 發佈資料夾
+        profile: JpegProfile
+        entries: 這段影格在清單的記錄 {影格: {size, hash}}
+
+    """
+    file_loader = None
+    missing_frames = []
+    new_entries = {}
+    encoded_count = 0
+
+    for frame in frames:
+        image_path = f'{submit_image_path}{camera_id}_{frame:06d}.jpg'
+        entry = entries.get(frame)
+
+        # 已發佈且完整的影格
+        if is_verified(image_path, entry):
+            new_entries[frame] = entry
+            continue
+
+        if file_loader is None:
+            file_loader = CameraShotFileLoader(shot_file_path, log)
+
+        camera_image = file_loader.load(frame)
+
+        if camera_image is None:
+            missing_frames.append(frame)
+            continue
+
+        # 轉檔與儲存
+        jpg_data = camera_image.convert_jpeg(profile)
+        write_atomic(image_path, jpg_data)
+        new_entries[frame] = {'size': len(jpg_data), 'hash': hash_data(jpg_data)}
+        encoded_count += 1
+
+    # 釋放映射的圖像才能關閉檔案
+    if file_loader is not None:
+        camera_image = None
+        file_loader.close()
+
+    return camera_id, frames, missing_frames, new_entries, encoded_count
+
+
+class SubmitManifest():
+    """發佈清單
+
+    記錄每台相機已發佈圖像的影格、大小跟雜湊，存在發佈資料夾
+    每台相機各自一個檔案，避免不同 slave 同時寫入衝突
+    重新發佈或中斷後再發佈時，只轉檔缺少或損毀的影格
+
+    Args:
+        submit_image_path: 發佈資料夾
+        shot_id: Shot ID
+        camera_id: 相機 ID
+
+    """
+
+    def __init__(self, submit_image_path, shot_id, camera_id):
+        self._path = f'{submit_image_path}{camera_id}_manifest.json'
+        self._shot_id = shot_id
+        self._camera_id = camera_id
+        self._entries = self._load()  # {影格: {size, hash}}
+
+    def _load(self):
+        """讀取清單，不存在或損毀的話從空的開始"""
+        if not os.path.isfile(self._path):
+            return {}
+
+        try:
+            with open(self._path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as error:
+            log.warning(f'Submit manifest broken: {error}')
+            return {}
+
+        return {int(frame): entry for frame, entry in data['frames'].items()}
+
+    def get_entries(self, frames):
+        """取得指定影格的記錄"""
+        return {
+            frame: self._entries[frame]
+            for frame in frames if frame in self._entries
+        }
+
+    def update(self, entries):
+        """更新記錄並存檔"""
+        self._entries.update(entries)
+        self.save()
+
+    def save(self):
+        """存檔"""
+        data = {
+            'shot_id': self._shot_id,
+            'camera_id': self._camera_id,
+            'frames': {
+                str(frame): entry
+                for frame, entry in sorted(self._entries.items())
+            }
+        }
+        write_atomic(self._path, json.dumps(data).encode())
@@ -25,7 +25,11 @@ def start_slave():
     is_master_down = False
     while True:
         message = message_manager.receive_message()
-        if message.type is MessageType.MASTER_DOWN:
+        if message.type is MessageType.MASTER_LOST:
+            log.warning('Master lost, keep cameras running and wait resume')
+        elif message.type is MessageType.MASTER_UP:
+            log.info('Master resumed')
+        elif message.type is MessageType.MASTER_DOWN:
             log.warning('Master Down !!')
             is_master_down = True
             break
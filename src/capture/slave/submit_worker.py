@@ -0,0 +1,30 @@
+"""Shot 發佈 worker process 的初始化
+
+放在 slave.camera 之外，spawn 出來的 worker 載入初始化函式時
+不會先執行 slave.camera 而載入相機系統
+
+"""
+import os
+
+# 有此環境變數的 process 為 worker，slave.camera 不會載入相機系統
+WORKER_ENV = '4DREC_SUBMIT_WORKER'
+
+
+def initialize_worker(env):
+    """worker 初始化
+
+    設定 worker 自己的環境變數，之後載入 slave.camera 時便不會建立相機系統
+    並降低優先權避免影響擷取
+
+    Args:
+        env: worker 的環境變數
+
+    """
+    os.environ.update(env)
+
+    import win32process
+    import win32api
+    win32process.SetPriorityClass(
+        win32api.GetCurrentProcess(),
+        win32process.BELOW_NORMAL_PRIORITY_CLASS
+    )
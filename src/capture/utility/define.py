@@ -61,6 +61,14 @@ class CameraState(Enum):
 class CameraLibraryTask(Enum):
     IMPORT = auto()
     REQUEST = auto()
+    REQUEST_RANGE = auto()
+
+
+class ShotLoaderTask(Enum):
+    LOAD = auto()
+    BATCH = auto()
+    ACK = auto()
+    CANCEL = auto()
 
 
 class CameraCacheType(Enum):
@@ -85,21 +93,29 @@ class MessageType(Enum):
 
     SHOT_IMAGE = auto()
     # {camera_id, shot_id, frame, quality, scale_length, download}
+    # 批次請求的圖像會多 batch_id
 
     SLAVE_DOWN = auto()
+    # {node, camera_ids[]}，本地訊息
+
+    SLAVE_TIMEOUT = auto()
+    # {node, camera_ids[]}，本地訊息，斷線的 slave 超過時間沒有恢復 session
 
     MASTER_UP = auto()
+    # 本地訊息，連上 master (包含斷線後恢復 session)
 
     MASTER_DOWN = auto()
+    # slave 重新啟動，master 要求或 session 超過時間沒有恢復
 
     CAMERA_STATUS = auto()
-    # {camera_id: status,}
+    # {camera_id: status,}，slave 平時只推送改變的欄位，心跳時推送完整狀態
 
     CAMERA_PARM = auto()
     # {camera_parm: (name, value)}
 
     RECORD_REPORT = auto()
-    # {camera_id, shot_id, missing_frames, frame_range, size}
+    # {camera_id, shot_id, missing_frames, frame_range, size, write_stats,
+    #  record_stats, session_id, seq}
 
     REMOVE_SHOT = auto()
     # {shot_id}
@@ -108,7 +124,27 @@ class MessageType(Enum):
     # {shot_id, frame_range}
 
     SUBMIT_REPORT = auto()
-    # {camera_id, shot_id, progress}
+    # {camera_id, shot_id, job_name, progress, encoded, missing, session_id,
+    #  seq}
+
+    NODE_ANNOUNCE = auto()
+    # {camera_ids[], session_id}，slave 連上後告知 master 這個連線負責的相機
+
+    GET_SHOT_IMAGES = auto()
+    # {camera_id, shot_id, batch_id, start_frame, end_frame, quality,
+    #  scale_length, window}
+
+    SHOT_IMAGES_ACK = auto()
+    # {camera_id, batch_id, received}
+
+    CANCEL_SHOT_IMAGES = auto()
+    # {shot_id}
+
+    MASTER_LOST = auto()
+    # 本地訊息，與 master 斷線，等待 session 恢復
+
+    REPORT_ACK = auto()
+    # {session_id, seq}，master 收到報告的確認
 
 
 class TaskState(Enum):
@@ -0,0 +1,326 @@
+import asyncio
+import socket
+import time
+
+from utility.logger import log
+from utility.define import MessageType
+
+from .message import Message
+from .send_queue import MessageSendQueue
+from .stats import MessageStats
+
+
+class AsyncMessagePeer():
+    """asyncio 連線對象
+
+    一個連線的 stream 包裝，寄送佇列由自己的 coroutine 送出並等待 drain
+    寄送佇列與 MessageSendNode 相同分優先通道
+    介面與 MessageNode 相同，可以放在 SLAVE_DOWN 訊息讓 master 取得名稱
+
+    Args:
+        name: 連線的位址
+        reader: asyncio.StreamReader
+        writer: asyncio.StreamWriter
+        bulk_rate: 圖像通道每秒的 payload 上限 (bytes)，0 為不限制
+        compress: 是否以 LZ4 壓縮非 JPEG 的訊息
+
+    """
+
+    def __init__(self, name, reader, writer, bulk_rate=0, compress=False):
+        self._name = name  # 連線的位址
+        self._reader = reader
+        self._writer = writer
+        self._compress = compress  # 是否壓縮
+        self._stats = MessageStats()  # 收發統計
+        self._wakeup = asyncio.Event()  # 有新訊息的事件，只在 loop 內使用
+        self._send_queue = MessageSendQueue(
+            bulk_rate, notify=self._wakeup.set
+        )  # 寄送佇列
+        self._error = None  # 連線錯誤時的放置位置
+
+    def get_name(self):
+        """取得連線位址"""
+        return self._name
+
+    def get_error(self):
+        """取得錯誤訊息，如果沒有會回傳 None"""
+        return self._error
+
+    def get_stats(self):
+        """取得連線的 MessageStats"""
+        return self._stats
+
+    def add_send_queue(self, message):
+        """加入寄送佇列，要在 loop 內呼叫"""
+        self._send_queue.put(message)
+
+    async def send_loop(self):
+        """依優先順序送出寄送佇列的訊息"""
+        while True:
+            message, wait = self._send_queue.pop()
+
+            if message is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                buffers = message.to_buffers(self._compress)
+            except TypeError as error:
+                log.error(f'Drop message {message}: {error}')
+                continue
+
+            self._writer.writelines(buffers)
+            await self._writer.drain()
+            self._stats.on_sent(
+                message.type, sum(len(buffer) for buffer in buffers)
+            )
+
+    async def receive_loop(self, put_inbox):
+        """接收封包並轉換成訊息後，放到收件匣，斷線時結束
+
+        Args:
+            put_inbox: manager 放入收件匣的 func
+
+        """
+        reader = self._reader
+        try:
+            while True:
+                meta = await reader.readexactly(Message.META_SIZE)
+                (
+                    msg_type, flags, sent_time, parms_size, payload_size
+                ) = Message.unpack_meta(meta)
+                parms_bytes = await reader.readexactly(parms_size)
+                payload = b''
+                if payload_size > 0:
+                    payload = await reader.readexactly(payload_size)
+
+                self._stats.on_received(
+                    msg_type,
+                    Message.META_SIZE + parms_size + payload_size,
+                    time.time() - sent_time
+                )
+                put_inbox(Message.load_from_bytes(
+                    msg_type, parms_bytes, payload, flags, sent_time
+                ))
+        except asyncio.IncompleteReadError:
+            self._error = ConnectionResetError('Connection closed by peer')
+        except (OSError, ValueError) as error:
+            self._error = error
+
+    def close(self):
+        self._writer.close()
+
+
+class AsyncMessageNodeManager():
+    """asyncio 的 Node 管理
+
+    MessageNodeManager 的 asyncio 版本，所有連線共用一個 event loop
+    每個連線只有兩個 coroutine，不再各自開收發的執行緒
+    連線斷掉時由接收的 coroutine 直接回調，不用輪詢檢查 node 狀態
+    對外的 add_send_queue、get_count 等介面可從其他執行緒呼叫
+    路由表的做法與 MessageNodeManager 相同
+
+    Args:
+        put_inbox: manager 放入收件匣的 func
+        bulk_rate: 圖像通道每秒的 payload 上限 (bytes)，0 為不限制
+        compress: 是否以 LZ4 壓縮非 JPEG 的訊息
+
+    """
+
+    def __init__(self, put_inbox, bulk_rate=0, compress=False):
+        self._put_inbox = put_inbox  # 從 manager 取得的收件匣
+        self._bulk_rate = bulk_rate  # 圖像通道每秒的上限
+        self._compress = compress  # 是否壓縮
+        self._peers = {}  # 連線中的 AsyncMessagePeer
+        self._routes = {}  # 路由表 {相機 ID: 連線名稱}
+        self._loop = None  # 運作中的 event loop
+        self._stop_event = None  # 停止事件
+        self._handlers = set()  # 處理連線的 task
+
+    def run_master(self, port, on_lost):
+        """以 master 運作，阻塞到 stop 為止
+
+        Args:
+            port: 聆聽的 port
+            on_lost: 連線斷掉的回調，參數為 AsyncMessagePeer 與負責的相機 ID
+
+        """
+        asyncio.run(self._serve(port, on_lost))
+
+    def run_slave(self, address, on_connected, on_lost):
+        """以 slave 運作，斷線後會不斷重新連線，阻塞到 stop 為止
+
+        Args:
+            address: master 的連線地址
+            on_connected: 連上的回調
+            on_lost: 連線斷掉的回調，參數為 AsyncMessagePeer 與負責的相機 ID
+
+        """
+        asyncio.run(self._connect(address, on_connected, on_lost))
+
+    async def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+
+    async def _serve(self, port, on_lost):
+        await self._start()
+
+        def on_connection(reader, writer):
+            self._add_handler(reader, writer, on_lost)
+
+        server = await asyncio.start_server(
+            on_connection, '0.0.0.0', port, backlog=6
+        )
+        log.info(f'Socket is Listening')
+
+        async with server:
+            await self._stop_event.wait()
+        await self._close_handlers()
+
+    async def _connect(self, address, on_connected, on_lost):
+        await self._start()
+
+        while not self._stop_event.is_set():
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*address), 1.0
+                )
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(1.0)
+                continue
+
+            handler = self._add_handler(reader, writer, on_lost)
+            on_connected()
+            stop = asyncio.ensure_future(self._stop_event.wait())
+            await asyncio.wait(
+                (handler, stop), return_when=asyncio.FIRST_COMPLETED
+            )
+            stop.cancel()
+
+        await self._close_handlers()
+
+    def _add_handler(self, reader, writer, on_lost):
+        """登記連線並建立處理連線的 task"""
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        name = writer.get_extra_info('peername')
+        log.info(f'Connection established ({name[0]})')
+
+        peer = AsyncMessagePeer(
+            name, reader, writer, self._bulk_rate, self._compress
+        )
+        self._peers[name] = peer
+
+        handler = asyncio.ensure_future(self._handle(peer, on_lost))
+        self._handlers.add(handler)
+        handler.add_done_callback(self._handlers.discard)
+        return handler
+
+    async def _close_handlers(self):
+        """停止時關閉所有連線，等待處理的 task 結束"""
+        self._close_peers()
+        if len(self._handlers) > 0:
+            await asyncio.wait(self._handlers)
+
+    async def _handle(self, peer, on_lost):
+        """處理一個連線，斷線時清理並回調"""
+        name = peer.get_name()
+        sender = asyncio.ensure_future(peer.send_loop())
+        receiver = asyncio.ensure_future(peer.receive_loop(
+            lambda message: self._on_receive(name, message)
+        ))
+        await asyncio.wait(
+            (sender, receiver), return_when=asyncio.FIRST_COMPLETED
+        )
+
+        # 送出失敗的話取得錯誤
+        if sender.done() and not sender.cancelled():
+            if peer.get_error() is None:
+                peer._error = sender.exception()
+        sender.cancel()
+        receiver.cancel()
+
+        self._peers.pop(name, None)
+        camera_ids = []
+        for camera_id, route in list(self._routes.items()):
+            if route == name:
+                del self._routes[camera_id]
+                camera_ids.append(camera_id)
+        peer.close()
+
+        if not self._stop_event.is_set():
+            on_lost(peer, camera_ids)
+
+    def _on_receive(self, name, message):
+        """收到訊息的處理，路由宣告記到路由表後也放到收件匣"""
+        if message.type is MessageType.NODE_ANNOUNCE:
+            for camera_id in message.get_parms()['camera_ids']:
+                self._routes[camera_id] = name
+            log.debug(f'Route {message.get_parms()["camera_ids"]} to {name}')
+
+        self._put_inbox(message)
+
+    def _close_peers(self):
+        for peer in list(self._peers.values()):
+            peer.close()
+        self._peers = {}
+        self._routes = {}
+
+    def _put_send_queue(self, message, target):
+        name = self._routes.get(target)
+        if name is not None and name in self._peers:
+            self._peers[name].add_send_queue(message)
+            return
+
+        for peer in list(self._peers.values()):
+            peer.add_send_queue(message)
+
+    def add_send_queue(self, message, target=None):
+        """增加訊息到寄送佇列
+
+        有指定相機而且路由表有記錄的話只送給負責的連線，否則廣播
+
+        Args:
+            message: 要放到佇列的訊息
+            target: 目標相機 ID
+
+        """
+        if self._loop is None:
+            return
+
+        self._call_soon(self._put_send_queue, message, target)
+
+    def get_all(self):
+        """取得全部的連線"""
+        return list(self._peers.values())
+
+    def get_count(self):
+        """取得正在連線的數量"""
+        return len(self._peers)
+
+    def get_stats(self):
+        """取得各連線的統計 {連線名稱: MessageStats}"""
+        return {
+            name: peer.get_stats() for name, peer in list(self._peers.items())
+        }
+
+    def _call_soon(self, callback, *args):
+        """從其他執行緒排入 loop，loop 已關閉的話略過"""
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass
+
+    def clear(self):
+        """關閉所有連線，slave 會重新連線"""
+        if self._loop is not None:
+            self._call_soon(self._close_peers)
+
+    def stop(self):
+        """停止 event loop 與所有連線"""
+        if self._loop is not None:
+            self._call_soon(self._stop_event.set)
@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+
+class MessageCodec():
+    """訊息參數的編碼
+
+    取代 pickle，參數以 UTF-8 的 JSON 編碼，解碼時不會執行任何程式碼
+    只接受基本型別: None、bool、int、float、str、list、tuple、dict
+    numpy 的數值會轉成對應的 Python 數值
+    tuple 解碼後會是 list，dict 的 key 要是字串
+
+    格式有變動時要更新 VERSION，標頭的版本不符就拒收
+
+    """
+
+    VERSION = 3  # 1 為舊的 pickle 訊息，2 的標頭沒有旗標與寄出時間
+
+    _encoder = json.JSONEncoder(
+        separators=(',', ':'),
+        ensure_ascii=False,
+        check_circular=False,
+        default=lambda value: MessageCodec._convert(value)
+    )
+    _decoder = json.JSONDecoder()
+
+    @staticmethod
+    def _convert(value):
+        """JSON 不支援的型別轉換"""
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(
+            f'Message codec: unsupported type {type(value).__name__}'
+        )
+
+    @classmethod
+    def encode(cls, parms):
+        """編碼成二進制
+
+        Args:
+            parms: 訊息參數
+
+        """
+        return cls._encoder.encode(parms).encode('utf-8')
+
+    @classmethod
+    def decode(cls, data):
+        """從二進制解碼
+
+        Args:
+            data: 二進制資料
+
+        """
+        return cls._decoder.decode(str(data, 'utf-8'))
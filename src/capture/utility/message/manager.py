@@ -1,6 +1,8 @@
 import socket
 import queue
+import json
 import time
+from threading import Timer
 from multiprocessing import current_process
 
 from utility.mix_thread import MixThread
@@ -9,7 +11,9 @@ from utility.logger import log
 from utility.define import MessageType
 
 from .node import MessageNodeManager
+from .aio import AsyncMessageNodeManager
 from .message import Message
+from .session import MessageSession, MessageSessionTracker
 
 
 class MessageManager(MixThread):
@@ -17,6 +21,12 @@ class MessageManager(MixThread):
 
     管理連線，並負責所有訊息的收發動作
     建立連線的資訊與主從判斷都來自 setting 模組
+    setting.message_transport 決定傳輸方式:
+        thread: 每個連線各自有收發的執行緒
+        asyncio: 所有連線共用一個 event loop
+    各連線的收發統計可以從 get_stats 取得，停止時會傾印到 log
+    slave 斷線時先送 MASTER_LOST，超過 setting.session.resume_timeout
+    沒有重新連上才送 MASTER_DOWN，連上後重送 master 還沒確認的報告
 
     """
 
@@ -24,18 +34,98 @@ class MessageManager(MixThread):
         super().__init__()
         self._address = setting.get_host_address()  # 連線地址
         self._inbox = queue.Queue()  # 收件匣
-        self._node = MessageNodeManager(self.put_inbox)  # Node 管理
+        self._transport = setting.message_transport  # 傳輸方式
+        self._camera_ids = []  # slave 這個連線負責的相機
+        self._rate_sample = (time.perf_counter(), 0)  # 上次計算接收速率的取樣
+        self._session = None  # slave 的 session，記錄待確認的報告
+        self._session_tracker = None  # master 記錄各 session 收過的報告
+        self._resume_timer = None  # 等待 session 恢復的計時
+
+        if setting.is_master():
+            self._session_tracker = MessageSessionTracker(
+                setting.session.max_unacked
+            )
+        else:
+            self._session = MessageSession(setting.session.max_unacked)
+
+        # Node 管理
+        bulk_rate = setting.message_bulk_rate_mb * 1024 ** 2
+        compress = setting.message_compress
+        if self._transport == 'asyncio':
+            self._node = AsyncMessageNodeManager(
+                self._on_receive, bulk_rate, compress
+            )
+        else:
+            self._node = MessageNodeManager(
+                self._on_receive, bulk_rate, compress
+            )
 
         # 初始化後即自動執行
         self.start()
 
     def _run(self):
-        """依照主從狀況去運作"""
-        if setting.is_master():
+        """依照主從狀況與傳輸方式去運作"""
+        if self._transport == 'asyncio':
+            if setting.is_master():
+                self._node.run_master(
+                    setting.host_address.port, self._on_slave_lost
+                )
+            else:
+                self._node.run_slave(
+                    self._address, self._on_master_connected,
+                    self._on_master_lost
+                )
+        elif setting.is_master():
             self._run_master()
         else:
             self._run_slave()
 
+    def _on_slave_lost(self, node, camera_ids):
+        """asyncio 模式，slave 斷線的回調，送警告訊息給自己"""
+        log.warning(f'<{node.get_name()[0]}> {node.get_error()}')
+        self.send_message(
+            MessageType.SLAVE_DOWN,
+            {'node': node, 'camera_ids': camera_ids},
+            is_local=True
+        )
+
+    def _on_master_connected(self):
+        """連上 master，告知負責的相機並重送還沒確認的報告"""
+        if self._resume_timer is not None:
+            self._resume_timer.cancel()
+            self._resume_timer = None
+            log.info(f'Session {self._session.get_id()} resumed')
+
+        self._send_announce()
+        for message in self._session.get_unacked():
+            self._node.add_send_queue(message)
+        self.send_message(MessageType.MASTER_UP, is_local=True)
+
+    def _on_master_lost(self, node, camera_ids):
+        """asyncio 模式，master 斷線的回調"""
+        log.warning(node.get_error())
+        self._wait_session_resume()
+
+    def _wait_session_resume(self):
+        """與 master 斷線，先送 MASTER_LOST，超過時間沒恢復再送 MASTER_DOWN"""
+        self.send_message(MessageType.MASTER_LOST, is_local=True)
+
+        if self._resume_timer is not None:
+            self._resume_timer.cancel()
+        self._resume_timer = Timer(
+            setting.session.resume_timeout, self._on_resume_timeout
+        )
+        self._resume_timer.daemon = True
+        self._resume_timer.start()
+
+    def _on_resume_timeout(self):
+        """session 超過時間沒有恢復"""
+        if self.is_connected():
+            return
+        log.warning(f'Session {self._session.get_id()} not resumed')
+        self._resume_timer = None
+        self.send_message(MessageType.MASTER_DOWN, is_local=True)
+
     def _build_socket(self):
         """建立所需 socket 並回傳"""
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -70,6 +160,7 @@ class MessageManager(MixThread):
             else:
                 # 檢查已連線的 socket 是否有出錯
                 has_error = None
+                lost_camera_ids = []
 
                 for node in self._node.get_all():
                     if node.isFinished():
@@ -80,13 +171,13 @@ class MessageManager(MixThread):
                             )
                             has_error = node
 
-                        self._node.remove(node)
+                        lost_camera_ids += self._node.remove(node)
 
                 # 連線有出錯的狀況，送警告訊息給自己
                 if has_error is not None:
                     self.send_message(
                         MessageType.SLAVE_DOWN,
-                        {'node': node},
+                        {'node': node, 'camera_ids': lost_camera_ids},
                         is_local=True
                     )
 
@@ -113,7 +204,7 @@ class MessageManager(MixThread):
                 # 連接上後的處理
                 connected = True
                 self._node.add_connection(sock)
-                self.send_message(MessageType.MASTER_UP, is_local=True)
+                self._on_master_connected()
 
                 while self._running:
                     # 監測 socket 是否有狀況
@@ -132,7 +223,7 @@ class MessageManager(MixThread):
                 # 有狀況時的回報
                 if connected:
                     log.warning(error)
-                    self.send_message(MessageType.MASTER_DOWN, is_local=True)
+                    self._wait_session_resume()
                     connected = False  # connected 的設置是避免不斷報錯
                     if error.errno == 10054:
                         if current_process().name == 'MainProcess':
@@ -144,12 +235,17 @@ class MessageManager(MixThread):
         """如果是 Master 的情況就會有 accepter，停下時也要停止它的運作"""
         if hasattr(self, '_accepter'):
             self._accepter.stop()
+        if self._resume_timer is not None:
+            self._resume_timer.cancel()
 
     def _after_stop(self):
-        """已連線的 Nodes 也都要停下來"""
+        """已連線的 Nodes 也都要停下來，並傾印收發統計"""
+        self.dump_stats()
         self._node.stop()
 
-    def send_message(self, msg_type, parms={}, payload=b'', is_local=False):
+    def send_message(
+        self, msg_type, parms={}, payload=b'', is_local=False, target=None
+    ):
         """傳送訊息到 master 或 slaves
 
         會依照參數建立 Message 物件，詳細方式參照 Message 跟 MessageType
@@ -159,14 +255,42 @@ class MessageManager(MixThread):
             parms: 額外附帶參數
             payload: 二進制邊碼，主要為圖像傳輸用
             is_local: 當訊息是傳送給自己時要為 True
+            target: 目標相機 ID，有的話只送給負責該相機的 slave
 
         """
-        message = Message(msg_type, parms, payload)
+        if (
+            not is_local and self._session is not None and
+            msg_type in MessageSession.reliable_types
+        ):
+            message = self._session.track(msg_type, parms, payload)
+        else:
+            message = Message(msg_type, parms, payload)
+
         if not is_local:
-            self._node.add_send_queue(message)
+            self._node.add_send_queue(message, target)
         else:
             self.put_inbox(message)
 
+    def announce(self, camera_ids):
+        """slave 告知 master 這個連線負責的相機，重新連線時會再告知
+
+        Args:
+            camera_ids: 相機 ID 列表
+
+        """
+        self._camera_ids = list(camera_ids)
+        self._send_announce()
+
+    def _send_announce(self):
+        if len(self._camera_ids) > 0:
+            self.send_message(
+                MessageType.NODE_ANNOUNCE,
+                {
+                    'camera_ids': self._camera_ids,
+                    'session_id': self._session.get_id()
+                }
+            )
+
     def receive_message(self):
         """查看接收訊息
 
@@ -176,6 +300,42 @@ class MessageManager(MixThread):
         message = self._inbox.get()
         return message
 
+    def _on_receive(self, message):
+        """連線收到訊息的處理
+
+        slave 收到報告確認就從待確認區移除，不放到收件匣
+        master 收到報告先回應確認，重送的報告已經收過的話不放到收件匣
+
+        Args:
+            message: message 物件
+
+        """
+        if message.type is MessageType.REPORT_ACK:
+            if self._session is not None:
+                self._session.ack(message.unpack())
+            return
+
+        if (
+            self._session_tracker is not None and
+            message.type is MessageType.NODE_ANNOUNCE
+        ):
+            self._session_tracker.announce(message.get_parms())
+
+        if (
+            self._session_tracker is not None and
+            message.type in MessageSession.reliable_types
+        ):
+            ack, is_new = self._session_tracker.receive(message)
+            if ack is not None:
+                self.send_message(
+                    MessageType.REPORT_ACK, ack,
+                    target=message.get_parms().get('camera_id')
+                )
+            if not is_new:
+                return
+
+        self.put_inbox(message)
+
     def put_inbox(self, message):
         """將訊息放到收件匣
 
@@ -197,6 +357,46 @@ class MessageManager(MixThread):
         """取得正在連線的 node數量"""
         return self._node.get_count()
 
+    def get_stats(self):
+        """取得各連線的收發統計
+
+        回傳 {'ip:port': MessageStats.to_dict()}
+
+        """
+        return {
+            f'{name[0]}:{name[1]}': stats.to_dict()
+            for name, stats in self._node.get_stats().items()
+        }
+
+    def get_receive_rate(self):
+        """取得距離上次呼叫的接收速率 (MB/s)"""
+        now = time.perf_counter()
+        received = sum(
+            stats.get_received_bytes()
+            for stats in self._node.get_stats().values()
+        )
+        last_time, last_received = self._rate_sample
+        self._rate_sample = (now, received)
+
+        # 有連線斷掉時總量會變少，不算負的速率
+        if now <= last_time or received < last_received:
+            return 0.0
+        return (received - last_received) / (now - last_time) / 1024 ** 2
+
+    def dump_stats(self, path=None):
+        """傾印各連線的收發統計到 log，有指定路徑的話另存成 JSON
+
+        Args:
+            path: JSON 檔案路徑
+
+        """
+        for name, stats in self._node.get_stats().items():
+            log.info(f'Message stats <{name[0]}:{name[1]}>\n{stats.format()}')
+
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(self.get_stats(), f, indent=2)
+
 
 class MessageAccepter(MixThread):
     """Message 聆聽用模組
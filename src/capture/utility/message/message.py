@@ -1,15 +1,21 @@
 import struct
-import pickle
-import copy
+import time
+
+import lz4framed
 
 from utility.define import MessageType
 
+from .codec import MessageCodec
+
 
 class Message():
     """訊息物件，機器間交互溝通的核心
 
     訊息物件由訊息類型、參數字典檔、payload (可選，二進制編碼)構成
-    訊息傳出時，前二者會 pickle 序列化再加上 payload 來傳輸
+    訊息傳出時，參數以 MessageCodec 編碼，前面加上固定格式的標頭:
+        版本、訊息類型、旗標、寄出時間、參數大小、payload 大小
+    寄出時間為建立訊息的時間，接收端拿來算延遲
+    開啟壓縮時，非 JPEG 的訊息夠大就以 LZ4 壓縮參數與 payload 並設定旗標
 
     Args:
         msg_type: 訊息類型，為 MessageType Enum
@@ -19,34 +25,73 @@ class Message():
     """
 
     # 設定訊息的封包格式
-    META_FORMAT = '>II'
+    META_FORMAT = '>BHBdII'
     META_SIZE = struct.calcsize(META_FORMAT)
 
+    FLAG_LZ4 = 1  # 參數與 payload 有 LZ4 壓縮
+    COMPRESS_MIN_SIZE = 1024  # 小於這個大小不壓縮
+
+    # 已經是 JPEG 的訊息，壓縮沒有效果
+    _jpeg_types = (MessageType.LIVE_VIEW_IMAGE, MessageType.SHOT_IMAGE)
+
     def __init__(self, msg_type, parms={}, payload=b''):
         self._type = msg_type  # 訊息類型
         self._parms = parms  # 參數
         self._payload = payload  # 二進制編碼
+        self._sent_time = time.time()  # 寄出時間
 
     def __str__(self):
         return f'[{self._type.name}]: {self._parms}'
 
-    def to_packet(self):
-        """轉換成封包
+    def to_buffers(self, compress=False):
+        """轉換成封包的緩衝列表
 
         訊息傳輸前的動作
-        先複製一個去掉 payload 的自身物件並序列化
-        再將 payload 加回去後利用 struct 包裝傳出
+        將參數編碼後加上標頭，payload 以 memoryview 附在後面不複製
+
+        Args:
+            compress: 是否嘗試以 LZ4 壓縮
 
         """
-        obj = copy.copy(self)
-        obj._payload = b''
-        msg = pickle.dumps(obj)
-        packet = struct.pack(
+        parms = MessageCodec.encode(self._parms)
+        payload = self._payload
+        flags = 0
+
+        if (
+            compress and
+            self._type not in self._jpeg_types and
+            len(parms) + len(payload) >= self.COMPRESS_MIN_SIZE
+        ):
+            compressed_parms = lz4framed.compress(parms)
+            compressed_payload = (
+                lz4framed.compress(payload) if len(payload) > 0 else b''
+            )
+
+            # 壓縮後沒變小就送原本的
+            if (
+                len(compressed_parms) + len(compressed_payload) <
+                len(parms) + len(payload)
+            ):
+                parms, payload = compressed_parms, compressed_payload
+                flags |= self.FLAG_LZ4
+
+        header = struct.pack(
             self.META_FORMAT,
-            len(msg),
-            len(self._payload)
-        ) + msg + self._payload
-        return packet
+            MessageCodec.VERSION,
+            self._type.value,
+            flags,
+            self._sent_time,
+            len(parms),
+            len(payload)
+        ) + parms
+
+        if len(payload) == 0:
+            return [header]
+        return [header, memoryview(payload)]
+
+    def to_packet(self):
+        """轉換成單一封包，會複製 payload"""
+        return b''.join(self.to_buffers())
 
     def unpack(self):
         """提取資料
@@ -73,6 +118,12 @@ class Message():
             )
         elif self._type is MessageType.GET_SHOT_IMAGE:
             return self._parms
+        elif self._type is MessageType.GET_SHOT_IMAGES:
+            return self._parms
+        elif self._type is MessageType.SHOT_IMAGES_ACK:
+            return self._parms
+        elif self._type is MessageType.CANCEL_SHOT_IMAGES:
+            return self._parms['shot_id']
         elif self._type is MessageType.CAMERA_STATUS:
             return self._parms
         elif self._type is MessageType.CAMERA_PARM:
@@ -85,37 +136,81 @@ class Message():
             return self._parms
         elif self._type is MessageType.SUBMIT_REPORT:
             return self._parms
-        elif self._type is MessageType.SLAVE_DOWN:
+        elif (
+            self._type is MessageType.SLAVE_DOWN or
+            self._type is MessageType.SLAVE_TIMEOUT
+        ):
             return self._parms['node']
-        elif self._type is MessageType.TRIGGER_REPORT:
-            return self._parms['camera_id']
+        elif self._type is MessageType.NODE_ANNOUNCE:
+            return self._parms
+        elif self._type is MessageType.REPORT_ACK:
+            return self._parms
+        elif (
+            self._type is MessageType.MASTER_UP or
+            self._type is MessageType.MASTER_LOST or
+            self._type is MessageType.MASTER_DOWN
+        ):
+            return self._parms
 
     @property
     def type(self):
         """取得訊息類型"""
         return self._type
 
+    def get_parms(self):
+        """取得參數"""
+        return self._parms
+
+    def get_payload_size(self):
+        """取得 payload 大小"""
+        return len(self._payload) if self._payload is not None else 0
+
+    def get_sent_time(self):
+        """取得寄出時間"""
+        return self._sent_time
+
     @classmethod
     def unpack_meta(cls, meta):
-        """取得封包的大小資訊
+        """取得封包的標頭資訊
 
-        會回傳兩個數字，一組是訊息物件的大小，一組是 payload 的大小
+        會回傳五個值: 訊息類型、旗標、寄出時間、參數的大小、payload 的大小
+        版本不符的封包會丟出 ValueError
 
         Args:
             meta: 收到的二進制封包
 
         """
-        return struct.unpack(cls.META_FORMAT, meta)
+        (
+            version, type_value, flags, sent_time, parms_size, payload_size
+        ) = struct.unpack(cls.META_FORMAT, meta)
 
-    @staticmethod
-    def load_from_bytes(message_bytes, payload):
-        """從序列化的狀態讀取回 Python 物件
+        if version != MessageCodec.VERSION:
+            raise ValueError(f'Unsupported message version {version}')
+
+        return (
+            MessageType(type_value), flags, sent_time, parms_size, payload_size
+        )
+
+    @classmethod
+    def load_from_bytes(
+        cls, msg_type, parms_bytes, payload, flags=0, sent_time=None
+    ):
+        """從編碼的參數建立訊息物件
 
         Args:
-            message_bytes: 序列化的訊息物件
-            payload: 二進制邊碼
+            msg_type: 訊息類型
+            parms_bytes: 編碼的參數
+            payload: 二進制邊碼，可以是 memoryview
+            flags: 標頭的旗標
+            sent_time: 標頭的寄出時間
 
         """
-        message = pickle.loads(message_bytes)
-        message._payload = payload
+        if flags & cls.FLAG_LZ4:
+            parms_bytes = lz4framed.decompress(parms_bytes)
+            if len(payload) > 0:
+                payload = lz4framed.decompress(payload)
+
+        message = Message(msg_type, MessageCodec.decode(parms_bytes), payload)
+        if sent_time is not None:
+            message._sent_time = sent_time
         return message
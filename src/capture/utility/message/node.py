@@ -1,9 +1,12 @@
-import queue
+import time
 
 from utility.mix_thread import MixThread
 from utility.logger import log
+from utility.define import MessageType
 
 from .message import Message
+from .send_queue import MessageSendQueue
+from .stats import MessageStats
 
 
 class MessageNodeManager():
@@ -11,15 +14,24 @@ class MessageNodeManager():
 
     把 socket 存放成 node 並與之和 manager 溝通
     負責 node 的動作控制與存活
+    slave 連上後會以 NODE_ANNOUNCE 告知負責的相機，記在路由表
+    指定相機的訊息只送給負責的 node，不廣播給所有 node
+    每個連線有自己的 MessageStats 統計收發的訊息
 
     Args:
         put_inbox: manager 放入收件匣的 func
+        bulk_rate: 圖像通道每秒的 payload 上限 (bytes)，0 為不限制
+        compress: 是否以 LZ4 壓縮非 JPEG 的訊息
 
     """
 
-    def __init__(self, put_inbox):
+    def __init__(self, put_inbox, bulk_rate=0, compress=False):
         self._nodes = {}  # 存放的 node 字典
+        self._routes = {}  # 路由表 {相機 ID: node 名稱}
+        self._stats = {}  # 各連線的統計 {node 名稱: MessageStats}
         self._put_inbox = put_inbox  # 從 manager 取得的收件匣
+        self._bulk_rate = bulk_rate  # 圖像通道每秒的上限
+        self._compress = compress  # 是否壓縮
 
     def add_connection(self, conn):
         """增加連線
@@ -32,13 +44,27 @@ class MessageNodeManager():
         """
         name = conn.getpeername()  # 取得連線名稱當作ID
         log.info(f'Connection established ({name[0]})')
-        send_node = MessageSendNode(conn, name)
+        stats = MessageStats()
+        send_node = MessageSendNode(
+            conn, name, stats, self._bulk_rate, self._compress
+        )
         receive_node = MessageReceiveNode(
-            conn, name, put_inbox=self._put_inbox
+            conn, name, stats,
+            put_inbox=lambda message: self._on_receive(name, message)
         )
 
+        self._stats[name] = stats
         self._nodes[name] = (send_node, receive_node)
 
+    def _on_receive(self, name, message):
+        """接收 node 收到訊息的處理，路由宣告記到路由表後也放到收件匣"""
+        if message.type is MessageType.NODE_ANNOUNCE:
+            for camera_id in message.get_parms()['camera_ids']:
+                self._routes[camera_id] = name
+            log.debug(f'Route {message.get_parms()["camera_ids"]} to {name}')
+
+        self._put_inbox(message)
+
     def get_all(self):
         """取得全部的 node"""
         nodes = []
@@ -50,9 +76,15 @@ class MessageNodeManager():
         """取得正在連線的 node數量"""
         return len(self._nodes)
 
+    def get_stats(self):
+        """取得各連線的統計 {node 名稱: MessageStats}"""
+        return dict(self._stats)
+
     def remove(self, node):
         """刪除 node，刪除前會先停止其運行
 
+        回傳這個 node 負責的相機 ID 列表
+
         Args:
             node: 要刪除的 node
 
@@ -65,13 +97,29 @@ class MessageNodeManager():
 
             del self._nodes[name]
 
-    def add_send_queue(self, message):
+        self._stats.pop(name, None)
+        camera_ids = []
+        for camera_id, route in list(self._routes.items()):
+            if route == name:
+                del self._routes[camera_id]
+                camera_ids.append(camera_id)
+        return camera_ids
+
+    def add_send_queue(self, message, target=None):
         """增加訊息到寄件佇列
 
+        有指定相機而且路由表有記錄的話只送給負責的 node，否則廣播
+
         Args:
             message: 要放到佇列的訊息
+            target: 目標相機 ID
 
         """
+        name = self._routes.get(target)
+        if name is not None and name in self._nodes:
+            self._nodes[name][0].add_send_queue(message)
+            return
+
         for pair_node in self._nodes.values():
             pair_node[0].add_send_queue(message)
 
@@ -83,6 +131,8 @@ class MessageNodeManager():
         """
         self.stop()
         self._nodes = {}
+        self._routes = {}
+        self._stats = {}
 
     def stop(self):
         """停止時將所有管理的 node 都停下來"""
@@ -99,13 +149,15 @@ class MessageNode(MixThread):
     Args:
         sock: 連線 socket
         name: 連線的位址
+        stats: 連線的 MessageStats
 
     """
 
-    def __init__(self, sock, name):
+    def __init__(self, sock, name, stats):
         super().__init__()
         self._sock = sock  # 連線 socket
         self._name = name  # 連線的位址
+        self._stats = stats  # 收發統計
         self._error = None  # 連線錯誤時的放置位置
 
     def get_error(self):
@@ -129,13 +181,19 @@ class MessageSendNode(MessageNode):
     """Node 寄送元件
 
     繼承 MessageNode 元件，檢查自己的 self._send_queue
-    一有訊息就執行寄送
+    一有訊息就執行寄送，標頭與 payload 以 scatter/gather 送出不合併
+    寄送佇列分優先通道，控制訊息不會排在圖像後面，詳見 MessageSendQueue
+
+    Args:
+        bulk_rate: 圖像通道每秒的 payload 上限 (bytes)，0 為不限制
+        compress: 是否以 LZ4 壓縮非 JPEG 的訊息
 
     """
 
-    def __init__(self, sock, name):
-        super().__init__(sock, name)
-        self._send_queue = queue.Queue()  # 寄送佇列
+    def __init__(self, sock, name, stats, bulk_rate=0, compress=False):
+        super().__init__(sock, name, stats)
+        self._send_queue = MessageSendQueue(bulk_rate)  # 寄送佇列
+        self._compress = compress  # 是否壓縮
 
         # 初始化後即自動執行
         self.start()
@@ -145,13 +203,50 @@ class MessageSendNode(MessageNode):
         while self._running:
             message = self._send_queue.get()
 
-            packet = message.to_packet()
+            try:
+                buffers = message.to_buffers(self._compress)
+            except TypeError as error:
+                log.error(f'Drop message {message}: {error}')
+                continue
 
             try:
-                self._sock.sendall(packet)
+                self._send_buffers(buffers)
             except Exception as error:
                 self._error = error
                 self.stop()
+                continue
+
+            self._stats.on_sent(
+                message.type, sum(len(buffer) for buffer in buffers)
+            )
+
+    def _send_buffers(self, buffers):
+        """送出緩衝列表
+
+        有 sendmsg 的平台一次送出全部緩衝，沒有的話 (Windows) 逐一 sendall
+        兩者都不會把 payload 複製到新的 bytes
+
+        Args:
+            buffers: 緩衝列表
+
+        """
+        if not hasattr(self._sock, 'sendmsg'):
+            for buffer in buffers:
+                self._sock.sendall(buffer)
+            return
+
+        views = [memoryview(buffer) for buffer in buffers]
+        while len(views) > 0:
+            sent = self._sock.sendmsg(views)
+
+            # 去掉已送出的部分
+            while sent > 0:
+                if sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views.pop(0)
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
 
     def add_send_queue(self, message):
         """加入寄送佇列"""
@@ -161,17 +256,19 @@ class MessageSendNode(MessageNode):
 class MessageReceiveNode(MessageNode):
     """Node 接收元件
 
-    繼承 MessageNode 元件，檢查自己的 self._send_queue
-    一有訊息就執行寄送
+    繼承 MessageNode 元件，接收封包並轉換成訊息後放到收件匣
+    標頭與參數讀進重複使用的緩衝，payload 讀進自己的 bytearray
+    以 memoryview 放到訊息，不做額外的複製
 
     Args:
         put_inbox: manager 放入收件匣的 func
 
     """
 
-    def __init__(self, sock, name, put_inbox):
-        super().__init__(sock, name)
+    def __init__(self, sock, name, stats, put_inbox):
+        super().__init__(sock, name, stats)
         self._put_inbox = put_inbox  # manager 放入收件匣的 func
+        self._buffer = bytearray(64 * 1024)  # 標頭與參數的接收緩衝
 
         # 初始化後即自動執行
         self.start()
@@ -180,16 +277,24 @@ class MessageReceiveNode(MessageNode):
         """接收封包並轉換成訊息後，放到收件匣"""
         while self._running:
             try:
-                # 取得大小資訊
-                meta = self._recvall(Message.META_SIZE)
-                message_size, payload_size = Message.unpack_meta(meta)
+                # 取得標頭資訊
+                meta = self._recv_buffer(Message.META_SIZE)
+                (
+                    msg_type, flags, sent_time, parms_size, payload_size
+                ) = Message.unpack_meta(meta)
 
                 # 取得確切大小的封包
-                message_bytes = self._recvall(message_size)
-                payload = self._recvall(payload_size)
-
-                # 將封包轉換成物件
-                message = Message.load_from_bytes(message_bytes, payload)
+                parms_bytes = self._recv_buffer(parms_size)
+                message = Message.load_from_bytes(
+                    msg_type, parms_bytes, self._recv_payload(payload_size),
+                    flags, sent_time
+                )
+
+                self._stats.on_received(
+                    msg_type,
+                    Message.META_SIZE + parms_size + payload_size,
+                    time.time() - sent_time
+                )
 
                 # 存入收件匣
                 self._put_inbox(message)
@@ -197,15 +302,43 @@ class MessageReceiveNode(MessageNode):
                 self._error = error
                 self.stop()
 
-    def _recvall(self, n):
-        """接收封包到指定大小為止
+    def _recv_into(self, view):
+        """接收封包直到填滿 view
+
+        Args:
+            view: 要填入的 memoryview
+
+        """
+        while len(view) > 0:
+            size = self._sock.recv_into(view)
+            if size == 0:
+                raise ConnectionResetError('Connection closed by peer')
+            view = view[size:]
+
+    def _recv_buffer(self, n):
+        """接收指定大小到重複使用的緩衝，下次接收前有效
 
         Args:
             n: 封包大小
 
         """
-        data = b''
-        while len(data) < n:
-            packet = self._sock.recv(n - len(data))
-            data += packet
-        return data
+        if n > len(self._buffer):
+            self._buffer = bytearray(n)
+
+        view = memoryview(self._buffer)[:n]
+        self._recv_into(view)
+        return view
+
+    def _recv_payload(self, n):
+        """接收 payload 到新的 bytearray，回傳 memoryview
+
+        Args:
+            n: payload 大小
+
+        """
+        if n == 0:
+            return b''
+
+        payload = bytearray(n)
+        self._recv_into(memoryview(payload))
+        return memoryview(payload)
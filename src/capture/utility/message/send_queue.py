@@ -0,0 +1,179 @@
+from threading import Condition
+from collections import deque
+import time
+
+from utility.define import MessageType
+
+from .message import Message
+
+
+class MessageSendQueue():
+    """寄送佇列
+
+    依訊息類型分成三個優先順序的通道，高優先的通道清空了才送下一個通道:
+        control: 錄製開關、重新觸發、參數等控制訊息
+        status: 相機狀態、報告與確認、圖像請求與批次回應確認
+        bulk: 預覽與 shot 圖像
+    還沒送出又有新的同類訊息時直接取代 (同相機的預覽圖像)
+    相機狀態是差異推送，同相機的狀態會合併欄位，不會丟掉先前的變化
+    bulk 通道可以限制每秒的 payload 大小，避免圖像塞滿頻寬
+
+    Args:
+        bulk_rate: bulk 通道每秒的 payload 上限 (bytes)，0 為不限制
+        notify: 放入訊息後的回調，給 asyncio 喚醒用
+
+    """
+
+    lanes = ('control', 'status', 'bulk')
+
+    _status_types = (
+        MessageType.CAMERA_STATUS,
+        MessageType.RECORD_REPORT,
+        MessageType.SUBMIT_REPORT,
+        MessageType.REPORT_ACK,
+        MessageType.GET_SHOT_IMAGE,
+        MessageType.GET_SHOT_IMAGES,
+        MessageType.SHOT_IMAGES_ACK
+    )
+    _bulk_types = (
+        MessageType.LIVE_VIEW_IMAGE,
+        MessageType.SHOT_IMAGE
+    )
+
+    def __init__(self, bulk_rate=0, notify=None):
+        self._cond = Condition()
+        self._lanes = {lane: deque() for lane in self.lanes}  # 各通道
+        self._pending = {}  # 可取代的訊息 {key: 佇列項目}
+        self._notify = notify
+        self._bulk_rate = bulk_rate  # bulk 每秒上限
+        self._tokens = bulk_rate  # bulk 目前可送的大小
+        self._token_time = time.perf_counter()
+        self._coalesced = 0  # 被取代的訊息數量
+
+    @classmethod
+    def get_lane(cls, message):
+        """取得訊息的通道"""
+        if message.type in cls._bulk_types:
+            return 'bulk'
+        elif message.type in cls._status_types:
+            return 'status'
+        return 'control'
+
+    @staticmethod
+    def get_coalesce_key(message):
+        """取得可取代的訊息 key，不能取代的回傳 None
+
+        相機狀態以參數的 key 區分 (master 的請求 / 各相機的回報)
+        預覽圖像以相機 ID 區分
+
+        """
+        if message.type is MessageType.CAMERA_STATUS:
+            return (message.type, tuple(sorted(message.get_parms())))
+        elif message.type is MessageType.LIVE_VIEW_IMAGE:
+            return (message.type, message.get_parms().get('camera_id'))
+        return None
+
+    @staticmethod
+    def _merge_status(queued, message):
+        """合併相機狀態，新的欄位覆蓋舊的"""
+        parms = {
+            key: (
+                dict(value, **message.get_parms()[key])
+                if isinstance(value, dict) else message.get_parms()[key]
+            )
+            for key, value in queued.get_parms().items()
+        }
+        return Message(message.type, parms)
+
+    def put(self, message):
+        """放入訊息，有相同 key 的訊息在佇列中就取代掉"""
+        with self._cond:
+            key = self.get_coalesce_key(message)
+
+            if key is not None and key in self._pending:
+                entry = self._pending[key]
+                if message.type is MessageType.CAMERA_STATUS:
+                    message = self._merge_status(entry[0], message)
+                entry[0] = message
+                self._coalesced += 1
+                return
+
+            entry = [message, key]
+            if key is not None:
+                self._pending[key] = entry
+            self._lanes[self.get_lane(message)].append(entry)
+            self._cond.notify()
+
+        if self._notify is not None:
+            self._notify()
+
+    def pop(self):
+        """取出下一個要送的訊息，不阻塞
+
+        回傳 (訊息, 等待秒數):
+            有可送的訊息: (訊息, 0)
+            只剩受限制的 bulk: (None, 還要等待的秒數)
+            沒有訊息: (None, None)
+
+        """
+        with self._cond:
+            return self._pop()
+
+    def get(self):
+        """取出下一個要送的訊息，沒有可送的就等待"""
+        with self._cond:
+            while True:
+                message, wait = self._pop()
+                if message is not None:
+                    return message
+                self._cond.wait(wait)
+
+    def _pop(self):
+        for lane in ('control', 'status'):
+            if len(self._lanes[lane]) > 0:
+                return self._pop_lane(lane), 0
+
+        bulk = self._lanes['bulk']
+        if len(bulk) == 0:
+            return None, None
+
+        wait = self._take_tokens(bulk[0][0].get_payload_size())
+        if wait > 0:
+            return None, wait
+
+        return self._pop_lane('bulk'), 0
+
+    def _pop_lane(self, lane):
+        message, key = self._lanes[lane].popleft()
+        if key is not None:
+            del self._pending[key]
+        return message
+
+    def _take_tokens(self, size):
+        """bulk 限流，可送的話扣掉大小回傳 0，不行的話回傳要等的秒數"""
+        if self._bulk_rate <= 0:
+            return 0
+
+        now = time.perf_counter()
+        self._tokens = min(
+            self._bulk_rate,
+            self._tokens + (now - self._token_time) * self._bulk_rate
+        )
+        self._token_time = now
+
+        # 超過一秒上限的訊息，累積滿一秒就放行
+        need = min(size, self._bulk_rate)
+        if self._tokens < need:
+            return (need - self._tokens) / self._bulk_rate
+
+        self._tokens -= size
+        return 0
+
+    def get_depths(self):
+        """取得各通道的訊息數量"""
+        with self._cond:
+            return {lane: len(queue) for lane, queue in self._lanes.items()}
+
+    def get_coalesced_count(self):
+        """取得被取代的訊息數量"""
+        return self._coalesced
@@ -0,0 +1,194 @@
+from threading import Lock
+from collections import OrderedDict
+import itertools
+import uuid
+
+from utility.logger import log
+from utility.define import MessageType
+
+from .message import Message
+
+
+class MessageSession():
+    """slave 的連線 session
+
+    每個 process 的 MessageManager 有一個 session ID，重新連線後沿用
+    要確保送達的報告會加上 session ID 與流水號，master 收到後回應確認
+    還沒確認的報告留在待確認區，重新連上 master 後依序重送
+
+    Args:
+        max_unacked: 待確認區的上限，超過時丟掉最舊的報告
+
+    """
+
+    # 要確保送達的訊息類型
+    reliable_types = (
+        MessageType.RECORD_REPORT,
+        MessageType.SUBMIT_REPORT
+    )
+
+    def __init__(self, max_unacked=1000):
+        self._id = uuid.uuid4().hex  # session ID
+        self._seqs = itertools.count()  # 報告流水號
+        self._lock = Lock()
+        self._unacked = OrderedDict()  # 待確認區 {流水號: 訊息}
+        self._max_unacked = max_unacked  # 待確認區的上限
+
+    def get_id(self):
+        """取得 session ID"""
+        return self._id
+
+    def track(self, msg_type, parms, payload):
+        """建立要確保送達的訊息，並放到待確認區
+
+        Args:
+            msg_type: 訊息類型
+            parms: 參數
+            payload: 二進制編碼
+
+        """
+        with self._lock:
+            seq = next(self._seqs)
+            message = Message(
+                msg_type,
+                dict(parms, session_id=self._id, seq=seq),
+                payload
+            )
+            self._unacked[seq] = message
+
+            if len(self._unacked) > self._max_unacked:
+                dropped_seq, dropped = self._unacked.popitem(last=False)
+                log.warning(f'Drop unacked report {dropped_seq}: {dropped}')
+
+        return message
+
+    def ack(self, parms):
+        """收到 master 的確認，從待確認區移除
+
+        Args:
+            parms: REPORT_ACK 的參數
+
+        """
+        if parms['session_id'] != self._id:
+            return
+
+        with self._lock:
+            self._unacked.pop(parms['seq'], None)
+
+    def get_unacked(self):
+        """取得待確認的訊息，依送出順序"""
+        with self._lock:
+            return list(self._unacked.values())
+
+
+class MessageSessionTracker():
+    """master 端的 session 記錄
+
+    記下各 session 已收到的報告流水號
+    slave 重送時，已經收過的報告只回應確認，不重複放到收件匣
+    每個 session 只記連續收到的流水號上限，跟上限之後先到的少量流水號
+    slave 待確認區丟掉的報告不會再來，亂序的流水號超過上限時視為遺失往前推進
+    相機改用新的 session (slave 重新啟動) 時丟掉舊的記錄
+    記錄的 session 數超過上限時丟掉最久沒收到報告的
+
+    Args:
+        max_window: 每個 session 亂序流水號的記錄上限
+        max_sessions: session 的記錄上限
+
+    """
+
+    def __init__(self, max_window=1000, max_sessions=256):
+        self._lock = Lock()
+        self._max_window = max_window  # 亂序流水號的記錄上限
+        self._max_sessions = max_sessions  # session 的記錄上限
+        self._received = OrderedDict()  # {session ID: _ReceivedSeqs}
+        self._camera_sessions = {}  # {相機 ID: session ID}
+
+    def announce(self, parms):
+        """收到 slave 的路由宣告，相機換了 session 的話丟掉舊的記錄
+
+        Args:
+            parms: NODE_ANNOUNCE 的參數
+
+        """
+        session_id = parms.get('session_id')
+        if session_id is None:
+            return
+
+        with self._lock:
+            replaced = set()
+            for camera_id in parms['camera_ids']:
+                previous = self._camera_sessions.get(camera_id)
+                if previous is not None and previous != session_id:
+                    replaced.add(previous)
+                self._camera_sessions[camera_id] = session_id
+
+            in_use = set(self._camera_sessions.values())
+            for previous in replaced - in_use:
+                self._received.pop(previous, None)
+
+    def receive(self, message):
+        """收到要確保送達的報告
+
+        回傳 (要回應的 REPORT_ACK 參數, 是否第一次收到)
+        沒有 session 資訊的報告 (舊版 slave) 不用回應
+
+        Args:
+            message: 報告訊息
+
+        """
+        parms = message.get_parms()
+        if 'session_id' not in parms:
+            return None, True
+
+        session_id = parms['session_id']
+        seq = parms['seq']
+        with self._lock:
+            if session_id in self._received:
+                self._received.move_to_end(session_id)
+            else:
+                self._received[session_id] = _ReceivedSeqs(self._max_window)
+                if len(self._received) > self._max_sessions:
+                    self._received.popitem(last=False)
+
+            is_new = self._received[session_id].add(seq)
+
+        return {'session_id': session_id, 'seq': seq}, is_new
+
+    def get_sessions_count(self):
+        """取得記錄中的 session 數量"""
+        return len(self._received)
+
+
+class _ReceivedSeqs():
+    """一個 session 收到的流水號
+
+    Args:
+        max_window: 亂序流水號的記錄上限
+
+    """
+
+    def __init__(self, max_window):
+        self._max_window = max_window
+        self._next = 0  # 比這個小的流水號都收過了
+        self._window = set()  # 比 _next 大且已收到的流水號
+
+    def add(self, seq):
+        """記錄流水號，回傳是否第一次收到"""
+        if seq < self._next or seq in self._window:
+            return False
+
+        self._window.add(seq)
+
+        # 亂序太多的話，中間沒收到的視為遺失
+        if len(self._window) > self._max_window:
+            self._next = min(self._window)
+
+        while self._next in self._window:
+            self._window.remove(self._next)
+            self._next += 1
+
+        return True
+
+    def __len__(self):
+        return len(self._window)
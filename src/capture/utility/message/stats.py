@@ -0,0 +1,122 @@
+from threading import Lock
+import bisect
+
+
+class MessageStats():
+    """連線的訊息統計
+
+    依訊息類型記錄寄出與收到的訊息數量、封包大小 (含標頭，壓縮後的大小)
+    收到的訊息以標頭的寄出時間計算延遲，累計成直方圖
+    延遲包含寄送佇列的等待，跨機器時會受時鐘誤差影響
+
+    """
+
+    # 延遲直方圖的區間上限 (毫秒)，最後一格為超過上限
+    latency_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self._lock = Lock()
+        self._sent = {}  # {訊息類型名稱: [數量, 大小]}
+        self._received = {}  # {訊息類型名稱: [數量, 大小]}
+        self._latency = {}  # {訊息類型名稱: 直方圖}
+
+    def on_sent(self, msg_type, size):
+        """記錄寄出的訊息
+
+        Args:
+            msg_type: 訊息類型
+            size: 封包大小
+
+        """
+        with self._lock:
+            counter = self._sent.setdefault(msg_type.name, [0, 0])
+            counter[0] += 1
+            counter[1] += size
+
+    def on_received(self, msg_type, size, latency):
+        """記錄收到的訊息
+
+        Args:
+            msg_type: 訊息類型
+            size: 封包大小
+            latency: 從寄出到收到的秒數
+
+        """
+        index = bisect.bisect_left(self.latency_bounds, latency * 1000)
+        with self._lock:
+            counter = self._received.setdefault(msg_type.name, [0, 0])
+            counter[0] += 1
+            counter[1] += size
+            histogram = self._latency.setdefault(
+                msg_type.name, [0] * (len(self.latency_bounds) + 1)
+            )
+            histogram[index] += 1
+
+    def get_received_bytes(self):
+        """取得收到的總大小"""
+        with self._lock:
+            return sum(size for _, size in self._received.values())
+
+    def to_dict(self):
+        """轉成字典
+
+        {sent: {類型: {count, bytes}}, received: {類型: {count, bytes}},
+         latency: {類型: [各區間數量]}}
+
+        """
+        with self._lock:
+            return {
+                'sent': {
+                    name: {'count': count, 'bytes': size}
+                    for name, (count, size) in self._sent.items()
+                },
+                'received': {
+                    name: {'count': count, 'bytes': size}
+                    for name, (count, size) in self._received.items()
+                },
+                'latency': {
+                    name: list(histogram)
+                    for name, histogram in self._latency.items()
+                }
+            }
+
+    @classmethod
+    def get_percentile(cls, histogram, percent):
+        """從直方圖估計延遲的百分位數 (毫秒)，取所在區間的上限
+
+        超過最後上限的區間回傳 None
+
+        Args:
+            histogram: 延遲直方圖
+            percent: 百分位 (0-100)
+
+        """
+        total = sum(histogram)
+        if total == 0:
+            return 0
+
+        threshold = total * percent / 100
+        count = 0
+        for bound, bucket in zip(cls.latency_bounds, histogram):
+            count += bucket
+            if count >= threshold:
+                return bound
+        return None
+
+    def format(self):
+        """整理成文字表格，給 log 傾印用"""
+        stats = self.to_dict()
+        lines = []
+        for direction in ('sent', 'received'):
+            for name, counter in sorted(stats[direction].items()):
+                line = (
+                    f'{direction:>8} {name:<20} {counter["count"]:>8}'
+                    f' {counter["bytes"] / 1024 ** 2:>10.2f} MB'
+                )
+                if direction == 'received':
+                    histogram = stats['latency'][name]
+                    p50 = self.get_percentile(histogram, 50)
+                    p99 = self.get_percentile(histogram, 99)
+                    line += f'  p50<={p50} ms p99<={p99} ms'
+                lines.append(line)
+        return '\n'.join(lines)
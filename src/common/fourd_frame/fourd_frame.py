@@ -4,7 +4,7 @@ import numpy as np
 import struct
 import json
 
-from common.jpeg_coder import jpeg_coder, TJPF_RGB
+from common.jpeg_coder import jpeg_coder, JpegProfile, TJPF_RGB
 
 
 class FourdFrameManager:
@@ -32,11 +32,18 @@ class FourdFrameManager:
     }
     header_format = '4s24sIIIIfIIIIIIII'
     header_size = 1024
+    texture_subsample = '422'
 
     @classmethod
     def get_header_template(cls):
         return cls.header.copy()
 
+    @classmethod
+    def get_texture_profile(cls, header):
+        return JpegProfile(
+            header['texture_quality'], cls.texture_subsample
+        )
+
     @classmethod
     def save_from_metashape(
             cls, geo_arr, tex_arr, save_path, frame, **kwargs
@@ -56,9 +63,7 @@ class FourdFrameManager:
         # texture
         print('Convert texture')
         tex_arr = np.copy(tex_arr)
-        texture_buffer = jpeg_coder.encode(
-            tex_arr, quality=header['texture_quality']
-        )
+        texture_buffer = cls.get_texture_profile(header).encode(tex_arr)
         header['texture_buffer_size'] = len(texture_buffer)
         header['texture_width'] = tex_arr.shape[1]
         header['texture_height'] = tex_arr.shape[0]
@@ -137,8 +142,8 @@ class FourdFrameManager:
         # texture
         print('Convert texture')
         image = Image.open(jpg_path)
-        texture_buffer = jpeg_coder.encode(
-            np.array(image), quality=header['texture_quality']
+        texture_buffer = cls.get_texture_profile(header).encode(
+            np.array(image)
         )
         header['texture_buffer_size'] = len(texture_buffer)
         header['texture_width'] = image.size[0]
@@ -184,6 +189,7 @@ class FourdFrame:
         self.header = self._load_header()
         self._geo_data = None
         self._texture_data = None
+        self._texture_key = None
         self._submit_data = None
         self._sfm_data = None
 
@@ -224,14 +230,23 @@ class FourdFrame:
             self._geo_data = [arr[:, :3], arr[:, 3:]]
         return self._geo_data
 
-    def get_texture_data(self, raw=False):
+    def get_texture_data(self, raw=False, profile=None, min_length=None):
+        # min_length: decode in the DCT domain down to this long side,
+        # instead of decoding full size and resizing afterwards
         if raw:
             texture_file = self.get_file_data('texture')
             texture_data = jpeg_coder.decode(texture_file, TJPF_RGB)
             return jpeg_coder.encode(texture_data)
-        if self._texture_data is None:
+        # the cached texture only serves calls with the same decode options
+        if profile is None:
+            profile = FourdFrameManager.get_texture_profile(self.header)
+        texture_key = (profile.fast_dct, profile.fast_upsample, min_length)
+        if self._texture_data is None or self._texture_key != texture_key:
             texture_file = self.get_file_data('texture')
-            self._texture_data = jpeg_coder.decode(texture_file)
+            self._texture_data = profile.decode(
+                texture_file, min_length=min_length
+            )
+            self._texture_key = texture_key
         return self._texture_data
 
     def get_obj_data(self):
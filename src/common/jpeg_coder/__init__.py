@@ -1 +1,3 @@
-from .jpeg_coder import jpeg_coder, TJPF_RGB
\ No newline at end of file
+from .jpeg_coder import (
+    jpeg_coder, JpegProfile, get_scaling_factor, TJPF_RGB, TJPF_BGR
+)
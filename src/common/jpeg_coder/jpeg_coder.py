@@ -1,6 +1,300 @@
 from pathlib import Path
-from turbojpeg import TurboJPEG, TJPF_RGB
+from ctypes import (
+    cdll, cast, byref, POINTER, Structure,
+    c_void_p, c_int, c_ulong, c_ubyte, c_char_p
+)
+import warnings
 
-jpeg_coder = TurboJPEG(
-    str(Path(__file__).parent / 'turbojpeg.dll')
+import numpy as np
+from turbojpeg import (
+    TurboJPEG, TJPF_RGB, TJPF_BGR, TJPF_GRAY,
+    TJSAMP_444, TJSAMP_422, TJSAMP_420, TJSAMP_GRAY,
+    TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE
 )
+
+_lib_path = str(Path(__file__).parent / 'turbojpeg.dll')
+jpeg_coder = TurboJPEG(_lib_path)
+
+TJERR_WARNING = 0  # tjGetErrorCode 的警告
+
+
+class ScalingFactor(Structure):
+    _fields_ = ('num', c_int), ('denom', c_int)
+
+
+class TurboDecompressor():
+    """解碼到給定陣列的 libjpeg-turbo 包裝
+
+    PyTurboJPEG 1.4.1 的 decode 每次都配置新的輸出陣列
+    這裡直接呼叫同一個函式庫的 tjDecompress2，把圖像寫進呼叫端給的陣列
+    輸出尺寸小於原圖時，libjpeg-turbo 會在 DCT 階段縮小到該尺寸
+    PyTurboJPEG 1.4.1 也沒有公開支援的縮放比例，由 scaling_factors 提供
+
+    Args:
+        lib_path: turbojpeg 函式庫位置
+
+    """
+
+    def __init__(self, lib_path):
+        lib = cdll.LoadLibrary(lib_path)
+
+        self._init = lib.tjInitDecompress
+        self._init.restype = c_void_p
+        self._destroy = lib.tjDestroy
+        self._destroy.argtypes = [c_void_p]
+        self._destroy.restype = c_int
+        self._decompress = lib.tjDecompress2
+        self._decompress.argtypes = [
+            c_void_p, POINTER(c_ubyte), c_ulong, POINTER(c_ubyte),
+            c_int, c_int, c_int, c_int, c_int
+        ]
+        self._decompress.restype = c_int
+
+        # 舊的 libjpeg-turbo 沒有以 handle 取得錯誤的函式
+        self._get_error_code = getattr(lib, 'tjGetErrorCode', None)
+        if self._get_error_code is not None:
+            self._get_error_code.argtypes = [c_void_p]
+            self._get_error_code.restype = c_int
+        self._get_error_str2 = getattr(lib, 'tjGetErrorStr2', None)
+        if self._get_error_str2 is not None:
+            self._get_error_str2.argtypes = [c_void_p]
+            self._get_error_str2.restype = c_char_p
+        self._get_error_str = lib.tjGetErrorStr
+        self._get_error_str.restype = c_char_p
+
+        get_scaling_factors = lib.tjGetScalingFactors
+        get_scaling_factors.argtypes = [POINTER(c_int)]
+        get_scaling_factors.restype = POINTER(ScalingFactor)
+        count = c_int()
+        factors = get_scaling_factors(byref(count))
+        self.scaling_factors = [
+            (factors[i].num, factors[i].denom) for i in range(count.value)
+        ]
+
+    @staticmethod
+    def _get_address(arr):
+        return cast(arr.__array_interface__['data'][0], POINTER(c_ubyte))
+
+    def decode(self, buf, dst, pixel_format=TJPF_BGR, flags=0):
+        """解碼到 dst，輸出尺寸為 dst 的高寬
+
+        Args:
+            buf: JPEG 資料
+            dst: 輸出的 uint8 陣列 (高, 寬, 通道)，每一列的像素要連續
+            pixel_format: 解碼的像素格式
+            flags: turbojpeg 旗標
+
+        """
+        height, width, channels = dst.shape
+        if (
+            dst.dtype != np.uint8 or
+            channels != _pixel_channels[pixel_format] or
+            dst.strides[1:] != (channels, 1)
+        ):
+            raise ValueError(
+                f'Can not decode into array {dst.shape} {dst.dtype}'
+            )
+
+        jpeg_array = np.frombuffer(buf, np.uint8)
+        handle = self._init()
+        try:
+            status = self._decompress(
+                handle, self._get_address(jpeg_array), jpeg_array.size,
+                self._get_address(dst), width, dst.strides[0], height,
+                pixel_format, flags
+            )
+            if status != 0:
+                self._report_error(handle)
+        finally:
+            self._destroy(handle)
+        return dst
+
+    def _report_error(self, handle):
+        """警告只提示，其他錯誤丟出 IOError，與 PyTurboJPEG 相同"""
+        if self._get_error_str2 is not None:
+            message = self._get_error_str2(handle).decode()
+        else:
+            message = self._get_error_str().decode()
+
+        if (
+            self._get_error_code is not None and
+            self._get_error_code(handle) == TJERR_WARNING
+        ):
+            warnings.warn(message)
+            return
+        raise IOError(message)
+
+
+# 各像素格式的通道數
+_pixel_channels = {TJPF_RGB: 3, TJPF_BGR: 3, TJPF_GRAY: 1}
+
+jpeg_decompressor = TurboDecompressor(_lib_path)
+
+
+def get_scaling_factor(width, height, min_length):
+    """取得 DCT 縮放解碼的比例
+
+    從 turbojpeg 支援的比例中，挑最長邊仍不小於 min_length 的最小比例
+    都不符合的話回傳 None，代表原尺寸解碼
+
+    Args:
+        width: 原圖寬
+        height: 原圖高
+        min_length: 解碼後最長邊的最小長度
+
+    """
+    length = max(width, height)
+    factor = None
+
+    for num, denom in jpeg_decompressor.scaling_factors:
+        if num >= denom:
+            continue
+
+        # turbojpeg 的縮放尺寸是無條件進位
+        if -(-length * num // denom) < min_length:
+            continue
+
+        if factor is None or num / denom < factor[0] / factor[1]:
+            factor = (num, denom)
+
+    return factor
+
+
+class JpegProfile():
+    """JPEG 編解碼設定
+
+    包裝 turbojpeg 的品質、色度取樣與 DCT 選項，讓每個使用的地方各自設定
+    色度取樣以字串表示: 444、422、420、gray
+
+    Args:
+        quality: JPEG 品質
+        subsample: 色度取樣
+        fast_dct: 是否使用較快但較不精確的 DCT
+        fast_upsample: 解碼時是否使用較快的色度放大
+
+    """
+
+    subsamples = {
+        '444': TJSAMP_444,
+        '422': TJSAMP_422,
+        '420': TJSAMP_420,
+        'gray': TJSAMP_GRAY
+    }
+
+    def __init__(
+        self, quality=85, subsample='422', fast_dct=False, fast_upsample=False
+    ):
+        subsample = str(subsample)
+        if subsample not in self.subsamples:
+            raise ValueError(f'Unknown JPEG subsample <{subsample}>')
+
+        self.quality = quality  # JPEG 品質
+        self.subsample = subsample  # 色度取樣
+        self.fast_dct = fast_dct  # 快速 DCT
+        self.fast_upsample = fast_upsample  # 快速色度放大
+
+    @classmethod
+    def from_parms(cls, parms, **kwargs):
+        """從設定字典建立，kwargs 會覆蓋字典的值
+
+        Args:
+            parms: {quality, subsample, fast_dct, fast_upsample}
+
+        """
+        keys = ('quality', 'subsample', 'fast_dct', 'fast_upsample')
+        values = {key: parms[key] for key in keys if key in parms}
+        values.update(kwargs)
+        return cls(**values)
+
+    def replace(self, **kwargs):
+        """複製一份並替換指定的值"""
+        values = {
+            'quality': self.quality,
+            'subsample': self.subsample,
+            'fast_dct': self.fast_dct,
+            'fast_upsample': self.fast_upsample
+        }
+        values.update(kwargs)
+        return JpegProfile(**values)
+
+    def _get_flags(self):
+        flags = 0
+        if self.fast_dct:
+            flags |= TJFLAG_FASTDCT
+        if self.fast_upsample:
+            flags |= TJFLAG_FASTUPSAMPLE
+        return flags
+
+    def encode(self, image, pixel_format=TJPF_BGR):
+        """編碼圖像
+
+        單通道的圖像或 gray 取樣會直接編碼成灰階 JPEG
+
+        Args:
+            image: 圖像陣列
+            pixel_format: 圖像的像素格式
+
+        """
+        if image.ndim == 2 or self.subsample == 'gray':
+            if image.ndim == 3 and image.shape[2] != 1:
+                raise ValueError('Gray JPEG needs a single channel image')
+            pixel_format = TJPF_GRAY
+            subsample = TJSAMP_GRAY
+            if image.ndim == 2:
+                image = image[..., None]
+        else:
+            subsample = self.subsamples[self.subsample]
+
+        return jpeg_coder.encode(
+            image,
+            quality=self.quality,
+            pixel_format=pixel_format,
+            jpeg_subsample=subsample,
+            flags=self._get_flags()
+        )
+
+    def decode(
+        self, buf, pixel_format=TJPF_BGR, min_length=None, allocate=None
+    ):
+        """解碼 JPEG
+
+        min_length 指定的話會在 DCT 階段直接縮小解碼
+        縮小到最長邊仍不小於 min_length 的最小比例，不需要全尺寸解碼
+        allocate 指定的話會解碼到它回傳的陣列，讓呼叫端重複使用輸出的記憶體
+
+        Args:
+            buf: JPEG 資料
+            pixel_format: 解碼的像素格式
+            min_length: 解碼後最長邊的最小長度
+            allocate: 以 (高, 寬, 通道) 取得輸出陣列的 func
+
+        """
+        if min_length is None and allocate is None:
+            return jpeg_coder.decode(
+                buf, pixel_format=pixel_format, flags=self._get_flags()
+            )
+
+        width, height = jpeg_coder.decode_header(buf)[:2]
+
+        scaling_factor = None
+        if min_length is not None:
+            scaling_factor = get_scaling_factor(width, height, min_length)
+
+        if allocate is None:
+            return jpeg_coder.decode(
+                buf,
+                pixel_format=pixel_format,
+                scaling_factor=scaling_factor,
+                flags=self._get_flags()
+            )
+
+        # turbojpeg 的縮放尺寸是無條件進位
+        if scaling_factor is not None:
+            num, denom = scaling_factor
+            width = -(-width * num // denom)
+            height = -(-height * num // denom)
+        dst = allocate((height, width, _pixel_channels[pixel_format]))
+
+        return jpeg_decompressor.decode(
+            buf, dst, pixel_format=pixel_format, flags=self._get_flags()
+        )
@@ -0,0 +1,75 @@
+"""測試共用的設定
+
+在任何位置執行: python -m pytest src/test_X.py
+測試檔放在 src 底下，模組以 capture 資料夾為準匯入
+設定檔與執行時需要的檔案複製到暫存資料夾並在那邊執行
+slave 的錄製資料夾與 master 的快取資料夾都建立在暫存資料夾裡
+slave.camera 以 submit worker 的方式載入，不建立 PySpin 相機系統
+master 的相機與模型套件在 __init__ 建立需要 UI 的單例，只登記不執行
+訊息模組的單例在匯入時就會啟動連線的執行緒，測試時只建立不啟動
+
+"""
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import importlib.util
+from pathlib import Path
+
+SRC_PATH = Path(__file__).parent
+CAPTURE_PATH = SRC_PATH / 'capture'
+
+# 執行時以相對路徑讀取的檔案
+WORK_FILES = (
+    'capture/settings',
+    'capture/source/ui/camera.json',
+    'resolve/setting.yaml'
+)
+
+# 不執行 __init__ 的套件
+MASTER_PACKAGES = ('master.camera', 'master.resolve')
+
+
+def make_work_path():
+    """建立執行用的暫存資料夾，回傳其中的 capture 資料夾"""
+    work_path = Path(tempfile.mkdtemp(prefix='4drec_test_'))
+    atexit.register(shutil.rmtree, work_path, True)
+
+    for name in WORK_FILES:
+        source = SRC_PATH / name
+        target = work_path / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if source.is_dir():
+            shutil.copytree(source, target)
+        else:
+            shutil.copy(source, target)
+    return work_path / 'capture'
+
+
+def register_package(name):
+    """登記套件但不執行 __init__，底下的模組照常匯入"""
+    path = CAPTURE_PATH.joinpath(*name.split('.'))
+    spec = importlib.util.spec_from_file_location(
+        name, path / '__init__.py', submodule_search_locations=[str(path)]
+    )
+    sys.modules[name] = importlib.util.module_from_spec(spec)
+
+
+os.environ.setdefault('4DREC_TYPE', 'SLAVE')
+os.chdir(make_work_path())
+sys.path.insert(0, str(CAPTURE_PATH))
+
+for package_name in MASTER_PACKAGES:
+    register_package(package_name)
+
+from slave.submit_worker import WORKER_ENV  # noqa: E402
+from utility.mix_thread import MixThread  # noqa: E402
+
+os.environ[WORKER_ENV] = '1'
+
+MixThread.start = lambda self: None
+try:
+    import utility.message  # noqa: E402, F401
+finally:
+    del MixThread.start
@@ -0,0 +1,51 @@
+"""slave 相機圖像測試"""
+
+import numpy as np
+import pytest
+
+from common.jpeg_coder import JpegProfile
+from slave.camera.image import CameraImage
+
+WIDTH = 64
+HEIGHT = 48
+
+
+def make_bayer(red, green, blue):
+    """產生單一顏色場景的 RGGB 原始資料"""
+    im = np.empty((HEIGHT, WIDTH), np.uint8)
+    im[0::2, 0::2] = red
+    im[0::2, 1::2] = green
+    im[1::2, 0::2] = green
+    im[1::2, 1::2] = blue
+    return CameraImage(im.tobytes(), WIDTH, HEIGHT)
+
+
+@pytest.mark.parametrize('convert', [
+    lambda image: image._raw_to_cv2(),
+    lambda image: image._raw_to_binned(2)
+])
+def test_channel_order(convert):
+    # 紅色場景在 BGR 的第三個通道
+    im = convert(make_bayer(200, 0, 0))
+    center = im[im.shape[0] // 2, im.shape[1] // 2]
+    assert list(center) == [0, 0, 200]
+
+    im = convert(make_bayer(0, 0, 200))
+    center = im[im.shape[0] // 2, im.shape[1] // 2]
+    assert list(center) == [200, 0, 0]
+
+
+def test_binned_size():
+    im = make_bayer(10, 20, 30)._raw_to_binned(4)
+    assert im.shape == (HEIGHT // 8, WIDTH // 8, 3)
+    assert (im == [30, 20, 10]).all()
+
+
+def test_gray_weights():
+    # 灰階以 BGR 權重計算，紅色約為 0.299
+    profile = JpegProfile(95, 'gray')
+    for scale_length in (None, WIDTH // 2, WIDTH // 8):
+        jpeg = make_bayer(200, 0, 0).convert_jpeg(profile, scale_length)
+        im = profile.decode(jpeg)
+        center = im[im.shape[0] // 2, im.shape[1] // 2]
+        assert abs(int(center.min()) - 60) <= 4
@@ -0,0 +1,133 @@
+"""master 硬碟圖像快取測試"""
+import os
+import time
+from enum import Enum
+
+from master.camera.disk_cache import CameraPixmapDiskCache
+
+
+class CacheType(Enum):
+    FULL = 1
+
+
+class Pixmap():
+    """測試用的 CameraPixmap"""
+
+    def __init__(self, frame, size=0, shot_id='s1', camera_id='c1'):
+        self.shot_id = shot_id
+        self.camera_id = camera_id
+        self.frame = frame
+        self._cache = bytes([frame % 256]) * size if size > 0 else None
+        self._shape = (1, size, 1) if size > 0 else None
+
+    def get_cache_type(self):
+        return CacheType.FULL
+
+    def is_cache(self):
+        return self._cache is not None
+
+    def get_cache(self):
+        return self._cache, self._shape
+
+    def load_cache(self, cache, shape):
+        self._cache = bytes(cache)
+        self._shape = shape
+
+
+def wait_written(cache, frames, timeout=5.0):
+    end_time = time.perf_counter() + timeout
+    while not cache._queue.empty() or any(
+        cache.get_key(Pixmap(frame)) not in cache._index for frame in frames
+    ):
+        assert time.perf_counter() < end_time, 'timeout'
+        time.sleep(0.01)
+
+
+def load_frame(cache, frame, **kwargs):
+    pixmap = Pixmap(frame, **kwargs)
+    if not cache.get(pixmap):
+        return None
+    return pixmap.get_cache()
+
+
+def test_round_trip(tmp_path):
+    cache = CameraPixmapDiskCache(str(tmp_path), 1024 ** 2)
+    for frame in range(3):
+        cache.put(Pixmap(frame, 100 + frame))
+    wait_written(cache, range(3))
+
+    for frame in range(3):
+        data, shape = load_frame(cache, frame)
+        assert data == bytes([frame]) * (100 + frame)
+        assert shape == (1, 100 + frame, 1)
+    assert load_frame(cache, 3) is None
+    assert load_frame(cache, 0, camera_id='c2') is None
+    assert cache.get_size() == 303
+
+
+def test_skip_uncached(tmp_path):
+    cache = CameraPixmapDiskCache(str(tmp_path), 1024 ** 2)
+    cache.put(Pixmap(0))
+    cache.put(Pixmap(1, 10))
+    cache.put(Pixmap(1, 20))
+    wait_written(cache, [1])
+    assert cache.get_size() == 10
+
+
+def test_disabled(tmp_path):
+    path = tmp_path / 'cache'
+    cache = CameraPixmapDiskCache(str(path), 0)
+    cache.put(Pixmap(0, 10))
+    assert not cache.get(Pixmap(0))
+    assert not path.exists()
+    assert not cache.is_alive()
+
+
+def test_reload(tmp_path):
+    cache = CameraPixmapDiskCache(str(tmp_path), 1024 ** 2)
+    for frame in range(2):
+        cache.put(Pixmap(frame, 50))
+    wait_written(cache, range(2))
+
+    # 重開後從區段重建索引，新的寫入從新的區段開始
+    reloaded = CameraPixmapDiskCache(str(tmp_path), 1024 ** 2)
+    assert load_frame(reloaded, 1)[0] == bytes([1]) * 50
+    reloaded.put(Pixmap(2, 50))
+    wait_written(reloaded, [2])
+    assert reloaded._index[reloaded.get_key(Pixmap(2))][0] == 1
+    assert reloaded.get_size() == 150
+
+
+def test_torn_write(tmp_path):
+    cache = CameraPixmapDiskCache(str(tmp_path), 1024 ** 2)
+    for frame in range(3):
+        cache.put(Pixmap(frame, 50))
+    wait_written(cache, range(3))
+    cache._close_segment()
+
+    # 最後一筆資料只寫了一半
+    data_path = tmp_path / f'{0:06d}{CameraPixmapDiskCache.data_ext}'
+    os.truncate(data_path, 120)
+
+    reloaded = CameraPixmapDiskCache(str(tmp_path), 1024 ** 2)
+    assert load_frame(reloaded, 1)[0] == bytes([1]) * 50
+    assert load_frame(reloaded, 2) is None
+
+
+def test_evict_segments(tmp_path):
+    cache = CameraPixmapDiskCache(str(tmp_path), 250, segment_size=100)
+    for frame in range(6):
+        cache.put(Pixmap(frame, 50))
+        wait_written(cache, [frame])
+
+    # 每個區段兩筆，超過上限刪除最舊的區段
+    assert load_frame(cache, 0) is None
+    assert load_frame(cache, 1) is None
+    for frame in range(2, 6):
+        assert load_frame(cache, frame)[0] == bytes([frame]) * 50
+    assert cache.get_size() == 200
+    assert sorted(os.listdir(tmp_path)) == [
+        f'{segment:06d}{ext}' for segment in (1, 2)
+        for ext in (CameraPixmapDiskCache.data_ext,
+                    CameraPixmapDiskCache.meta_ext)
+    ]
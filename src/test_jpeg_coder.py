@@ -0,0 +1,77 @@
+"""JPEG 編解碼測試"""
+
+import cv2
+import numpy as np
+import pytest
+
+from common.jpeg_coder import JpegProfile, TJPF_RGB, TJPF_BGR
+from common.jpeg_coder.jpeg_coder import TJPF_GRAY
+
+
+def make_jpeg(profile, width=640, height=480):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 3), np.uint8)
+    return profile.encode(cv2.GaussianBlur(image, (0, 0), 3))
+
+
+class Buffers():
+    """記錄 allocate 呼叫的陣列池"""
+
+    def __init__(self):
+        self.arrays = {}
+        self.calls = 0
+
+    def allocate(self, shape):
+        self.calls += 1
+        if shape not in self.arrays:
+            self.arrays[shape] = np.empty(shape, np.uint8)
+        return self.arrays[shape]
+
+
+@pytest.mark.parametrize('pixel_format', [TJPF_RGB, TJPF_BGR])
+def test_decode_into_buffer(pixel_format):
+    profile = JpegProfile(90, '422')
+    jpeg = make_jpeg(profile)
+    expected = profile.decode(jpeg, pixel_format)
+
+    buffers = Buffers()
+    for _ in range(2):
+        im = profile.decode(jpeg, pixel_format, allocate=buffers.allocate)
+        assert im is buffers.arrays[(480, 640, 3)]
+        assert np.array_equal(im, expected)
+    assert buffers.calls == 2
+    assert len(buffers.arrays) == 1
+
+
+def test_decode_gray_into_buffer():
+    profile = JpegProfile(90, 'gray')
+    jpeg = profile.encode(np.full((48, 64), 100, np.uint8))
+
+    buffers = Buffers()
+    im = profile.decode(jpeg, TJPF_GRAY, allocate=buffers.allocate)
+    assert im.shape == (48, 64, 1)
+    assert abs(int(im.mean()) - 100) <= 1
+
+
+def test_decode_into_wrong_buffer():
+    profile = JpegProfile(90, '422')
+    jpeg = make_jpeg(profile, 64, 48)
+    with pytest.raises(ValueError):
+        profile.decode(
+            jpeg, allocate=lambda shape: np.empty(shape, np.float32)
+        )
+
+
+@pytest.mark.parametrize('min_length', [100, 320, 640])
+def test_decode_scaled(min_length):
+    profile = JpegProfile(90, '422')
+    jpeg = make_jpeg(profile)
+
+    im = profile.decode(jpeg, min_length=min_length)
+    assert min_length <= max(im.shape[:2]) <= 640
+
+    buffers = Buffers()
+    pooled = profile.decode(
+        jpeg, min_length=min_length, allocate=buffers.allocate
+    )
+    assert np.array_equal(pooled, im)
@@ -0,0 +1,289 @@
+"""訊息編碼、寄送佇列與路由測試"""
+import time
+import socket
+import struct
+
+import numpy as np
+import pytest
+
+from utility.define import MessageType
+from utility.message import Message
+from utility.message.codec import MessageCodec
+from utility.message.node import MessageNodeManager
+from utility.message.send_queue import MessageSendQueue
+
+
+def load_packet(packet):
+    """以封包建立訊息，與 MessageReceiveNode 的流程相同"""
+    msg_type, flags, sent_time, parms_size, _ = Message.unpack_meta(
+        packet[:Message.META_SIZE]
+    )
+    start = Message.META_SIZE
+    return Message.load_from_bytes(
+        msg_type,
+        packet[start:start + parms_size],
+        packet[start + parms_size:],
+        flags, sent_time
+    )
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        assert len(chunk) > 0, 'connection closed'
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    meta = recv_exactly(sock, Message.META_SIZE)
+    _, _, _, parms_size, payload_size = Message.unpack_meta(meta)
+    return load_packet(meta + recv_exactly(sock, parms_size + payload_size))
+
+
+def test_codec_round_trip():
+    parms = {
+        'camera_id': '相機1',
+        'frame_range': (0, 10),
+        'missing_frames': [np.int64(3), np.uint32(5)],
+        'size': np.float32(0.5),
+        'nested': {'is_start': True, 'shot_id': None},
+        'empty': []
+    }
+    decoded = MessageCodec.decode(MessageCodec.encode(parms))
+    assert decoded == {
+        'camera_id': '相機1',
+        'frame_range': [0, 10],
+        'missing_frames': [3, 5],
+        'size': 0.5,
+        'nested': {'is_start': True, 'shot_id': None},
+        'empty': []
+    }
+    assert type(decoded['missing_frames'][0]) is int
+
+
+@pytest.mark.parametrize('value', [b'bytes', {1, 2}, object()])
+def test_codec_unsupported(value):
+    with pytest.raises(TypeError):
+        MessageCodec.encode({'value': value})
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('payload_size', [0, 4096])
+def test_message_round_trip(compress, payload_size):
+    payload = b'\x00' * payload_size
+    # 重複的內容一定壓得比較小
+    message = Message(
+        MessageType.RECORD_REPORT,
+        {'camera_id': 'c1', 'note': 'frame missing ' * 200},
+        payload
+    )
+    buffers = message.to_buffers(compress)
+    assert len(buffers) == (1 if len(payload) == 0 else 2)
+
+    packet = b''.join(buffers)
+    _, flags, _, _, _ = Message.unpack_meta(packet[:Message.META_SIZE])
+    assert bool(flags & Message.FLAG_LZ4) == compress
+    if compress:
+        assert len(packet) < len(message.to_packet())
+
+    loaded = load_packet(packet)
+    assert loaded.type is MessageType.RECORD_REPORT
+    assert loaded.get_parms() == message.get_parms()
+    assert bytes(loaded._payload) == payload
+    assert loaded.get_sent_time() == message.get_sent_time()
+
+
+def test_message_compress_skipped():
+    # JPEG、太小與壓縮後沒變小的訊息不壓縮
+    for message in (
+        Message(MessageType.SHOT_IMAGE, {'camera_id': 'c1'}, b'\x00' * 4096),
+        Message(MessageType.RECORD_REPORT, {'camera_id': 'c1'}),
+        Message(MessageType.RECORD_REPORT, {
+            'missing_frames': list(range(500))
+        })
+    ):
+        packet = b''.join(message.to_buffers(compress=True))
+        _, flags, _, _, _ = Message.unpack_meta(packet[:Message.META_SIZE])
+        assert flags == 0
+        assert bytes(load_packet(packet)._payload) == bytes(message._payload)
+
+
+@pytest.mark.parametrize('msg_type', [
+    MessageType.MASTER_UP, MessageType.MASTER_LOST, MessageType.MASTER_DOWN
+])
+def test_message_unpack_notice(msg_type):
+    assert Message(msg_type).unpack() == {}
+    parms = {'session_id': 's1'}
+    assert load_packet(Message(msg_type, parms).to_packet()).unpack() == parms
+
+
+def test_message_version():
+    packet = bytearray(Message(MessageType.RETRIGGER).to_packet())
+    packet[0] = MessageCodec.VERSION - 1
+    with pytest.raises(ValueError):
+        Message.unpack_meta(bytes(packet[:Message.META_SIZE]))
+
+
+def test_send_queue_lanes():
+    queue = MessageSendQueue()
+    queue.put(Message(MessageType.SHOT_IMAGE, {'frame': 0}, b'x'))
+    queue.put(Message(MessageType.RECORD_REPORT, {'camera_id': 'c1'}))
+    queue.put(Message(MessageType.TOGGLE_RECORDING, {'is_start': True}))
+    assert queue.get_depths() == {'control': 1, 'status': 1, 'bulk': 1}
+
+    types = [queue.pop()[0].type for _ in range(3)]
+    assert types == [
+        MessageType.TOGGLE_RECORDING,
+        MessageType.RECORD_REPORT,
+        MessageType.SHOT_IMAGE
+    ]
+    assert queue.pop() == (None, None)
+
+
+def test_send_queue_coalesce():
+    queue = MessageSendQueue()
+    for frame in range(3):
+        for camera_id in ('c1', 'c2'):
+            queue.put(Message(
+                MessageType.LIVE_VIEW_IMAGE,
+                {'camera_id': camera_id, 'frame': frame}, b'x'
+            ))
+
+    # 相機狀態合併欄位，不丟掉先前的變化
+    queue.put(Message(MessageType.CAMERA_STATUS, {'c1': {'fps': 30}}))
+    queue.put(Message(MessageType.CAMERA_STATUS, {'c1': {'state': 1}}))
+    queue.put(Message(MessageType.CAMERA_STATUS, {'c1': {'fps': 29}}))
+    assert queue.get_coalesced_count() == 6
+
+    status = queue.get()
+    assert status.get_parms() == {'c1': {'fps': 29, 'state': 1}}
+    images = [queue.get().get_parms() for _ in range(2)]
+    assert images == [
+        {'camera_id': 'c1', 'frame': 2}, {'camera_id': 'c2', 'frame': 2}
+    ]
+    assert queue.pop() == (None, None)
+
+
+def test_send_queue_bulk_rate():
+    queue = MessageSendQueue(bulk_rate=1000)
+    for _ in range(2):
+        queue.put(Message(MessageType.SHOT_IMAGE, {}, b'\x00' * 800))
+
+    assert queue.pop()[0] is not None
+    message, wait = queue.pop()
+    assert message is None and 0 < wait <= 0.8
+
+    # 控制訊息不受限制
+    queue.put(Message(MessageType.RETRIGGER))
+    assert queue.pop()[0].type is MessageType.RETRIGGER
+
+    start_time = time.perf_counter()
+    assert queue.get().type is MessageType.SHOT_IMAGE
+    assert time.perf_counter() - start_time > wait / 2
+
+
+class RouteServer():
+    """master 端的 MessageNodeManager 與兩個 slave 連線"""
+
+    def __init__(self, count=2):
+        self.inbox = []
+        self.manager = MessageNodeManager(self.inbox.append)
+        self.clients = []
+
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(count)
+        for _ in range(count):
+            client = socket.create_connection(server.getsockname())
+            conn, _ = server.accept()
+            self.manager.add_connection(conn)
+            self.clients.append(client)
+        server.close()
+        self.nodes = self.manager.get_all()
+
+    def announce(self, index, camera_ids):
+        self.clients[index].sendall(Message(
+            MessageType.NODE_ANNOUNCE,
+            {'camera_ids': camera_ids, 'session_id': str(index)}
+        ).to_packet())
+
+    def wait_inbox(self, count, timeout=5.0):
+        end_time = time.perf_counter() + timeout
+        while len(self.inbox) < count:
+            assert time.perf_counter() < end_time, 'timeout'
+            time.sleep(0.01)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        for node in self.nodes:
+            node.stop()
+            # 喚醒等待寄送佇列的 node 讓它結束
+            if hasattr(node, 'add_send_queue'):
+                node.add_send_queue(Message(MessageType.RETRIGGER))
+
+
+@pytest.fixture
+def route_server():
+    server = RouteServer()
+    yield server
+    server.close()
+
+
+def test_route_to_owner(route_server):
+    route_server.announce(0, ['c1', 'c2'])
+    route_server.announce(1, ['c3'])
+    route_server.wait_inbox(2)
+
+    manager = route_server.manager
+    manager.add_send_queue(
+        Message(MessageType.GET_SHOT_IMAGE, {'camera_id': 'c3'}), 'c3'
+    )
+    manager.add_send_queue(
+        Message(MessageType.GET_SHOT_IMAGE, {'camera_id': 'c1'}), 'c1'
+    )
+    # 不在路由表的相機廣播
+    manager.add_send_queue(
+        Message(MessageType.GET_SHOT_IMAGE, {'camera_id': 'c9'}), 'c9'
+    )
+
+    first, second = route_server.clients
+    assert recv_message(first).get_parms() == {'camera_id': 'c1'}
+    assert recv_message(first).get_parms() == {'camera_id': 'c9'}
+    assert recv_message(second).get_parms() == {'camera_id': 'c3'}
+    assert recv_message(second).get_parms() == {'camera_id': 'c9'}
+
+
+def test_route_removed(route_server):
+    route_server.announce(0, ['c1', 'c2'])
+    route_server.announce(1, ['c3'])
+    route_server.wait_inbox(2)
+
+    manager = route_server.manager
+    name = route_server.clients[0].getsockname()
+    node = next(
+        node for node in manager.get_all() if node.get_name() == name
+    )
+    assert sorted(manager.remove(node)) == ['c1', 'c2']
+    assert manager.get_count() == 1
+
+    # 負責的 node 移除後改為廣播給剩下的連線
+    manager.add_send_queue(Message(MessageType.CAMERA_PARM, {
+        'camera_parm': ('gain', 1)
+    }), 'c1')
+    message = recv_message(route_server.clients[1])
+    assert message.unpack() == ['gain', 1]
+
+
+def test_route_payload(route_server):
+    payload = struct.pack('>I', 7) * 1024
+    route_server.clients[1].sendall(Message(
+        MessageType.SHOT_IMAGE, {'camera_id': 'c3', 'frame': 1}, payload
+    ).to_packet())
+    route_server.wait_inbox(1)
+
+    parms, received = route_server.inbox[0].unpack()
+    assert parms == {'camera_id': 'c3', 'frame': 1}
+    assert bytes(received) == payload
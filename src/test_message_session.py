@@ -0,0 +1,89 @@
+"""訊息 session 測試"""
+
+from utility.define import MessageType
+from utility.message import Message
+from utility.message.session import (
+    MessageSession, MessageSessionTracker
+)
+
+
+def make_report(session, seq, camera_id='cam'):
+    return Message(MessageType.RECORD_REPORT, {
+        'camera_id': camera_id, 'session_id': session, 'seq': seq
+    })
+
+
+def receive_all(tracker, session, seqs):
+    return [tracker.receive(make_report(session, seq))[1] for seq in seqs]
+
+
+def test_session_ack():
+    session = MessageSession(max_unacked=3)
+    for frame in range(5):
+        session.track(MessageType.RECORD_REPORT, {'frame': frame}, b'')
+    # 超過上限丟掉最舊的
+    assert [m.get_parms()['seq'] for m in session.get_unacked()] == [2, 3, 4]
+
+    session.ack({'session_id': 'other', 'seq': 2})
+    session.ack({'session_id': session.get_id(), 'seq': 3})
+    assert [m.get_parms()['seq'] for m in session.get_unacked()] == [2, 4]
+
+
+def test_tracker_duplicates():
+    tracker = MessageSessionTracker()
+    assert receive_all(tracker, 'a', [0, 1, 2]) == [True] * 3
+    assert receive_all(tracker, 'a', [0, 1, 2]) == [False] * 3
+    # 不同 session 的流水號分開記
+    assert receive_all(tracker, 'b', [0]) == [True]
+
+    # 舊版 slave 沒有 session 資訊
+    ack, is_new = tracker.receive(
+        Message(MessageType.RECORD_REPORT, {'camera_id': 'cam'})
+    )
+    assert ack is None and is_new
+
+
+def test_tracker_out_of_order():
+    tracker = MessageSessionTracker()
+    assert receive_all(tracker, 'a', [0, 3, 2, 3, 1, 2]) == [
+        True, True, True, False, True, False
+    ]
+    received = tracker._received['a']
+    assert received._next == 4
+    assert len(received) == 0
+
+
+def test_tracker_window_limit():
+    tracker = MessageSessionTracker(max_window=3)
+    # 0 遺失，亂序的流水號超過上限後往前推進
+    assert receive_all(tracker, 'a', [1, 2, 3, 4]) == [True] * 4
+    received = tracker._received['a']
+    assert received._next == 5
+    assert len(received) == 0
+    assert receive_all(tracker, 'a', [0, 4, 5]) == [False, False, True]
+
+
+def test_tracker_replaced_session():
+    tracker = MessageSessionTracker()
+    tracker.announce({'camera_ids': ['c1', 'c2'], 'session_id': 'a'})
+    receive_all(tracker, 'a', [0, 1])
+
+    # c1 換了 session，a 還有 c2 在用
+    tracker.announce({'camera_ids': ['c1'], 'session_id': 'b'})
+    receive_all(tracker, 'b', [0])
+    assert tracker.get_sessions_count() == 2
+
+    tracker.announce({'camera_ids': ['c2'], 'session_id': 'c'})
+    assert tracker.get_sessions_count() == 1
+    assert receive_all(tracker, 'b', [0]) == [False]
+
+
+def test_tracker_sessions_limit():
+    tracker = MessageSessionTracker(max_sessions=2)
+    for session in 'abc':
+        receive_all(tracker, session, [0])
+    receive_all(tracker, 'b', [1])
+    assert tracker.get_sessions_count() == 2
+    assert receive_all(tracker, 'b', [0]) == [False]
+    # 最久沒收到報告的 a 已丟掉
+    assert receive_all(tracker, 'a', [0]) == [True]
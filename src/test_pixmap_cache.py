@@ -0,0 +1,90 @@
+"""master 圖像快取測試"""
+from master.camera.cache import CameraPixmapCache
+
+
+class Pixmap():
+    """測試用的 CameraPixmap"""
+
+    def __init__(self, frame, size=10, shot_id='s1', camera_id='c1'):
+        self.shot_id = shot_id
+        self.camera_id = camera_id
+        self.frame = frame
+        self._size = size
+
+    def get_cache_type(self):
+        return 'full'
+
+    def get_size(self):
+        return self._size
+
+
+def put_frames(cache, frames, **kwargs):
+    evicted = []
+    for frame in frames:
+        evicted += cache.put(Pixmap(frame, **kwargs))
+    return [pixmap.frame for pixmap in evicted]
+
+
+def test_get():
+    cache = CameraPixmapCache(100)
+    pixmap = Pixmap(0)
+    cache.put(pixmap)
+    assert cache.get(Pixmap(0)) is pixmap
+    assert cache.get(Pixmap(1)) is None
+    assert cache.get(Pixmap(0, camera_id='c2')) is None
+    assert cache.get(Pixmap(0, shot_id='s2')) is None
+
+
+def test_lru_eviction():
+    cache = CameraPixmapCache(30)
+    assert put_frames(cache, range(3)) == []
+
+    # 最近用到的 0 留下來
+    cache.get(Pixmap(0))
+    assert put_frames(cache, [3]) == [1]
+    assert put_frames(cache, [4]) == [2]
+    assert cache.get(Pixmap(0)) is not None
+    assert cache.get_size() == 30
+
+
+def test_replace():
+    cache = CameraPixmapCache(30)
+    put_frames(cache, range(3))
+
+    # 同 key 取代不會重複計算大小
+    assert put_frames(cache, [1], size=5) == []
+    assert cache.get_size() == 25
+    assert cache.get(Pixmap(1)).get_size() == 5
+
+
+def test_pin():
+    cache = CameraPixmapCache(40)
+    cache.pin('s1', 0, 1)
+    put_frames(cache, range(4))
+
+    # 先淘汰沒釘選的
+    assert put_frames(cache, [4, 5]) == [2, 3]
+    assert cache.get(Pixmap(0)) is not None
+
+    # 換釘選範圍，解除釘選的依使用順序放到沒釘選 LRU 最新的位置
+    cache.pin('s1', 4, 5)
+    assert put_frames(cache, [6]) == [1]
+    assert put_frames(cache, [7, 8]) == [0, 6]
+    assert cache.get(Pixmap(4)) is not None
+
+
+def test_pinned_over_budget():
+    # 釘選的圖像本身就超過上限時才淘汰釘選的
+    cache = CameraPixmapCache(20)
+    cache.pin('s1', 0, 10)
+    put_frames(cache, [20])
+    assert put_frames(cache, [0, 1]) == [20]
+    assert put_frames(cache, [2]) == [0]
+    assert cache.get_size() == 20
+
+
+def test_oversized():
+    cache = CameraPixmapCache(20)
+    assert put_frames(cache, [0]) == []
+    assert put_frames(cache, [1], size=50) == [0, 1]
+    assert cache.get_size() == 0
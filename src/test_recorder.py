@@ -0,0 +1,260 @@
+"""slave 錄製器測試"""
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+
+from utility.setting import setting
+from slave.camera import recorder as recorder_module
+from slave.camera.image import CameraImage
+from slave.camera.shot import (
+    CameraShotFileDumper, CameraShotFileLoader
+)
+
+log = logging.getLogger('test_recorder')
+
+
+class ShotMeta():
+    """測試用的 shot 資訊"""
+
+    camera_id = 'test'
+    shot_id = 'test'
+    is_cali = False
+
+    def __init__(self, path):
+        self._path = path
+
+    def get_path(self):
+        return self._path
+
+
+class ReportCatcher():
+    """接住錄製報告，取代 message_manager"""
+
+    def __init__(self):
+        self.reports = []
+
+    def send_message(self, msg_type, parms=None, payload=b''):
+        self.reports.append(parms)
+
+
+def make_image(frame):
+    return CameraImage(np.full(64, frame % 256, np.uint8), 8, 8)
+
+
+def wait_until(func, timeout=5.0):
+    end_time = time.perf_counter() + timeout
+    while not func():
+        assert time.perf_counter() < end_time, 'timeout'
+        time.sleep(0.01)
+
+
+def test_ring_round_trip():
+    ring = recorder_module.CameraFrameRing(2)
+    image = make_image(1)
+    assert ring.put(1, image) == (True, None)
+
+    # 放入時已經複製，擷取端可以重複使用自己的陣列
+    image.get_data()[:] = 0
+    frame, slot, camera_image = ring.get()
+    assert frame == 1
+    assert camera_image.get_size() == (8, 8)
+    assert (camera_image.get_data() == 1).all()
+
+    # 槽位只配置一次
+    slots = list(ring._slots)
+    ring.release(slot)
+    ring.put(2, make_image(2))
+    assert all(a is b for a, b in zip(slots, ring._slots))
+
+    ring.put_stop()
+    assert ring.get()[0] == 2
+    assert ring.get() == (None, None, None)
+
+
+def test_ring_full():
+    ring = recorder_module.CameraFrameRing(2)
+    ring.put(0, make_image(0))
+    ring.put(1, make_image(1))
+    assert ring.put(2, make_image(2)) == (False, None)
+    assert ring.get_depth() == 2
+
+    # 捨棄最舊還沒寫入的圖像
+    assert ring.put(2, make_image(2), drop_oldest=True) == (True, 0)
+    assert ring.put(3, make_image(3), drop_oldest=True) == (True, 1)
+    frames = [ring.get()[0] for _ in range(2)]
+    assert frames == [2, 3]
+
+    # 寫入端取走的槽位還沒歸還，沒有可以捨棄的圖像
+    assert ring.put(4, make_image(4), drop_oldest=True) == (False, None)
+
+
+def test_ring_block():
+    ring = recorder_module.CameraFrameRing(1)
+    ring.put(0, make_image(0))
+    _, slot, _ = ring.get()
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(ring.put(1, make_image(1), block=True))
+    )
+    thread.start()
+    time.sleep(0.1)
+    assert thread.is_alive()
+
+    ring.release(slot)
+    thread.join(5)
+    assert results == [(True, None)]
+    frame, _, camera_image = ring.get()
+    assert frame == 1 and (camera_image.get_data() == 1).all()
+
+
+def gate_recorder(tmp_path, monkeypatch, policy):
+    """建立主檔案寫入會卡住的錄製器，回傳 (錄製器, 閘門, 報告)"""
+    setting.apply({'record': dict(
+        setting.record, overflow_policy=policy, ring_capacity=2
+    )})
+    gate = threading.Event()
+
+    class GatedDumper(CameraShotFileDumper):
+        def dump(self, frame, camera_image):
+            gate.wait()
+            super().dump(frame, camera_image)
+
+    catcher = ReportCatcher()
+    monkeypatch.setattr(recorder_module, 'CameraShotFileDumper', GatedDumper)
+    monkeypatch.setattr(recorder_module, 'message_manager', catcher)
+
+    recorder = recorder_module.CameraRecorder(
+        ShotMeta(str(tmp_path / 'shot')), log
+    )
+    wait_until(lambda: recorder._file is not None)
+
+    # 0 被寫入端取走卡住，緩衝環只剩一個槽位
+    recorder.add_task(0, make_image(0))
+    wait_until(lambda: recorder._ring.get_depth() == 0)
+    return recorder, gate, catcher.reports
+
+
+def test_drop_oldest_report(tmp_path, monkeypatch):
+    recorder, gate, reports = gate_recorder(
+        tmp_path, monkeypatch, 'drop_oldest'
+    )
+    for frame in range(1, 5):
+        recorder.add_task(frame, make_image(frame))
+
+    gate.set()
+    recorder.stop()
+    recorder.join()
+
+    stats = recorder.get_record_stats()
+    assert stats['policy'] == 'drop_oldest'
+    assert stats['dropped'] == 3
+    assert stats['queued'] == 5
+
+    report, = reports
+    assert report['record_stats']['dropped_frames'] == [1, 2, 3]
+    assert report['missing_frames'] == [1, 2, 3]
+    assert report['frame_range'] == (0, 4)
+    assert recorder.get_record_frames() == [0, 4]
+
+
+def test_block_report(tmp_path, monkeypatch):
+    recorder, gate, reports = gate_recorder(tmp_path, monkeypatch, 'block')
+    recorder.add_task(1, make_image(1))
+
+    thread = threading.Thread(
+        target=recorder.add_task, args=(2, make_image(2))
+    )
+    thread.start()
+    time.sleep(0.1)
+    assert thread.is_alive()
+
+    gate.set()
+    thread.join(5)
+    recorder.stop()
+    recorder.join()
+
+    stats = recorder.get_record_stats()
+    assert stats['blocked'] == 1
+    assert stats['blocked_time'] > 0
+    assert stats['dropped'] == 0
+
+    report, = reports
+    assert report['missing_frames'] == []
+    assert recorder.get_record_frames() == [0, 1, 2]
+
+
+def test_report_with_unordered_frames(tmp_path):
+    dumper = CameraShotFileDumper(str(tmp_path / 'shot'), log)
+    # spill 併回的影格接在主檔案最後
+    for frame in [0, 1, 10, 11, 12, 2, 3, 4, 5, 6, 7, 8]:
+        dumper.dump(frame, make_image(frame))
+    dumper.close()
+
+    report = dumper.get_report()
+    assert report['frame_range'] == (0, 12)
+    assert report['missing_frames'] == [9]
+
+
+def test_spill_report(tmp_path, monkeypatch):
+    setting.apply({'record': dict(
+        setting.record, overflow_policy='spill', ring_capacity=2
+    )})
+    main_path = str(tmp_path / 'shot')
+    spill_path = str(tmp_path / 'spill')
+
+    # 主檔案寫入先卡住，讓緩衝環滿到 spill
+    gate = threading.Event()
+
+    class GatedDumper(CameraShotFileDumper):
+        def dump(self, frame, camera_image):
+            if self._shot_file_path == main_path:
+                gate.wait()
+            super().dump(frame, camera_image)
+
+    catcher = ReportCatcher()
+    monkeypatch.setattr(recorder_module, 'CameraShotFileDumper', GatedDumper)
+    monkeypatch.setattr(recorder_module, 'message_manager', catcher)
+
+    recorder = recorder_module.CameraRecorder(
+        ShotMeta(main_path), log, spill_path=spill_path
+    )
+    wait_until(lambda: recorder._file is not None)
+
+    # 0 被寫入端取走卡住，1 放在緩衝環，2 ~ 9 spill
+    recorder.add_task(0, make_image(0))
+    wait_until(lambda: recorder._ring.get_depth() == 0)
+    recorder.add_task(1, make_image(1))
+    for frame in range(2, 10):
+        recorder.add_task(frame, make_image(frame))
+        # spill 的緩衝環一樣小，等寫完再放下一張
+        wait_until(lambda: len(recorder._spill_ring._free) == 2)
+
+    # 主檔案寫完後，10 ~ 14 寫在 spill 的影格之後
+    gate.set()
+    wait_until(lambda: len(recorder._ring._free) == 2)
+    for frame in range(10, 15):
+        recorder.add_task(frame, make_image(frame))
+        wait_until(lambda: len(recorder._ring._free) == 2)
+
+    recorder.stop()
+    recorder.join()
+
+    stats = recorder.get_record_stats()
+    assert stats['spilled'] == 8
+    assert stats['dropped'] == 0
+
+    report, = catcher.reports
+    assert report['frame_range'] == (0, 14)
+    assert report['missing_frames'] == []
+    assert sorted(recorder.get_record_frames()) == list(range(15))
+
+    # 併回的圖像可以從主檔案讀出，spill 暫存檔已刪除
+    loader = CameraShotFileLoader(main_path, log, use_index_cache=False)
+    for frame in range(15):
+        assert loader.load(frame).get_data()[0] == frame
+    loader.close()
+    assert not os.path.isfile(spill_path + CameraShotFileDumper.image_ext)
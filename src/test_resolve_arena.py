@@ -0,0 +1,210 @@
+"""master 模型快取測試"""
+import time
+import types
+import struct
+from pathlib import Path
+
+import lz4framed
+import numpy as np
+import pytest
+
+from utility.setting import setting
+from common.jpeg_coder import jpeg_coder
+from master.resolve.arena import ResolveArena
+from master.resolve.multi_executor import MultiExecutor
+from master.resolve.package import SharedBlock, ResolvePackage
+
+RESOLUTION = 16
+
+
+def make_package(frame, job_id='job'):
+    package = ResolvePackage(job_id, frame)
+    pos_list = np.full((30, 3), frame, np.float32)
+    uv_list = np.full((30, 2), frame, np.float32)
+    texture = np.full((RESOLUTION, RESOLUTION, 3), frame, np.uint8)
+    package._cache_buffer((pos_list, uv_list), texture)
+    return package
+
+
+def test_block_round_trip():
+    arrays = (
+        np.arange(30, dtype=np.float32).reshape(10, 3),
+        None,
+        np.arange(75, dtype=np.uint8).reshape(5, 5, 3)
+    )
+    block = SharedBlock.from_arrays(arrays)
+
+    views = block.get_arrays()
+    assert views[1] is None
+    for view, arr in zip(views, arrays):
+        if arr is not None:
+            assert view.dtype == arr.dtype
+            assert np.array_equal(view, arr)
+
+    # 每個陣列的起始位置對齊
+    offsets = [layout[0] for layout in block._layout if layout is not None]
+    assert all(offset % SharedBlock.align == 0 for offset in offsets)
+    assert block.get_size() == 128 + 128
+
+    del views, view
+    assert block.release()
+    assert block.release()
+
+
+def test_block_release_in_use():
+    block = SharedBlock.from_arrays((np.ones(10, np.float32),))
+    arr, = block.get_arrays()
+
+    # 陣列還在使用時無法關閉，資料仍可讀取
+    assert not block.release()
+    assert arr.sum() == 10
+
+    del arr
+    assert block.release()
+
+
+def test_arena_payload():
+    arena = ResolveArena(1024 ** 2)
+    arena.put(make_package(3))
+    assert arena.has('job', 3)
+    assert not arena.has('job', 4)
+    assert arena.get_payload('job', 4) is None
+
+    count, (pos_list, uv_list), texture, resolution = arena.get_payload(
+        'job', 3
+    )
+    assert count == 30
+    assert (pos_list == 3).all() and (uv_list == 3).all()
+    assert texture.shape == (RESOLUTION, RESOLUTION, 3)
+    assert (texture == 3).all()
+    del pos_list, uv_list, texture
+
+
+def test_arena_lru():
+    size = make_package(0).get_cache_size()
+    arena = ResolveArena(size * 2)
+
+    assert arena.put(make_package(0)) == []
+    assert arena.put(make_package(1)) == []
+
+    # 最近取用的 0 留下來
+    arena.get_payload('job', 0)
+    evicted = arena.put(make_package(2))
+    assert [package.get_meta() for package in evicted] == [('job', 1)]
+    assert arena.has('job', 0) and arena.has('job', 2)
+    assert arena.get_size() == size * 2
+
+
+def test_arena_duplicate():
+    arena = ResolveArena(1024 ** 2)
+    arena.put(make_package(0))
+    size = arena.get_size()
+
+    duplicate = make_package(0)
+    assert arena.put(duplicate) is None
+    assert arena.get_size() == size
+    assert duplicate._block._shm is None
+
+
+def test_arena_oversized():
+    # 單一模型超過上限還是留著
+    arena = ResolveArena(1)
+    assert arena.put(make_package(0)) == []
+    evicted = arena.put(make_package(1))
+    assert [package.get_meta() for package in evicted] == [('job', 0)]
+    assert arena.has('job', 1)
+
+
+def test_arena_retired():
+    size = make_package(0).get_cache_size()
+    arena = ResolveArena(size)
+    arena.put(make_package(0))
+
+    # UI 還在顯示 0，淘汰後先留著
+    payload = arena.get_payload('job', 0)
+    arena.put(make_package(1))
+    assert len(arena._retired) == 1
+    assert (payload[2] == 0).all()
+
+    del payload
+    arena.put(make_package(2))
+    assert arena._retired == []
+
+
+def write_old_format(path, frame):
+    """寫一個舊格式 (.4dr) 的模型檔"""
+    geo = np.full((30, 5), frame, np.float32)
+    geo_data = lz4framed.compress(geo.tobytes())
+    texture = np.full((RESOLUTION, RESOLUTION, 3), frame, np.uint8)
+    texture_data = jpeg_coder.encode(texture)
+    with open(f'{path}/{frame:06d}.4dr', 'wb') as f:
+        f.write(struct.pack('II', len(geo_data), len(texture_data)))
+        f.write(geo_data)
+        f.write(texture_data)
+
+
+def is_mapped(name):
+    """是否還有 process 映射這塊共享記憶體"""
+    for maps in Path('/proc').glob('[0-9]*/maps'):
+        try:
+            if name in maps.read_text():
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def wait_unmapped(name, timeout=5):
+    deadline = time.monotonic() + timeout
+    while is_mapped(name):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class CacheManager():
+    """代替 ResolveManager 存入快取，記錄淘汰後共享記憶體是否真的釋放"""
+
+    def __init__(self, budget):
+        self.arena = ResolveArena(budget)
+        self.names = {}
+        self.freed = []
+
+    def save_package(self, package):
+        self.names[package.get_meta()] = package._block._shm.name
+        for evicted in self.arena.put(package):
+            self.freed.append(wait_unmapped(self.names[evicted.get_meta()]))
+
+    def send_ui(self, package):
+        pass
+
+
+@pytest.mark.skipif(
+    not Path('/proc/self/maps').exists(), reason='need /proc maps'
+)
+def test_cache_all_frees_evicted(tmp_path):
+    export_path = tmp_path / 'job' / 'export'
+    export_path.mkdir(parents=True)
+    frames = range(6)
+    for frame in frames:
+        write_old_format(export_path, frame)
+
+    submit_job_path = setting.submit_job_path
+    setting.apply({'submit_job_path': f'{tmp_path}/'})
+    try:
+        sample = make_package(0)
+        size = sample.get_cache_size()
+        sample.release()
+        manager = CacheManager(size * 2)
+        executor = types.SimpleNamespace(_manager=manager)
+        MultiExecutor.cache_all(
+            executor, [('job', None, frame) for frame in frames]
+        )
+    finally:
+        setting.apply({'submit_job_path': submit_job_path})
+
+    # 淘汰的共享記憶體 master 與 worker 都已關閉
+    assert manager.freed == [True] * 4
+    assert manager.arena.get_size() == size * 2
+    assert sum(manager.arena.has('job', frame) for frame in frames) == 2
@@ -0,0 +1,214 @@
+"""slave shot 檔案格式測試"""
+import os
+import time
+import struct
+import logging
+
+import numpy as np
+import pytest
+
+from slave.camera.image import CameraImage
+from slave.camera.shot import (
+    CameraShotFileBuffer, CameraShotFileDumper, CameraShotFileLoader
+)
+
+log = logging.getLogger('test_shot')
+
+WIDTH = 16
+HEIGHT = 8
+
+
+def make_image(frame, width=WIDTH, height=HEIGHT):
+    data = np.arange(width * height, dtype=np.uint32) + frame
+    return CameraImage(data.astype(np.uint8), width, height)
+
+
+def dump_shot(path, frames, raw_format=True, **kwargs):
+    dumper = CameraShotFileDumper(path, log, raw_format=raw_format, **kwargs)
+    for frame in frames:
+        dumper.dump(frame, make_image(frame))
+    dumper.close()
+    return dumper
+
+
+def load_frames(path, frames, **kwargs):
+    loader = CameraShotFileLoader(path, log, **kwargs)
+    images = [loader.load(frame) for frame in frames]
+    datas = [None if image is None else image.get_data().copy()
+             for image in images]
+    sizes = [None if image is None else image.get_size() for image in images]
+    del images
+    loader.close()
+    return datas, sizes
+
+
+@pytest.mark.parametrize('raw_format', [True, False])
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_round_trip(tmp_path, raw_format, use_mmap):
+    path = str(tmp_path / 'shot')
+    frames = [3, 4, 5, 7, 8]
+    dump_shot(path, frames, raw_format, buffer_size=100, block_size=64)
+
+    with open(path + CameraShotFileDumper.image_ext, 'rb') as f:
+        is_raw = f.read(4) == CameraShotFileDumper.raw_magic
+    assert is_raw == raw_format
+
+    datas, sizes = load_frames(
+        path, frames + [6, 9], use_mmap=use_mmap, use_index_cache=False
+    )
+    for frame, data, size in zip(frames, datas, sizes):
+        assert np.array_equal(data, make_image(frame).get_data())
+        assert size == (WIDTH, HEIGHT)
+    assert datas[-2:] == [None, None]
+
+
+def test_duplicate_frame(tmp_path):
+    path = str(tmp_path / 'shot')
+    dumper = CameraShotFileDumper(path, log)
+    dumper.dump(0, make_image(0))
+    dumper.dump(1, make_image(1))
+    dumper.dump(1, make_image(100))
+    dumper.close()
+
+    # 重複的影格以後寫入的為主
+    datas, _ = load_frames(path, [0, 1], use_index_cache=False)
+    assert np.array_equal(datas[1], make_image(100).get_data())
+
+
+def test_raw_size_mismatch(tmp_path):
+    path = str(tmp_path / 'shot')
+    dumper = CameraShotFileDumper(path, log)
+    dumper.dump(0, make_image(0))
+    dumper.dump(1, make_image(1, WIDTH * 2))
+    dumper.dump(2, make_image(2))
+    dumper.close()
+
+    assert dumper.get_frames() == [0, 2]
+    datas, _ = load_frames(path, [0, 1, 2], use_index_cache=False)
+    assert datas[1] is None
+    assert np.array_equal(datas[2], make_image(2).get_data())
+
+
+@pytest.mark.parametrize('raw_format', [True, False])
+@pytest.mark.parametrize('ext', [
+    CameraShotFileDumper.image_ext, CameraShotFileDumper.meta_ext
+])
+def test_truncated_file(tmp_path, raw_format, ext):
+    path = str(tmp_path / 'shot')
+    dump_shot(path, range(5), raw_format)
+
+    # 最後一張圖像或最後一筆影格資訊只寫了一半
+    os.truncate(path + ext, os.path.getsize(path + ext) - 2)
+
+    datas, _ = load_frames(path, range(5), use_index_cache=False)
+    assert datas[4] is None
+    for frame in range(4):
+        assert np.array_equal(datas[frame], make_image(frame).get_data())
+
+
+def test_empty_shot(tmp_path):
+    path = str(tmp_path / 'shot')
+    open(path + CameraShotFileDumper.image_ext, 'wb').close()
+    open(path + CameraShotFileDumper.meta_ext, 'wb').close()
+
+    datas, _ = load_frames(path, [0])
+    assert datas == [None]
+
+
+def test_index_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / 'shot')
+    index_path = path + CameraShotFileDumper.index_ext
+    dump_shot(path, [2, 0, 1])
+
+    loader = CameraShotFileLoader(path, log)
+    index = loader._index.copy()
+    loader.close()
+    assert list(index['frame']) == [0, 1, 2]
+    assert os.path.isfile(index_path)
+
+    # 直接載入快取，不重新建立索引
+    def build_index(self):
+        raise AssertionError('index rebuilt')
+
+    monkeypatch.setattr(CameraShotFileLoader, '_build_index', build_index)
+    loader = CameraShotFileLoader(path, log)
+    assert np.array_equal(loader._index, index)
+    loader.close()
+
+
+def test_index_cache_outdated(tmp_path):
+    path = str(tmp_path / 'shot')
+    index_path = path + CameraShotFileDumper.index_ext
+    dump_shot(path, [0, 1])
+    CameraShotFileLoader(path, log).close()
+
+    # 重新錄製後 4dm 比快取新
+    time.sleep(0.01)
+    dump_shot(path, [0, 1, 2])
+    past = os.path.getmtime(index_path) - 10
+    os.utime(index_path, (past, past))
+
+    datas, _ = load_frames(path, [2])
+    assert np.array_equal(datas[0], make_image(2).get_data())
+
+
+def test_index_cache_broken(tmp_path):
+    path = str(tmp_path / 'shot')
+    index_path = path + CameraShotFileDumper.index_ext
+    dump_shot(path, [0, 1])
+
+    with open(index_path, 'wb') as f:
+        f.write(b'broken')
+    datas, _ = load_frames(path, [1])
+    assert np.array_equal(datas[0], make_image(1).get_data())
+
+    # 快取指到 4dr 之外
+    index = np.load(index_path)
+    index['cursor'] += 1024
+    np.save(index_path, index)
+    datas, _ = load_frames(path, [1])
+    assert np.array_equal(datas[0], make_image(1).get_data())
+
+
+class WriteRecorder():
+    """記錄每次寫入大小的 file object"""
+
+    def __init__(self, limit=None):
+        self.data = bytearray()
+        self.writes = []
+        self._limit = limit
+
+    def tell(self):
+        return len(self.data)
+
+    def write(self, view):
+        size = len(view) if self._limit is None else min(
+            len(view), self._limit
+        )
+        self.data += view[:size]
+        self.writes.append(size)
+        return size
+
+
+def test_write_buffer_alignment():
+    file = WriteRecorder()
+    buffer = CameraShotFileBuffer(file, buffer_size=10, block_size=4)
+    for i in range(7):
+        buffer.write(bytes([i]) * 3)
+        assert buffer.tell() == (i + 1) * 3
+
+    # flush 前每次寫入都是對齊的大小
+    assert all(size % 4 == 0 for size in file.writes)
+    buffer._write(len(buffer._buffer))
+    assert bytes(file.data) == b''.join(bytes([i]) * 3 for i in range(7))
+    assert buffer.get_stats()['write_count'] == len(file.writes)
+
+
+def test_write_buffer_partial_write():
+    # 無緩衝的 file object 一次只寫入一部分
+    file = WriteRecorder(limit=3)
+    buffer = CameraShotFileBuffer(file, buffer_size=8)
+    buffer.write(np.arange(10, dtype=np.uint8))
+    buffer.write(struct.pack('>I', 7))
+    buffer._write(len(buffer._buffer))
+    assert bytes(file.data) == bytes(range(10)) + struct.pack('>I', 7)